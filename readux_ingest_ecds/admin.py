@@ -1,33 +1,111 @@
 import os
 import logging
 from django.contrib import admin
+from django.db import transaction
 from django.shortcuts import redirect
-from .models import Local
-from .tasks import local_ingest_task_ecds
+from django.urls import NoReverseMatch, reverse
+from django.utils.html import format_html
+from django.utils.html import format_html_join
+from .forms import BulkVolumeUploadForm
+from .models import Bulk, IngestReport, Local
+from .progress import describe
+from .tasks import bulk_ingest_task_ecds, local_ingest_task_ecds
 
 LOGGER = logging.getLogger(__name__)
 
 class LocalAdmin(admin.ModelAdmin):
     """Django admin ingest.models.local resource."""
-    fields = ('bundle', 'image_server', 'collections')
+    fields = ('bundle', 'bundle_path', 'image_server', 'collections', 'profile', 'reingest')
     show_save_and_add_another = False
 
     def save_model(self, request, obj, form, change):
         LOGGER.info(f'INGEST: Local ingest started by {request.user.username}')
         obj.creator = request.user
-        obj.prep()
+        # Only save the upload and a report to follow it. Reading the metadata and creating
+        # the manifest happen in the background task, so large bundles do not hold up the request.
+        obj.report = IngestReport.objects.create()
         super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Collections are saved with the related objects, so only queue the ingest after.
+        ingest_id = form.instance.id
         if os.environ["DJANGO_ENV"] != 'test': # pragma: no cover
-            local_ingest_task_ecds.apply_async(args=[obj.id])
+            transaction.on_commit(lambda: local_ingest_task_ecds.apply_async(args=[ingest_id]))
         else:
-            local_ingest_task_ecds(obj.id)
+            local_ingest_task_ecds(ingest_id)
 
     def response_add(self, request, obj, post_url_continue=None):
-        obj.refresh_from_db()
-        LOGGER.info(f'INGEST: Local ingest - {obj.id} - added for {obj.manifest.pid}')
-        return redirect('/admin/manifests/manifest/{m}/change/'.format(m=obj.manifest.pk))
+        if obj.manifest_id is not None:
+            LOGGER.info(f'INGEST: Local ingest - {obj.id} - added for {obj.manifest.pid}')
+            return redirect('/admin/manifests/manifest/{m}/change/'.format(m=obj.manifest.pk))
+        LOGGER.info(f'INGEST: Local ingest - {obj.id} - queued')
+        return redirect(reverse('admin:readux_ingest_ecds_ingestreport_change', args=[obj.report_id]))
 
     class Meta: # pylint: disable=too-few-public-methods, missing-class-docstring
         model = Local
 
+class BulkAdmin(admin.ModelAdmin):
+    """Django admin ingest.models.bulk resource."""
+    form = BulkVolumeUploadForm
+    list_display = ('id', 'created', 'started', 'finished', 'stats')
+    show_save_and_add_another = False
+
+    def save_model(self, request, obj, form, change):
+        LOGGER.info(f'INGEST: Bulk ingest started by {request.user.username}')
+        obj.creator = request.user
+        # Each uploaded file is handled by `upload_files`, not stored on the Bulk object.
+        obj.volume_files = None
+        super().save_model(request, obj, form, change)
+        obj.upload_files(request.FILES.getlist('volume_files'))
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Collections are saved with the related objects, so only queue the ingest after.
+        if os.environ["DJANGO_ENV"] != 'test': # pragma: no cover
+            bulk_ingest_task_ecds.apply_async(args=[form.instance.id])
+        else:
+            bulk_ingest_task_ecds(form.instance.id)
+
+    def response_add(self, request, obj, post_url_continue=None):
+        LOGGER.info(f'INGEST: Bulk ingest - {obj.id} - added {obj.local_uploads.count()} volumes')
+        return redirect('/admin/manifests/manifest/')
+
+    class Meta: # pylint: disable=too-few-public-methods, missing-class-docstring
+        model = Bulk
+
+class IngestReportAdmin(admin.ModelAdmin):
+    """Read only view of what was recorded about past ingests."""
+    list_display = ('id', 'manifest', 'created')
+    readonly_fields = ('manifest', 'created', 'ingest_progress', 'validation', 'profile_summaries')
+    fields = readonly_fields
+
+    def ingest_progress(self, obj):
+        # Polled by progress.js while the ingest runs, when the host app includes readux_ingest_ecds.urls.
+        try:
+            url = reverse('readux_ingest_ecds:progress', args=[obj.pk])
+        except NoReverseMatch:
+            url = ''
+        return format_html('<span class="ingest-progress" data-url="{}">{}</span>', url, describe(obj.progress))
+
+    def profile_summaries(self, obj):
+        return format_html_join(
+            '', '<h3>{}</h3><p>{}</p><pre>{}</pre>',
+            ((task, profile['file'], profile['summary']) for task, profile in obj.profiles.items())
+        )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    class Media: # pylint: disable=too-few-public-methods, missing-class-docstring
+        js = ('readux_ingest_ecds/progress.js',)
+
+    class Meta: # pylint: disable=too-few-public-methods, missing-class-docstring
+        model = IngestReport
+
 admin.site.register(Local, LocalAdmin)
+admin.site.register(Bulk, BulkAdmin)
+admin.site.register(IngestReport, IngestReportAdmin)
@@ -14,3 +14,27 @@ app = Celery('readux_ingest_ecds', result_extended=True)
 # pickle the object when using Windows.
 app.config_from_object('django.conf:settings')
 app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
+
+# Extracting bundles is disk and I/O bound, loading OCR is CPU and database bound. Each
+# has its own queue so workers for one can be scaled without the other starving it.
+# Set either setting to None to use the host app's default queue.
+INGEST_QUEUE = getattr(settings, 'INGEST_CELERY_QUEUE', 'ingest')
+OCR_QUEUE = getattr(settings, 'INGEST_CELERY_OCR_QUEUE', 'ingest_ocr')
+
+def queue_options(queue, redeliver=False):
+    """Options for the tasks on one of the ingest queues.
+
+    Tasks are acknowledged after they finish, so with a prefetch multiplier of 1 a worker
+    only reserves the task it is running and a long ingest does not hold others back.
+
+    :param queue: Name of the queue
+    :type queue: str
+    :param redeliver: Run the task again when its worker is killed, for tasks that are
+        safe to repeat, defaults to False
+    :type redeliver: bool, optional
+    :rtype: dict
+    """
+    options = {'acks_late': True, 'reject_on_worker_lost': redeliver}
+    if queue:
+        options['queue'] = queue
+    return options
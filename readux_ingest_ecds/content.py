@@ -0,0 +1,65 @@
+""" Store extracted files once per content, under their SHA-256 checksums. """
+import os
+import logging
+from shutil import copy2
+from django.conf import settings
+
+LOGGER = logging.getLogger(__name__)
+
+def content_store_enabled():
+    """Files are deduplicated when `INGEST_CONTENT_DIR` is set."""
+    return bool(getattr(settings, 'INGEST_CONTENT_DIR', None))
+
+class ContentStore:
+    """Directory of files named by their SHA-256 checksums, eg. `ab/ab12....tsv`.
+
+    The files ingests need in other places, like a canvas' OCR file or converted TIFF, are
+    hard links to the stored copy, so identical files take the space of one. The store
+    should be on the same filesystem as `INGEST_OCR_DIR` and `INGEST_CONVERTED_DIR`;
+    otherwise files are copied and only the conversion is saved.
+
+    :param directory: Overrides `INGEST_CONTENT_DIR`, defaults to None
+    :type directory: str, optional
+    """
+    def __init__(self, directory=None):
+        self.directory = directory or settings.INGEST_CONTENT_DIR
+
+    def path(self, sha256, extension):
+        """Where the content with a checksum is stored.
+
+        :param sha256: SHA-256 hex digest
+        :type sha256: str
+        :param extension: File extension, with the dot
+        :type extension: str
+        :rtype: str
+        """
+        return os.path.join(self.directory, sha256[:2], f'{sha256}{extension.lower()}')
+
+    def add(self, file_path, sha256):
+        """Store a file, or replace it with a link to the stored copy of the same content.
+
+        :param file_path: File that stays where it is, as a link to the stored content
+        :type file_path: str
+        :param sha256: SHA-256 hex digest of the file
+        :type sha256: str
+        :return: Path of the stored content and True when it was already stored
+        :rtype: tuple
+        """
+        content_path = self.path(sha256, os.path.splitext(file_path)[1])
+        if os.path.exists(content_path):
+            self.link(content_path, file_path)
+            return content_path, True
+        os.makedirs(os.path.dirname(content_path), exist_ok=True)
+        self.link(file_path, content_path)
+        return content_path, False
+
+    @staticmethod
+    def link(source, target):
+        """Make `target` the same file as `source`, replacing anything already there."""
+        partial_path = f'{target}.link'
+        try:
+            os.link(source, partial_path)
+        except OSError:
+            LOGGER.warning(f'INGEST: Could not link {target} to {source}, copying it instead')
+            copy2(source, partial_path)
+        os.replace(partial_path, target)
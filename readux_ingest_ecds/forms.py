@@ -2,10 +2,14 @@ from django import forms
 from django.forms import ClearableFileInput
 from .models import Bulk
 
+class MultipleFileInput(ClearableFileInput):
+    """File input that lets a person choose many files at once."""
+    allow_multiple_selected = True
+
 class BulkVolumeUploadForm(forms.ModelForm):
     class Meta:
         model = Bulk
         fields = ['image_server', 'volume_files', 'collections']
         widgets = {
-            'volume_files': ClearableFileInput(attrs={'allow_multiple_selected': True}),
+            'volume_files': MultipleFileInput(),
         }
@@ -1,10 +1,24 @@
 from django.conf import settings
 from django.apps import apps
 from django.core.exceptions import AppRegistryNotReady
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+_iiif_models = {}
 
 def get_iiif_models():
+   """Models from the host app set by the `IIIF_*_MODEL` settings.
+
+   The models are looked up once and reused. Until the app registry is ready, the
+   settings' "app_label.ModelName" strings are returned instead and nothing is saved.
+
+   :return: Models keyed by name
+   :rtype: dict
+   """
+   if _iiif_models:
+      return _iiif_models
    try:
-      return {
+      models = {
          'Manifest': apps.get_model(settings.IIIF_MANIFEST_MODEL),
          'ImageServer': apps.get_model(settings.IIIF_IMAGE_SERVER_MODEL),
          'RelatedLink': apps.get_model(settings.IIIF_RELATED_LINK_MODEL),
@@ -21,3 +35,11 @@ def get_iiif_models():
          'Collection': settings.IIIF_COLLECTION_MODEL,
          'OCR': settings.IIIF_OCR_MODEL,
       }
+   _iiif_models.update(models)
+   return _iiif_models
+
+@receiver(setting_changed)
+def reset_iiif_models(setting, **kwargs): # pylint: disable = unused-argument
+   """Look the models up again when the settings that name them change, eg. in tests."""
+   if setting.startswith('IIIF_'):
+      _iiif_models.clear()
@@ -0,0 +1,21 @@
+""" Show and clean up the scratch space used by ingests. """
+import json
+from django.core.management.base import BaseCommand
+from readux_ingest_ecds.scratch import ScratchSpace
+
+class Command(BaseCommand):
+    help = 'Show disk used by ingests, or remove the images of manifests whose conversion has finished.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--converted', nargs='+', metavar='PID', default=[],
+            help='Remove the images waiting in INGEST_PROCESSING_DIR for these manifests.'
+        )
+
+    def handle(self, *args, **options):
+        scratch = ScratchSpace()
+        for pid in options['converted']:
+            removed = scratch.remove_processing_files(pid)
+            self.stdout.write(f'Removed {removed} images for {pid}')
+
+        self.stdout.write(json.dumps(scratch.usage(), indent=2))
@@ -0,0 +1,37 @@
+""" Check bundles before ingesting them. """
+import json
+from django.core.management.base import BaseCommand, CommandError
+from readux_ingest_ecds.services.validation_services import validate_bundle
+
+class Command(BaseCommand):
+    help = 'Check the images and OCR in bundles without ingesting them or touching the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('bundles', nargs='+', metavar='BUNDLE', help='ZIP, tar file or directory to check.')
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Processes that check files at the same time. Defaults to INGEST_VALIDATION_WORKERS or one per CPU.'
+        )
+        parser.add_argument('--fail-fast', action='store_true', help='Stop checking a bundle at its first problem.')
+        parser.add_argument('--json', action='store_true', help='Print the reports as JSON.')
+
+    def handle(self, *args, **options):
+        reports = [
+            validate_bundle(bundle, workers=options['workers'], fail_fast=options['fail_fast'])
+            for bundle in options['bundles']
+        ]
+        if options['json']:
+            self.stdout.write(json.dumps([report.as_dict() for report in reports], indent=2))
+        else:
+            for report in reports:
+                self.stdout.write(
+                    f'{report.bundle}: {report.images} images, {report.ocr_files} OCR files, {report.words} words'
+                )
+                for problem in report.problems:
+                    self.stdout.write(f'  {problem["file"]}: {problem["error"]}')
+                for warning in report.warnings:
+                    self.stdout.write(f'  {warning["file"]}: warning: {warning["warning"]}')
+
+        invalid = [report.bundle for report in reports if not report.valid]
+        if invalid:
+            raise CommandError(f'{len(invalid)} of {len(reports)} bundles have problems: {", ".join(invalid)}')
@@ -0,0 +1,122 @@
+""" Track memory used by the stages of an ingest and enforce a budget. """
+import os
+import resource
+import tracemalloc
+from contextlib import contextmanager
+from django.conf import settings
+
+MB = 1024 * 1024
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when an ingest uses more memory than `INGEST_MEMORY_BUDGET` allows."""
+    pass # pylint: disable=unnecessary-pass
+
+def current_rss():
+    """Resident set size of this process in bytes.
+
+    :return: Current RSS or, where /proc is not available, the peak RSS.
+    :rtype: int
+    """
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+def peak_rss():
+    """Highest resident set size of this process so far, in bytes."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    return max_rss if os.uname().sysname == 'Darwin' else max_rss * 1024
+
+class MemoryTracker:
+    """Sample memory for each stage of an ingest.
+
+    RSS is sampled at the start and end of every stage. A stage's peak also counts
+    the process' high-water mark if it was raised during the stage. When
+    `INGEST_TRACEMALLOC` is True, the peak of Python allocations is recorded too.
+    That is more precise but slows the ingest down.
+
+    :param task: Name of the task, used in error messages.
+    :type task: str
+    """
+    def __init__(self, task='ingest'):
+        self.task = task
+        budget = getattr(settings, 'INGEST_MEMORY_BUDGET', None)
+        self.budget = int(budget * MB) if budget else None
+        self.soft_limit = int(self.budget * getattr(settings, 'INGEST_MEMORY_SOFT_LIMIT', 0.8)) if budget else None
+        self.trace = getattr(settings, 'INGEST_TRACEMALLOC', False)
+        self.stages = {}
+        self._open_stages = []
+        self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name):
+        """Record memory used while the enclosed code runs.
+
+        :param name: Name of the stage
+        :type name: str
+        """
+        sample = {'rss_start': current_rss(), 'max_rss_start': peak_rss(), 'traced_peak': 0}
+        if self.trace:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            self._update_traced_peaks()
+            if hasattr(tracemalloc, 'reset_peak'): # Python >= 3.9
+                tracemalloc.reset_peak()
+        self._open_stages.append(sample)
+        try:
+            yield self
+        finally:
+            if self.trace:
+                self._update_traced_peaks()
+            self._open_stages.pop()
+            self._record(name, sample)
+            if self._started_tracing and not self._open_stages:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    def _update_traced_peaks(self):
+        # Resetting the peak for a nested stage would lose the peak of the stages
+        # around it, so push the current peak out to all open stages first.
+        peak = tracemalloc.get_traced_memory()[1]
+        for sample in self._open_stages:
+            sample['traced_peak'] = max(sample['traced_peak'], peak)
+
+    def _record(self, name, sample):
+        rss_end = current_rss()
+        max_rss_end = peak_rss()
+        rss_peak = max(sample['rss_start'], rss_end)
+        if max_rss_end > sample['max_rss_start']:
+            rss_peak = max(rss_peak, max_rss_end)
+
+        previous = self.stages.get(name, {})
+        self.stages[name] = {
+            'rss_start': previous.get('rss_start', sample['rss_start']),
+            'rss_end': rss_end,
+            'rss_peak': max(previous.get('rss_peak', 0), rss_peak),
+        }
+        if self.trace:
+            self.stages[name]['tracemalloc_peak'] = max(
+                previous.get('tracemalloc_peak', 0), sample['traced_peak']
+            )
+
+    def check(self, stage=None):
+        """Compare current RSS to the budget.
+
+        :param stage: Name of the current stage for the error message, defaults to None
+        :type stage: str, optional
+        :raises MemoryBudgetExceeded: When RSS is over `INGEST_MEMORY_BUDGET`.
+        :return: True when RSS is over the soft limit and work should be done in smaller batches.
+        :rtype: bool
+        """
+        if self.budget is None:
+            return False
+        rss = current_rss()
+        if rss >= self.budget:
+            raise MemoryBudgetExceeded(
+                f'INGEST: {self.task} stopped{f" during {stage}" if stage else ""}: '
+                f'using {rss / MB:.0f} MB, over the INGEST_MEMORY_BUDGET of {self.budget / MB:.0f} MB.'
+            )
+        return rss >= self.soft_limit
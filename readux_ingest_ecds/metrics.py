@@ -0,0 +1,180 @@
+""" Timing and counters for the stages of an ingest. """
+import json
+import logging
+import os
+import socket
+import tempfile
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from time import perf_counter
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from .memory import MemoryTracker
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SINKS = ['readux_ingest_ecds.metrics.LogSink']
+
+class IngestMetrics:
+    """Collects stage timings, counts and memory use for one ingest or OCR task.
+
+    Timings for a stage that runs more than once, eg. fetching OCR for each canvas,
+    are added together.
+
+    :param tags: Values that identify the ingest, eg. task and manifest pid.
+    :type tags: dict
+    """
+    def __init__(self, **tags):
+        self.tags = tags
+        self.timings = {}
+        self.counts = {}
+        self.memory = MemoryTracker(task=tags.get('task', 'ingest'))
+
+    @contextmanager
+    def stage(self, name):
+        """Time a stage of the ingest.
+
+        :param name: Name of the stage
+        :type name: str
+        """
+        start = perf_counter()
+        try:
+            with self.memory.stage(name):
+                yield self
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + perf_counter() - start
+
+    @contextmanager
+    def statements(self, name='statements'):
+        """Count the SQL statements run by the enclosed code.
+
+        :param name: Name of the counter, defaults to 'statements'
+        :type name: str, optional
+        """
+        def count(execute, sql, params, many, context):
+            self.incr(name)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            yield self
+
+    def incr(self, name, value=1):
+        """Add to a counter, eg. pages, words, or bytes.
+
+        :param name: Name of counter
+        :type name: str
+        :param value: Amount to add, defaults to 1
+        :type value: int, optional
+        """
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def as_dict(self):
+        return {
+            'tags': dict(self.tags),
+            'timings': {stage: round(seconds, 6) for stage, seconds in self.timings.items()},
+            'counts': dict(self.counts),
+        }
+
+    def flush(self):
+        """Send everything collected to the configured sinks and start over."""
+        if not self.timings and not self.counts:
+            return
+        for sink in get_sinks():
+            try:
+                sink.emit(self)
+            except Exception as error: # pylint: disable = broad-except
+                # Never fail an ingest because metrics could not be sent.
+                LOGGER.warning(f'INGEST: Metrics sink {sink.__class__.__name__} failed: {error}')
+        self.timings = {}
+        self.counts = {}
+
+def timed(metrics, stage):
+    """Time a stage when there is somewhere to record it.
+
+    :param metrics: Metrics for the current ingest or None
+    :type metrics: IngestMetrics, None
+    :param stage: Name of the stage
+    :type stage: str
+    :return: Context manager
+    """
+    if metrics is None:
+        return nullcontext()
+    return metrics.stage(stage)
+
+class MetricsSink:
+    """Base class for places to send metrics. Subclasses implement `emit`."""
+    def emit(self, metrics):
+        raise NotImplementedError
+
+class LogSink(MetricsSink):
+    """Write metrics as one JSON log line."""
+    def emit(self, metrics):
+        LOGGER.info(f'INGEST: Metrics {json.dumps(metrics.as_dict(), default=str)}')
+
+class StatsdSink(MetricsSink):
+    """Send metrics as StatsD timers and counters over UDP.
+
+    Uses the `INGEST_STATSD_HOST`, `INGEST_STATSD_PORT` and `INGEST_STATSD_PREFIX` settings.
+    """
+    def __init__(self):
+        self.address = (
+            getattr(settings, 'INGEST_STATSD_HOST', 'localhost'),
+            int(getattr(settings, 'INGEST_STATSD_PORT', 8125))
+        )
+        self.prefix = getattr(settings, 'INGEST_STATSD_PREFIX', 'readux.ingest')
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def lines(self, metrics):
+        task = metrics.tags.get('task', 'ingest')
+        for stage, seconds in metrics.timings.items():
+            yield f'{self.prefix}.{task}.{stage}:{seconds * 1000:.3f}|ms'
+        for name, value in metrics.counts.items():
+            yield f'{self.prefix}.{task}.{name}:{value}|c'
+
+    def emit(self, metrics):
+        self.socket.sendto('\n'.join(self.lines(metrics)).encode('utf-8'), self.address)
+
+class PrometheusFileSink(MetricsSink):
+    """Write the latest metrics to a file for node_exporter's textfile collector.
+
+    Uses the `INGEST_PROMETHEUS_FILE` setting.
+    """
+    def __init__(self):
+        self.path = settings.INGEST_PROMETHEUS_FILE
+
+    def lines(self, metrics):
+        task = metrics.tags.get('task', 'ingest')
+        yield '# TYPE readux_ingest_stage_seconds gauge'
+        for stage, seconds in metrics.timings.items():
+            yield f'readux_ingest_stage_seconds{{task="{task}",stage="{stage}"}} {seconds:.6f}'
+        yield '# TYPE readux_ingest_count gauge'
+        for name, value in metrics.counts.items():
+            yield f'readux_ingest_count{{task="{task}",name="{name}"}} {value}'
+
+    def emit(self, metrics):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        # Write then rename so the collector never reads a partial file.
+        with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as prom_file:
+            prom_file.write('\n'.join(self.lines(metrics)) + '\n')
+        os.replace(prom_file.name, self.path)
+
+@lru_cache(maxsize=None)
+def get_sinks():
+    """Instances of the sinks listed in the `INGEST_METRICS_SINKS` setting.
+
+    :return: Sinks to send metrics to
+    :rtype: tuple
+    """
+    return tuple(
+        import_string(sink)() for sink in getattr(settings, 'INGEST_METRICS_SINKS', DEFAULT_SINKS)
+    )
+
+@receiver(setting_changed)
+def reset_sinks(setting, **kwargs): # pylint: disable = unused-argument
+    """Rebuild the sinks when the settings they read change, eg. in tests."""
+    if setting.startswith('INGEST_'):
+        get_sinks.cache_clear()
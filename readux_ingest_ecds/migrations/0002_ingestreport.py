@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+Manifest = settings.IIIF_MANIFEST_MODEL
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readux_ingest_ecds', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='local',
+            name='profile',
+            field=models.BooleanField(default=False, help_text='Optional: Profile the ingest and OCR tasks and save the results to an ingest report.'),
+        ),
+        migrations.CreateModel(
+            name='IngestReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('profiles', models.JSONField(blank=True, default=dict)),
+                ('manifest', models.ForeignKey(null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='ecds_ingest_reports', to=Manifest)),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+        migrations.AddField(
+            model_name='local',
+            name='report',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='local', to='readux_ingest_ecds.ingestreport'),
+        ),
+    ]
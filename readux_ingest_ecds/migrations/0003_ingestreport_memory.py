@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readux_ingest_ecds', '0002_ingestreport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestreport',
+            name='memory',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
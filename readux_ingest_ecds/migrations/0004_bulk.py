@@ -0,0 +1,51 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:18
+
+from django.conf import settings
+import django.core.files.storage
+from django.db import migrations, models
+import django.db.models.deletion
+
+ImageServer = settings.IIIF_IMAGE_SERVER_MODEL
+Collection = settings.IIIF_COLLECTION_MODEL
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('readux_ingest_ecds', '0003_ingestreport_memory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='local',
+            name='bundle_from_bulk',
+            field=models.FileField(blank=True, null=True, storage=django.core.files.storage.FileSystemStorage(location='tmp'), upload_to=''),
+        ),
+        migrations.CreateModel(
+            name='Bulk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('volume_files', models.FileField(blank=True, help_text='Bundles for each volume, or one ZIP of bundles, and an optional metadata spreadsheet.', null=True, storage=django.core.files.storage.FileSystemStorage(location='tmp'), upload_to='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('stats', models.JSONField(blank=True, default=dict)),
+                ('collections', models.ManyToManyField(blank=True, help_text='Optional: Collections to attach to the volumes ingested in this form.', related_name='ecds_ingest_bulk_collections', to=Collection)),
+                ('creator', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ecds_ingest_created_bulks', to=settings.AUTH_USER_MODEL)),
+                ('image_server', models.ForeignKey(null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='ecds_ingest_bulk_image_server', to=ImageServer)),
+            ],
+            options={
+                'verbose_name_plural': 'Bulk',
+            },
+        ),
+        migrations.AddField(
+            model_name='ingestreport',
+            name='bulk',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reports', to='readux_ingest_ecds.bulk'),
+        ),
+        migrations.AddField(
+            model_name='local',
+            name='bulk',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='local_uploads', to='readux_ingest_ecds.bulk'),
+        ),
+    ]
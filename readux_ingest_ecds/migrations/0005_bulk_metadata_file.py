@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:55
+
+import django.core.files.storage
+from django.db import migrations, models
+import readux_ingest_ecds.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readux_ingest_ecds', '0004_bulk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulk',
+            name='metadata_file',
+            field=models.FileField(blank=True, null=True, storage=django.core.files.storage.FileSystemStorage(location='tmp'), upload_to=readux_ingest_ecds.models.bulk_upload_path),
+        ),
+        migrations.AlterField(
+            model_name='local',
+            name='bundle_from_bulk',
+            field=models.FileField(blank=True, null=True, storage=django.core.files.storage.FileSystemStorage(location='tmp'), upload_to=readux_ingest_ecds.models.bulk_upload_path),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:39
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+Canvas = settings.IIIF_CANVAS_MODEL
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(Canvas),
+        ('readux_ingest_ecds', '0005_bulk_metadata_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='local',
+            name='reingest',
+            field=models.BooleanField(default=False, help_text='Optional: Skip images that have not changed since this volume was last ingested.'),
+        ),
+        migrations.CreateModel(
+            name='CanvasChecksum',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64)),
+                ('crc32', models.PositiveBigIntegerField()),
+                ('size', models.PositiveBigIntegerField()),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('canvas', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='ecds_checksum', to=Canvas)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readux_ingest_ecds', '0006_canvaschecksum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestreport',
+            name='progress',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:48
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+Canvas = settings.IIIF_CANVAS_MODEL
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(Canvas),
+        ('readux_ingest_ecds', '0007_ingestreport_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentObject',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('image', 'image'), ('ocr', 'ocr')], max_length=5)),
+                ('size', models.PositiveBigIntegerField()),
+                ('path', models.CharField(max_length=500)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CanvasContent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('image', 'image'), ('ocr', 'ocr')], max_length=5)),
+                ('canvas', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ecds_contents', to=Canvas)),
+                ('content', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='canvases', to='readux_ingest_ecds.contentobject')),
+            ],
+            options={
+                'unique_together': {('canvas', 'kind')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-19 13:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readux_ingest_ecds', '0008_contentobject'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='local',
+            name='bundle_path',
+            field=models.CharField(blank=True, default='', help_text='Optional: Instead of uploading, the path of a bundle directory, ZIP or tar file under INGEST_BUNDLE_ROOT on the server.', max_length=1000),
+        ),
+        migrations.AlterField(
+            model_name='canvaschecksum',
+            name='crc32',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 14:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readux_ingest_ecds', '0009_local_bundle_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestreport',
+            name='validation',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -1,17 +1,32 @@
 import os
 import logging
-from zipfile import ZipFile
+from tempfile import TemporaryDirectory
+from zipfile import ZipFile, is_zipfile
+from django.core.exceptions import ValidationError
+from django.core.files.base import File
 from django.core.files.storage import FileSystemStorage
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
-from .services.file_services import is_image, is_ocr, is_junk, move_image_file, move_ocr_file, canvas_dimensions, upload_trigger_file
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .services.bundles import TarBundle, open_bundle
+from .services.file_services import is_image, is_ocr, is_junk, is_bundle_file, move_image_file, move_ocr_file, canvas_dimensions, upload_trigger_file, IngestFiles, \
+    extract_member, ingest_file_name, member_checksum
 from .services.iiif_services import create_manifest
-from .services.metadata_services import metadata_from_file
+from .services.image_services import Derivatives, convert_images, converted_directory, local_conversion, tiff_path
+from .services.validation_services import InvalidBundle, validate_bundle
+from .services.metadata_services import load_metadata_sheet, metadata_file_format, metadata_from_file
 from .helpers import get_iiif_models
+from .content import ContentStore, content_store_enabled
+from .metrics import IngestMetrics
+from .progress import Progress
+from .scratch import ScratchSpace, cleanup_enabled
+from .transactions import TransactionBatches
 
 Manifest = get_iiif_models()['Manifest']
 ImageServer = get_iiif_models()['ImageServer']
 Collection = get_iiif_models()['Collection']
+Canvas = get_iiif_models()['Canvas']
 
 LOGGER = logging.getLogger(__name__)
 
@@ -19,6 +34,13 @@ tmp_storage = FileSystemStorage(
     location=settings.INGEST_TMP_DIR
 )
 
+def bulk_upload_path(instance, filename):
+    """Keep the files for each bulk ingest together so the bundles keep their names."""
+    bulk_id = instance.pk if isinstance(instance, Bulk) else instance.bulk_id
+    if bulk_id is None:
+        return filename
+    return os.path.join('bulk', str(bulk_id), filename)
+
 class IngestAbstractModel(models.Model):
     metadata = models.JSONField(default=dict, blank=True)
     manifest = models.ForeignKey(
@@ -49,22 +71,329 @@ class IngestAbstractModel(models.Model):
     class Meta: # pylint: disable=too-few-public-methods, missing-class-docstring
         abstract = True
 
+class Bulk(models.Model):
+    """Ingest many volumes at once. Each bundle becomes a :class:`Local` ingest."""
+    image_server = models.ForeignKey(
+        ImageServer,
+        on_delete=models.DO_NOTHING,
+        null=True,
+        related_name='ecds_ingest_bulk_image_server'
+    )
+    creator = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='ecds_ingest_created_bulks'
+    )
+    collections = models.ManyToManyField(
+        Collection,
+        blank=True,
+        help_text="Optional: Collections to attach to the volumes ingested in this form.",
+        related_name='ecds_ingest_bulk_collections'
+    )
+    volume_files = models.FileField(
+        null=True,
+        blank=True,
+        storage=tmp_storage,
+        help_text="Bundles for each volume, or one ZIP of bundles, and an optional metadata spreadsheet."
+    )
+    metadata_file = models.FileField(
+        null=True,
+        blank=True,
+        storage=tmp_storage,
+        upload_to=bulk_upload_path
+    )
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    stats = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'Bulk'
+
+    def upload_files(self, files):
+        """Create a :class:`Local` ingest for each uploaded ZIP.
+
+        A metadata spreadsheet can be uploaded along with the bundles or included in
+        a ZIP of bundles. It is saved once for the whole batch. Each upload is saved as
+        it is; a ZIP of bundles is unpacked by `unpack_archives` in the bulk ingest task,
+        so the upload request does not read and save every bundle in it again.
+
+        :param files: Uploaded files
+        :type files: list
+        :return: New Local ingests
+        :rtype: list
+        """
+        files = [file for file in files if not is_junk(os.path.basename(file.name))]
+        archives = [file for file in files if self._is_zip(file)]
+        sheets = [file for file in files if file not in archives and metadata_file_format(file.name) is not None]
+        if sheets:
+            self.metadata_file.save(os.path.basename(sheets[0].name), sheets[0])
+        return [self.add_bundle(os.path.basename(archive.name), archive) for archive in archives]
+
+    def unpack_archives(self):
+        """Replace each ingest whose upload is a ZIP of bundles with an ingest for each
+        bundle in it, and keep a metadata spreadsheet found with them when the batch has none.
+
+        An archive's new ingests and the removal of its own are saved together, so a
+        redelivered bulk ingest task does not unpack it twice.
+
+        :return: Number of archives unpacked
+        :rtype: int
+        """
+        unpacked = 0
+        for local in self.local_uploads.order_by('pk'):
+            with local.bundle_file.open('rb') as archive, ZipFile(archive, 'r') as zip_ref:
+                members = [
+                    member for member in zip_ref.infolist()
+                    if not is_junk(os.path.basename(member.filename))
+                ]
+                bundles = [member for member in members if member.filename.casefold().endswith('.zip')]
+                if not bundles:
+                    continue
+
+                with transaction.atomic():
+                    if not self.metadata_file:
+                        for member in members:
+                            if member not in bundles and metadata_file_format(member.filename) is not None:
+                                with zip_ref.open(member) as sheet:
+                                    self.metadata_file.save(os.path.basename(member.filename), File(sheet))
+                                break
+
+                    for member in bundles:
+                        with zip_ref.open(member) as bundle:
+                            self.add_bundle(os.path.basename(member.filename), File(bundle))
+                    local.delete()
+            local.bundle_file.delete(save=False)
+            unpacked += 1
+        return unpacked
+
+    def add_bundle(self, name, content):
+        """Save a bundle to a new :class:`Local` ingest.
+
+        :param name: File name of the bundle
+        :type name: str
+        :param content: The bundle
+        :type content: django.core.files.File
+        :return: New Local ingest
+        :rtype: Local
+        """
+        local = Local.objects.create(
+            bulk=self,
+            image_server=self.image_server,
+            creator=self.creator
+        )
+        local.bundle_from_bulk.save(name, content)
+        return local
+
+    def metadata_for(self, bundle_name):
+        """Find the row of the batch's metadata spreadsheet for a bundle.
+
+        :param bundle_name: File name of the bundle
+        :type bundle_name: str
+        :return: Cleaned metadata for the bundle or an empty dict
+        :rtype: dict
+        """
+        if not self.metadata_file:
+            return {}
+        return load_metadata_sheet(self.metadata_file.path).get(bundle_name)
+
+    @staticmethod
+    def _is_zip(file):
+        is_zip = is_zipfile(file)
+        file.seek(0)
+        return is_zip
+
+    def finish(self, failed=None):
+        """Record throughput once every volume has been ingested.
+
+        :param failed: Primary keys of Local ingests that failed, defaults to None
+        :type failed: list, optional
+        :return: Aggregate stats for the bulk ingest
+        :rtype: dict
+        """
+        Canvas = get_iiif_models()['Canvas']
+        self.finished = timezone.now()
+        seconds = max((self.finished - (self.started or self.created)).total_seconds(), 0.001)
+        manifests = self.reports.exclude(manifest=None).values('manifest')
+        volumes = manifests.count()
+        pages = Canvas.objects.filter(manifest__in=manifests).count()
+        self.stats = {
+            'volumes': volumes,
+            'failed': failed or [],
+            'pages': pages,
+            'seconds': round(seconds, 3),
+            'volumes_per_hour': round(volumes / seconds * 3600, 2),
+            'pages_per_second': round(pages / seconds, 2),
+        }
+        self.save()
+
+        metrics = IngestMetrics(task='bulk_ingest', bulk=self.pk)
+        metrics.timings['bulk_ingest'] = seconds
+        metrics.incr('volumes', volumes)
+        metrics.incr('pages', pages)
+        metrics.flush()
+        LOGGER.info(f'INGEST: Bulk ingest - {self.pk} - finished {self.stats}')
+        return self.stats
+
+class IngestReport(models.Model):
+    """What was recorded about an ingest. Kept after the ingest object is deleted."""
+    manifest = models.ForeignKey(
+        Manifest,
+        on_delete=models.DO_NOTHING,
+        null=True,
+        related_name='ecds_ingest_reports'
+    )
+    bulk = models.ForeignKey(
+        Bulk,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='reports'
+    )
+    created = models.DateTimeField(auto_now_add=True)
+    profiles = models.JSONField(default=dict, blank=True)
+    memory = models.JSONField(default=dict, blank=True)
+    progress = models.JSONField(default=dict, blank=True)
+    validation = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ['-created']
+
+    def __str__(self):
+        return f'Ingest report {self.pk} for {self.manifest_id}'
+
+    def record_memory(self, task, tracker):
+        """Save the memory used by each stage of a task.
+
+        :param task: Name of the task
+        :type task: str
+        :param tracker: Tracker used during the task
+        :type tracker: readux_ingest_ecds.memory.MemoryTracker
+        """
+        self.memory[task] = dict(tracker.stages)
+        self.save(update_fields=['memory'])
+
+class CanvasChecksum(models.Model):
+    """Fingerprint of the image a canvas was created from, used to skip unchanged images
+    when a volume is ingested again."""
+    canvas = models.OneToOneField(
+        Canvas,
+        on_delete=models.CASCADE,
+        related_name='ecds_checksum'
+    )
+    sha256 = models.CharField(max_length=64)
+    crc32 = models.PositiveBigIntegerField(null=True, blank=True)
+    size = models.PositiveBigIntegerField()
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.canvas.pid} {self.sha256}'
+
+    def matches(self, bundle, member, sha256=None):
+        """Check if a file in a bundle is the image this checksum was taken from. The size,
+        and the CRC-32 stored in a ZIP, are compared first, so only files that could be the
+        same are read and hashed.
+
+        :param bundle: Open bundle
+        :type bundle: readux_ingest_ecds.services.bundles.Bundle
+        :param member: Image in the bundle
+        :type member: readux_ingest_ecds.services.bundles.BundleMember
+        :param sha256: Digest already taken as the file was extracted, defaults to None to read the file
+        :type sha256: str, optional
+        :rtype: bool
+        """
+        if self.size != member.file_size or member.crc not in (None, self.crc32):
+            return False
+        return self.sha256 == (sha256 or member_checksum(bundle, member))
+
+class ContentObject(models.Model):
+    """A file kept once in the content store, however many canvases use it."""
+    IMAGE = 'image'
+    OCR = 'ocr'
+    KINDS = (
+        (IMAGE, 'image'),
+        (OCR, 'ocr')
+    )
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    kind = models.CharField(max_length=5, choices=KINDS)
+    size = models.PositiveBigIntegerField()
+    path = models.CharField(max_length=500)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.kind} {self.sha256}'
+
+class CanvasContent(models.Model):
+    """Which stored image and OCR file each canvas uses."""
+    canvas = models.ForeignKey(
+        Canvas,
+        on_delete=models.CASCADE,
+        related_name='ecds_contents'
+    )
+    content = models.ForeignKey(
+        ContentObject,
+        on_delete=models.CASCADE,
+        related_name='canvases'
+    )
+    kind = models.CharField(max_length=5, choices=ContentObject.KINDS)
+
+    class Meta:
+        unique_together = ('canvas', 'kind')
+
 class Local(IngestAbstractModel):
     bundle = models.FileField(
         null=True,
         blank=True,
         storage=tmp_storage
     )
+    bundle_from_bulk = models.FileField(
+        null=True,
+        blank=True,
+        storage=tmp_storage,
+        upload_to=bulk_upload_path
+    )
+    bulk = models.ForeignKey(
+        Bulk,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='local_uploads'
+    )
+    profile = models.BooleanField(
+        default=False,
+        help_text="Optional: Profile the ingest and OCR tasks and save the results to an ingest report."
+    )
+    bundle_path = models.CharField(
+        max_length=1000,
+        blank=True,
+        default='',
+        help_text="Optional: Instead of uploading, the path of a bundle directory, ZIP or tar file under INGEST_BUNDLE_ROOT on the server."
+    )
+    reingest = models.BooleanField(
+        default=False,
+        help_text="Optional: Skip images that have not changed since this volume was last ingested."
+    )
+    report = models.OneToOneField(
+        IngestReport,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='local'
+    )
 
     class Meta:
         verbose_name_plural = 'Local'
 
-    @property
-    def tmp_directory(self):
-        return os.path.join(
-            settings.INGEST_TMP_DIR,
-            self.manifest.pid
-        )
+    def working_directory(self):
+        """Scratch directory for this ingest alone, removed with everything in it when the
+        block exits. Bundles often share inner paths like `images/0001.jpg`, so ingests
+        running at the same time cannot extract into the same directory.
+
+        :rtype: tempfile.TemporaryDirectory
+        """
+        os.makedirs(settings.INGEST_TMP_DIR, exist_ok=True)
+        return TemporaryDirectory(dir=settings.INGEST_TMP_DIR, prefix=f'ingest-{self.pk or "new"}-')
 
     @property
     def ocr_directory(self):
@@ -72,10 +401,112 @@ class Local(IngestAbstractModel):
         os.makedirs(target_directory, exist_ok=True)
         return target_directory
 
+    @property
+    def bundle_file(self):
+        """The bundle uploaded directly or as part of a bulk ingest."""
+        return self.bundle if self.bundle else self.bundle_from_bulk
+
+    @property
+    def bundle_source(self):
+        """The bundle's path on the server, or the uploaded bundle."""
+        return self.bundle_path or self.bundle_file
+
+    @property
+    def bundle_name(self):
+        """File or directory name of the bundle, as listed in a bulk ingest's metadata."""
+        return os.path.basename(os.path.normpath(self.bundle_path)) if self.bundle_path else os.path.basename(self.bundle_file.name)
+
+    def clean(self):
+        """Check there is a bundle to ingest and that a path on the server is under `INGEST_BUNDLE_ROOT`.
+
+        :raises ValidationError: When there is no bundle or the path is not allowed
+        """
+        if not self.bundle_path:
+            if not self.bundle and not self.bundle_from_bulk:
+                raise ValidationError({'bundle': 'Upload a bundle or enter the path of one on the server.'})
+            return
+        root = getattr(settings, 'INGEST_BUNDLE_ROOT', None)
+        if root is None:
+            raise ValidationError({'bundle_path': 'Set INGEST_BUNDLE_ROOT to ingest bundles from the server.'})
+        path = os.path.realpath(self.bundle_path)
+        if os.path.commonpath([path, os.path.realpath(root)]) != os.path.realpath(root):
+            raise ValidationError({'bundle_path': f'Bundles must be under {root}.'})
+        if not os.path.exists(path):
+            raise ValidationError({'bundle_path': f'{self.bundle_path} does not exist.'})
+
+    @cached_property
+    def files(self):
+        """Images and OCR files for this ingest's manifest, by page name."""
+        return IngestFiles.from_disk(self.manifest.pid, self.ocr_directory)
+
+    @cached_property
+    def checksums(self):
+        """Checksums of the images this manifest's canvases were created from, by canvas pid."""
+        return {
+            checksum.canvas.pid: checksum
+            for checksum in CanvasChecksum.objects.filter(canvas__manifest=self.manifest).select_related('canvas')
+        }
+
+    @cached_property
+    def new_checksums(self):
+        """Checksums of the images extracted by this ingest, by canvas pid."""
+        return {}
+
+    @cached_property
+    def stored_content(self):
+        """Content stored by this ingest, by the absolute path of the extracted file."""
+        return {}
+
+    @cached_property
+    def canvas_files(self):
+        """Canvas pid, image path and OCR file path of each canvas this ingest saved."""
+        return []
+
+    @cached_property
+    def unchanged_images(self):
+        """File names of images skipped because they have not changed."""
+        return []
+
     @property
     def trigger_file(self):
         return os.path.join(settings.INGEST_TMP_DIR, f'{self.manifest.pid}.txt')
 
+    def get_report(self):
+        """Report for this ingest, created the first time it is needed.
+
+        :return: Report that outlives this ingest
+        :rtype: IngestReport
+        """
+        if self.report is None:
+            self.report = IngestReport.objects.create(manifest=self.manifest, bulk=self.bulk)
+            self.save()
+        return self.report
+
+    @cached_property
+    def metrics(self):
+        return IngestMetrics(task='local_ingest', ingest=self.pk)
+
+    @cached_property
+    def progress(self):
+        return Progress(self.report, 'local_ingest')
+
+    def validate(self):
+        """Check the bundle's images and OCR before anything is extracted or saved, and
+        record what was found on the report.
+
+        :raises InvalidBundle: When the bundle has problems
+        """
+        with self.metrics.stage('validate'):
+            report = validate_bundle(self.bundle_source, fail_fast=getattr(settings, 'INGEST_VALIDATION_FAIL_FAST', False))
+        ingest_report = self.get_report()
+        ingest_report.validation = report.as_dict()
+        ingest_report.save(update_fields=['validation'])
+        if not report.valid:
+            raise InvalidBundle(
+                f'INGEST: {report.bundle} has {len(report.problems)} problems: '
+                + '; '.join(f'{problem["file"]}: {problem["error"]}' for problem in report.problems[:10])
+            )
+
     def prep(self):
         """
         Open metadata
@@ -83,111 +514,311 @@ class Local(IngestAbstractModel):
         Unzip bundle
         """
         LOGGER.info(f'INGEST: Local ingest - preparing new local ingest')
-        os.makedirs(settings.INGEST_TMP_DIR, exist_ok=True)
-        os.makedirs(settings.INGEST_PROCESSING_DIR, exist_ok=True)
-        os.makedirs(settings.INGEST_OCR_DIR, exist_ok=True)
-        self.save()
-        self.open_metadata()
-        self.manifest = create_manifest(self)
-        self.save()
+        with self.metrics.stage('prep'), self.metrics.statements('prep_statements'):
+            os.makedirs(settings.INGEST_TMP_DIR, exist_ok=True)
+            os.makedirs(settings.INGEST_PROCESSING_DIR, exist_ok=True)
+            os.makedirs(settings.INGEST_OCR_DIR, exist_ok=True)
+            # One transaction so the manifest, report and ingest are saved together.
+            with transaction.atomic():
+                self.open_metadata()
+                with self.metrics.stage('create_manifest'):
+                    self.manifest = create_manifest(self)
+                if self.report is None:
+                    self.report = IngestReport.objects.create(manifest=self.manifest, bulk=self.bulk)
+                elif self.report.manifest_id is None:
+                    # The admin saves a report before the manifest exists.
+                    self.report.manifest = self.manifest
+                    self.report.save(update_fields=['manifest'])
+                self.save()
+        self.metrics.tags.update(ingest=self.pk, manifest=self.manifest.pid)
+        self.get_report().record_memory('prep', self.metrics.memory)
+        self.metrics.flush()
 
     def ingest(self):
         LOGGER.info(f'INGEST: Local ingest - {self.id} - saved for {self.manifest.pid}')
-        self.unzip_bundle()
-        self.create_canvases()
+        self.metrics.tags.update(manifest=self.manifest.pid)
+        if local_conversion():
+            # Fail before extracting anything when conversion is not set up.
+            converted_directory()
+        with self.metrics.stage('ingest'):
+            self.unzip_bundle()
+            self.create_canvases()
         LOGGER.info(f'INGEST: Local ingest - {self.id} - finished for {self.manifest.pid}')
+        self.get_report().record_memory('ingest', self.metrics.memory)
+        self.metrics.flush()
+        if cleanup_enabled():
+            # The images have been handed off for conversion and every file in the bundle extracted.
+            # Bundles on the server are left where they are.
+            os.remove(self.trigger_file)
+            if self.bundle_file:
+                self.bundle_file.delete(save=False)
         self.delete()
 
     def unzip_bundle(self):
-        open(self.trigger_file, 'a').close()
-
-        with ZipFile(self.bundle, 'r') as zip_ref:
-            for member in zip_ref.infolist():
-                file_name = member.filename
-
-                if is_junk(os.path.basename(file_name)):
-                    continue
-
-                file_path = os.path.join(
-                    settings.INGEST_TMP_DIR,
-                    file_name
-                )
-
-                if is_image(file_name):
-                    zip_ref.extract(
-                        member=member,
-                        path=settings.INGEST_TMP_DIR
-                    )
-
-                    file_to_process = move_image_file(self, file_path)
-                    with open(self.trigger_file, 'a') as t_file:
-                        t_file.write(f'{file_to_process}\n')
-
-                elif is_ocr(file_name):
-                    zip_ref.extract(
-                        member=member,
-                        path=settings.INGEST_TMP_DIR
-                    )
-
-                    move_ocr_file(self, file_path)
+        # Start a new list, in case an earlier attempt left one behind.
+        open(self.trigger_file, 'w').close()
+
+        with self.metrics.stage('unzip_bundle'), open_bundle(self.bundle_source) as bundle:
+            # Counted up front for ZIPs and directories. Tar streams are estimated by their size.
+            count, size = bundle.sizes(is_bundle_file)
+            self.progress.stage('unzip_bundle', total=count)
+            with ScratchSpace().reserve(self.manifest.pid, size):
+                self._extract_members(bundle, (member for member in bundle if is_bundle_file(member.filename)))
+
+    def _extract_members(self, bundle, members):
+        derivatives = Derivatives()
+        try:
+            with self.working_directory() as working_directory, derivatives:
+                for member in members:
+                    self._extract_member(bundle, member, working_directory, derivatives)
+                    self.progress.advance()
+        finally:
+            # Recorded on the report too, so failures are seen without the metrics backend.
+            self.metrics.incr('derivatives', derivatives.made)
+            self.metrics.incr('failed_derivatives', derivatives.failed)
+            self.progress.record_failures('derivatives', derivatives.failed)
+
+    def _extract_member(self, bundle, member, working_directory, derivatives):
+        file_name = member.filename
+
+        self.metrics.memory.check('unzip_bundle')
+
+        if is_image(file_name):
+            file_to_process = ingest_file_name(self, file_name)
+            canvas_pid = f'{os.path.splitext(file_to_process)[0]}.tiff'
+            checksum = self.checksums.get(canvas_pid) if self.reingest else None
+            if checksum is not None and not bundle.streamed and checksum.matches(bundle, member):
+                self._unchanged_image(file_to_process)
+                return
+
+            file_path, sha256 = extract_member(bundle, member, working_directory)
+            # A streamed file can't be read again, so it is hashed as it is extracted instead.
+            if checksum is not None and bundle.streamed and checksum.matches(bundle, member, sha256):
+                os.remove(file_path)
+                self._unchanged_image(file_to_process)
+                return
+            self.new_checksums[canvas_pid] = CanvasChecksum(
+                sha256=sha256,
+                crc32=member.crc,
+                size=member.file_size
+            )
+            file_to_process = move_image_file(self, file_path)
+            self.files.add_image(os.path.join(settings.INGEST_PROCESSING_DIR, file_to_process))
+            derivatives.add(os.path.join(settings.INGEST_PROCESSING_DIR, file_to_process))
+            with open(self.trigger_file, 'a') as t_file:
+                t_file.write(f'{file_to_process}\n')
+            self.metrics.incr('images')
+            self.metrics.incr('bytes', member.file_size)
+
+        elif is_ocr(file_name):
+            file_path, sha256 = extract_member(bundle, member, working_directory)
+            ocr_file_path = os.path.join(self.ocr_directory, move_ocr_file(self, file_path))
+            if content_store_enabled():
+                self.store_content(ocr_file_path, sha256, ContentObject.OCR, member.file_size)
+            self.files.add_ocr(ocr_file_path)
+            self.metrics.incr('ocr_files')
+            self.metrics.incr('bytes', member.file_size)
+
+    def _unchanged_image(self, file_to_process):
+        self.unchanged_images.append(file_to_process)
+        self.metrics.incr('unchanged_images')
 
     def open_metadata(self):
+        """Read the metadata file in the bundle, unless the ingest or its bulk ingest has metadata.
+
+        The manifest's pid is needed to name the extracted files, so this runs before the
+        bundle is extracted. For a tar stream that is a second pass over the archive as far
+        as the metadata file. Archives with the metadata file first are only read once.
+        """
         if bool(self.metadata):
             return
 
         metadata_file = None
 
-        with ZipFile(self.bundle, 'r') as zip_ref:
-            for member in zip_ref.infolist():
-                file_name = member.filename
+        with self.metrics.stage('open_metadata'):
+            if self.bulk is not None:
+                self.metadata = self.bulk.metadata_for(self.bundle_name)
+                if self.metadata:
+                    return
 
-                if is_junk(os.path.basename(file_name)):
-                    continue
+            with open_bundle(self.bundle_source) as bundle, self.working_directory() as working_directory:
+                for position, member in enumerate(bundle):
+                    file_name = member.filename
 
-                if is_image(file_name):
-                    continue
+                    if is_junk(os.path.basename(file_name)):
+                        continue
 
-                if os.path.splitext(os.path.basename(file_name))[0] == 'metadata':
-                    metadata_file = os.path.join(
-                        settings.INGEST_TMP_DIR,
-                        file_name
-                    )
-                    zip_ref.extract(
-                        member=member,
-                        path=settings.INGEST_TMP_DIR
-                    )
+                    if is_image(file_name):
+                        continue
 
-        if metadata_file is None or os.path.exists(metadata_file) is False:
-            return
+                    if os.path.splitext(os.path.basename(file_name))[0] == 'metadata':
+                        # Stop at the first one so a tar stream is not read to the end.
+                        metadata_file, _ = extract_member(bundle, member, working_directory)
+                        if position and isinstance(bundle, TarBundle):
+                            LOGGER.info(
+                                f'INGEST: {file_name} is file {position + 1} of {self.bundle_name}. '
+                                'Add it to the archive first so the stream is only read once.'
+                            )
+                        break
+
+                if metadata_file is None or os.path.exists(metadata_file) is False:
+                    return
 
-        self.metadata = metadata_from_file(metadata_file)
+                self.metadata = metadata_from_file(metadata_file)
+            self.metrics.memory.check('open_metadata')
 
     def create_canvases(self):
         Canvas = get_iiif_models()['Canvas']
         images = None
         with open(self.trigger_file, 'r') as t_file:
             images = t_file.read().splitlines()
-        images.sort()
-
-        for index, image in enumerate(images):
-            position = index + 1
-            image_name = os.path.splitext(image)[0]
-            canvas_pid = f'{image_name}.tiff'
-            width, height = canvas_dimensions(image_name)
-            ocr_directory = os.path.join(settings.INGEST_OCR_DIR, self.manifest.pid)
-            try:
-                ocr_file = [ocr for ocr in os.listdir(ocr_directory) if image_name in ocr][0]
-                ocr_file_path = os.path.abspath(os.path.join(ocr_directory, ocr_file))
-            except IndexError:
-                ocr_file_path = None
-
-            Canvas.objects.get_or_create(
-                manifest=self.manifest,
-                pid=canvas_pid,
-                ocr_file_path=ocr_file_path,
-                position=position,
-                width=width,
-                height=height
-            )
+        converting = list(images)
+        unchanged = set(self.unchanged_images)
+        images = sorted(images + self.unchanged_images)
+
+        self.progress.stage('create_canvases', total=len(images))
+        with self.metrics.stage('create_canvases'), TransactionBatches() as batches:
+            for index, image in enumerate(images):
+                position = index + 1
+                image_name = os.path.splitext(image)[0]
+                canvas_pid = f'{image_name}.tiff'
+                ocr_file_path = self.files.ocr_path(image_name)
+
+                if image in unchanged:
+                    # The canvas and its dimensions are still right; it may have moved or have new OCR.
+                    changes = {'position': position}
+                    if ocr_file_path is not None:
+                        changes['ocr_file_path'] = ocr_file_path
+                    with batches.canvas():
+                        Canvas.objects.filter(manifest=self.manifest, pid=canvas_pid).update(**changes)
+                    self.metrics.incr('pages')
+                    self.progress.advance()
+                    continue
 
-        upload_trigger_file(self.trigger_file)
+                image_path = self.files.image_path(image_name)
+                width, height = canvas_dimensions(image_name, image_path) if image_path else (0, 0)
+                self.canvas_files.append((canvas_pid, image_path, ocr_file_path))
+
+                with batches.canvas():
+                    canvas, _ = Canvas.objects.update_or_create(
+                        manifest=self.manifest,
+                        pid=canvas_pid,
+                        defaults={
+                            'ocr_file_path': ocr_file_path,
+                            'position': position,
+                            'width': width,
+                            'height': height
+                        }
+                    )
+                if canvas_pid in self.new_checksums:
+                    self.new_checksums[canvas_pid].canvas = canvas
+                self.metrics.incr('pages')
+                self.progress.advance()
+        self.metrics.incr('commits', batches.commits)
+        self.save_checksums()
+
+        if not converting:
+            LOGGER.info(f'INGEST: Local ingest - {self.id} - no changed images for {self.manifest.pid}')
+        elif local_conversion():
+            self.convert_images(converting)
+        else:
+            with self.metrics.stage('upload_trigger_file'):
+                upload_trigger_file(self.trigger_file)
+        self.save_contents()
+
+    def convert_images(self, images):
+        """Convert images to pyramidal TIFFs here instead of with the AWS Lambda.
+
+        :param images: File names of images in `INGEST_PROCESSING_DIR`
+        :type images: list
+        """
+        image_paths = [os.path.join(settings.INGEST_PROCESSING_DIR, image) for image in images]
+        self.progress.stage('convert_images', total=len(image_paths))
+        with self.metrics.stage('convert_images'):
+            if content_store_enabled():
+                stats = self._convert_unique_images(image_paths)
+            else:
+                stats = convert_images(image_paths)
+        self.progress.advance(len(image_paths))
+        self.metrics.incr('converted_images', stats['images'])
+        self.metrics.incr('converted_bytes', stats['bytes'])
+        self.metrics.incr('conversion_workers', stats['workers'])
+        if cleanup_enabled():
+            for image_path in image_paths:
+                os.remove(image_path)
+
+    def _convert_unique_images(self, image_paths):
+        """Convert each image whose content has not been converted before into the content
+        store, then link every canvas' TIFF to its converted content."""
+        store = ContentStore()
+        directory = converted_directory()
+        os.makedirs(directory, exist_ok=True)
+        contents = {}
+        jobs = {}
+        for image_path in image_paths:
+            checksum = self.new_checksums[f'{os.path.splitext(os.path.basename(image_path))[0]}.tiff']
+            content_path = store.path(checksum.sha256, '.tiff')
+            contents[image_path] = content_path
+            self.stored_content[os.path.abspath(image_path)] = ContentObject(
+                sha256=checksum.sha256, kind=ContentObject.IMAGE, size=checksum.size, path=content_path
+            )
+            if not os.path.exists(content_path) and content_path not in jobs:
+                os.makedirs(os.path.dirname(content_path), exist_ok=True)
+                jobs[content_path] = image_path
+
+        stats = convert_images(list(jobs.values()), targets=list(jobs))
+        for image_path, content_path in contents.items():
+            store.link(content_path, tiff_path(image_path, directory))
+        self.metrics.incr('duplicate_images', len(image_paths) - len(jobs))
+        return stats
+
+    def store_content(self, file_path, sha256, kind, size):
+        """Keep one copy of a file in the content store and link this ingest's file to it.
+
+        :param file_path: Extracted file
+        :type file_path: str
+        :param sha256: SHA-256 hex digest of the file
+        :type sha256: str
+        :param kind: `ContentObject.IMAGE` or `ContentObject.OCR`
+        :type kind: str
+        :param size: Bytes
+        :type size: int
+        """
+        content_path, duplicate = ContentStore().add(file_path, sha256)
+        if duplicate:
+            self.metrics.incr(f'duplicate_{kind}_files')
+        self.stored_content[os.path.abspath(file_path)] = ContentObject(sha256=sha256, kind=kind, size=size, path=content_path)
+
+    def save_contents(self):
+        """Record the stored content each canvas uses."""
+        if not self.stored_content:
+            return
+        Canvas = get_iiif_models()['Canvas']
+        references = [
+            (canvas_pid, self.stored_content[os.path.abspath(path)])
+            for canvas_pid, image_path, ocr_file_path in self.canvas_files
+            for path in (image_path, ocr_file_path)
+            if path and os.path.abspath(path) in self.stored_content
+        ]
+        canvases = {
+            canvas.pid: canvas
+            for canvas in Canvas.objects.filter(manifest=self.manifest, pid__in={canvas_pid for canvas_pid, _ in references})
+        }
+        with transaction.atomic():
+            ContentObject.objects.bulk_create(
+                {content.sha256: content for _, content in references}.values(), ignore_conflicts=True
+            )
+            CanvasContent.objects.filter(canvas__in=canvases.values()).delete()
+            CanvasContent.objects.bulk_create([
+                CanvasContent(canvas=canvases[canvas_pid], content_id=content.sha256, kind=content.kind)
+                for canvas_pid, content in references
+            ])
+
+    def save_checksums(self):
+        """Replace the checksums of the canvases whose images were extracted."""
+        checksums = [checksum for checksum in self.new_checksums.values() if checksum.canvas_id is not None]
+        if not checksums:
+            return
+        with transaction.atomic():
+            CanvasChecksum.objects.filter(canvas_id__in=[checksum.canvas_id for checksum in checksums]).delete()
+            CanvasChecksum.objects.bulk_create(checksums)
@@ -0,0 +1,87 @@
+""" Optional profiling for ingest tasks. """
+import cProfile
+import io
+import logging
+import os
+import pstats
+from contextlib import contextmanager
+from django.conf import settings
+
+LOGGER = logging.getLogger(__name__)
+
+def profiling_enabled(requested=False):
+    """Check if a task should be profiled.
+
+    :param requested: Profiling was asked for on the ingest, defaults to False
+    :type requested: bool, optional
+    :return: True if the ingest or the `INGEST_PROFILE` setting asks for profiling.
+    :rtype: bool
+    """
+    return bool(requested) or getattr(settings, 'INGEST_PROFILE', False)
+
+def profile_directory():
+    directory = getattr(
+        settings,
+        'INGEST_PROFILE_DIR',
+        os.path.join(settings.INGEST_TMP_DIR, 'profiles')
+    )
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+@contextmanager
+def profile_task(task_name, report=None):
+    """Run the enclosed code under cProfile and save the results to the report.
+
+    Only use this when `profiling_enabled()` is True; there is no cost to the code path
+    that does not enter it. A profile that cannot be saved is logged, so it never hides
+    an error from the task or fails a task that worked.
+
+    :param task_name: Name used for the profile file and the key in `report.profiles`.
+    :type task_name: str
+    :param report: Where to record the profile, defaults to None
+    :type report: readux_ingest_ecds.models.IngestReport, optional
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        try:
+            save_profile(profiler, task_name, report)
+        except Exception: # pylint: disable = broad-except
+            LOGGER.exception(f'INGEST: Could not save the profile for {task_name}')
+
+def save_profile(profiler, task_name, report=None):
+    """Write the raw stats and a summary of the most expensive calls.
+
+    :param profiler: Profiler that has finished
+    :type profiler: cProfile.Profile
+    :param task_name: Name of the task that was profiled
+    :type task_name: str
+    :param report: Where to record the profile, defaults to None
+    :type report: readux_ingest_ecds.models.IngestReport, optional
+    :return: Path to the stats file and the summary
+    :rtype: dict
+    """
+    label = f'{task_name}-{report.pk}' if report is not None else task_name
+    stats_file = os.path.join(profile_directory(), f'{label}.prof')
+    profiler.dump_stats(stats_file)
+
+    summary = io.StringIO()
+    stats = pstats.Stats(profiler, stream=summary)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(getattr(settings, 'INGEST_PROFILE_TOP', 25))
+
+    profile = {
+        'file': os.path.abspath(stats_file),
+        'seconds': round(stats.total_tt, 6),
+        'summary': summary.getvalue(),
+    }
+
+    LOGGER.info(f'INGEST: Profile for {label} saved to {stats_file}')
+
+    if report is not None:
+        report.profiles[task_name] = profile
+        report.save(update_fields=['profiles'])
+
+    return profile
@@ -0,0 +1,198 @@
+""" Progress of a running ingest, saved to its report a few times a minute. """
+from time import monotonic
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+class Progress:
+    """Stage, pages done, words loaded and estimated seconds left for a task.
+
+    Updates are kept in memory and saved to the report's `progress` field at most once
+    every `INGEST_PROGRESS_INTERVAL` seconds (default 2), when a stage starts and when the
+    task finishes, so a volume with hundreds of pages does not add a write for each page.
+
+    Failures that do not stop a task, eg. derivatives that could not be made, are counted
+    under `failures` and kept when the next task of the ingest starts reporting progress.
+
+    Pages are saved in transactions of many canvases (see `TransactionBatches`). Progress
+    saved while one is open is written with a second connection to the database, so the
+    report page sees it straight away and a batch that is rolled back does not take the
+    progress with it. SQLite only allows one writer at a time, so there, and when the
+    progress was started inside a transaction, eg. in a test, the task's connection is used.
+
+    :param report: Report to save progress to, nothing is saved when None
+    :type report: readux_ingest_ecds.models.IngestReport
+    :param task: Name of the task
+    :type task: str
+    """
+    def __init__(self, report, task):
+        self.report = report
+        previous = (report.progress if report is not None else None) or {}
+        self.interval = getattr(settings, 'INGEST_PROGRESS_INTERVAL', 2)
+        self.state = {
+            'task': task,
+            'stage': None,
+            'done': 0,
+            'total': None,
+            'words': 0,
+            'eta': None,
+            'finished': False,
+            'failed': False,
+            'retrying': False,
+            'error': None,
+            # A retried task counts its failures again.
+            'failures': dict(previous.get('failures', {})) if previous.get('task') != task else {},
+            'delivery': previous.get('delivery'),
+            'updated': None,
+        }
+        self.stage_started = monotonic()
+        self.saved = None
+        self.started_in_transaction = connections[self.database_alias()].in_atomic_block
+
+    def database_alias(self):
+        return (self.report._state.db if self.report is not None else None) or DEFAULT_DB_ALIAS
+
+    def database(self):
+        """Alias of the connection to save progress with: a second connection to the report's
+        database while the task's connection is in a transaction it started.
+
+        :rtype: str
+        """
+        alias = self.database_alias()
+        connection = connections[alias]
+        if self.started_in_transaction or not connection.in_atomic_block or connection.vendor == 'sqlite':
+            return alias
+        progress_alias = f'{alias}_ingest_progress'
+        if progress_alias not in connections.databases:
+            connections.databases[progress_alias] = dict(connections.databases[alias])
+        return progress_alias
+
+    def stage(self, name, total=None):
+        """Start a stage.
+
+        :param name: Name of the stage
+        :type name: str
+        :param total: Pages or files the stage works through, defaults to None
+        :type total: int, optional
+        """
+        self.state.update(stage=name, done=0, total=total, eta=None)
+        self.stage_started = monotonic()
+        self.save()
+
+    def advance(self, done=1, words=0):
+        """Record pages or files done, saving when the interval has passed.
+
+        :param done: Pages or files done since the last call, defaults to 1
+        :type done: int, optional
+        :param words: Words loaded since the last call, defaults to 0
+        :type words: int, optional
+        """
+        self.state['done'] += done
+        self.state['words'] += words
+        if self.saved is None or monotonic() - self.saved >= self.interval:
+            self.save()
+
+    def record_failures(self, kind, count):
+        """Count things that failed without stopping the task, saving when there are any.
+
+        :param kind: What failed, eg. "derivatives"
+        :type kind: str
+        :param count: How many failed
+        :type count: int
+        """
+        if count:
+            self.state['failures'][kind] = self.state['failures'].get(kind, 0) + count
+            self.save()
+
+    def finish(self):
+        self.state.update(finished=True, eta=0)
+        self.save()
+
+    def eta(self):
+        """Seconds until the stage is done at its rate so far, or None when unknown."""
+        done, total = self.state['done'], self.state['total']
+        elapsed = monotonic() - self.stage_started
+        if not total or not done or not elapsed:
+            return None
+        return round((total - done) * elapsed / done, 1)
+
+    def save(self):
+        self.saved = monotonic()
+        if self.report is None or self.report.pk is None:
+            return
+        self.state.update(eta=self.eta() if not self.state['finished'] else 0, updated=timezone.now().isoformat())
+        self.report.progress = {**self.state, 'failures': dict(self.state['failures'])}
+        # One UPDATE of one column, so saving progress never overwrites the rest of the report.
+        type(self.report).objects.using(self.database()).filter(pk=self.report.pk).update(progress=self.report.progress)
+
+def record_failure(report, error, retrying=False):
+    """Mark the progress saved on a report as failed, so the page following it stops
+    polling unless the task will be retried. The next try starts its progress afresh.
+
+    :param report: Report of the failed task, nothing is saved when None
+    :type report: readux_ingest_ecds.models.IngestReport
+    :param error: Exception the task raised
+    :type error: Exception
+    :param retrying: The task will be tried again, defaults to False
+    :type retrying: bool, optional
+    """
+    if report is None or report.pk is None:
+        return
+    reports = type(report).objects.filter(pk=report.pk)
+    state = reports.values_list('progress', flat=True).first() or {}
+    state.update(
+        failed=not retrying,
+        retrying=retrying,
+        error=f'{error.__class__.__name__}: {error}',
+        eta=None,
+        updated=timezone.now().isoformat()
+    )
+    report.progress = state
+    reports.update(progress=state)
+
+def record_delivery(report, key):
+    """Count the times one try of a task has been delivered to a worker. The count is
+    saved with the report's progress and starts again at 1 for a different key.
+
+    :param report: Report of the task
+    :type report: readux_ingest_ecds.models.IngestReport
+    :param key: Identifies the try, eg. the task's id and number of retries
+    :type key: str
+    :return: Deliveries of the try, including this one
+    :rtype: int
+    """
+    reports = type(report).objects.filter(pk=report.pk)
+    state = reports.values_list('progress', flat=True).first() or {}
+    delivery = state.get('delivery') or {}
+    count = delivery.get('count', 0) + 1 if delivery.get('key') == key else 1
+    state['delivery'] = {'key': key, 'count': count}
+    report.progress = state
+    reports.update(progress=state)
+    return count
+
+def describe(state):
+    """Progress as a sentence for people, eg. "add_ocr: 120 of 400, 35000 words, about 42s left".
+
+    :param state: Saved progress
+    :type state: dict
+    :rtype: str
+    """
+    if not state:
+        return 'Waiting to start'
+    failures = ''.join(f', {count} {kind} failed' for kind, count in state.get('failures', {}).items())
+    if state.get('error'):
+        stage = state.get('stage') or 'the start'
+        if state.get('retrying'):
+            return f'Retrying after an error at {stage}: {state["error"]}'
+        return f'Failed at {stage}: {state["error"]}' + failures
+    if state.get('finished'):
+        text = f'Finished, {state["words"]} words loaded' if state.get('words') else 'Finished'
+        return text + failures
+    text = f'{state["stage"]}: {state["done"]}'
+    if state.get('total'):
+        text += f' of {state["total"]}'
+    if state.get('words'):
+        text += f', {state["words"]} words'
+    if state.get('eta') is not None:
+        text += f', about {state["eta"]:.0f}s left'
+    return text + failures
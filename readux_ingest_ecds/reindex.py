@@ -0,0 +1,88 @@
+""" Reindex a manifest's canvases once their OCR is loaded, instead of one at a time. """
+import logging
+from functools import lru_cache
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import Signal, receiver
+from django.utils.module_loading import import_string
+from .helpers import get_iiif_models
+
+LOGGER = logging.getLogger(__name__)
+
+MODES = ('canvas', 'deferred')
+
+# Sent with the Manifest model as sender and `manifest` and `canvas_ids` for each batch.
+# In 'deferred' mode nothing else reindexes the canvases unless `INGEST_REINDEX_HANDLER`
+# is set, so hosts connect a receiver that updates their search index in bulk.
+canvases_loaded = Signal()
+
+def reindex_deferred():
+    """Canvases are saved as their OCR loads, unless `INGEST_REINDEX` is 'deferred'."""
+    mode = getattr(settings, 'INGEST_REINDEX', 'canvas')
+    if mode not in MODES:
+        raise ImproperlyConfigured(f'INGEST_REINDEX must be one of {", ".join(MODES)}, not {mode}')
+    return mode == 'deferred'
+
+def batches(canvas_ids):
+    """Split canvases into batches of `INGEST_REINDEX_BATCH_SIZE`, or one batch when it is not set.
+
+    :param canvas_ids: Primary keys of the canvases
+    :type canvas_ids: list
+    :rtype: list
+    """
+    batch_size = getattr(settings, 'INGEST_REINDEX_BATCH_SIZE', None) or len(canvas_ids) or 1
+    return [canvas_ids[start:start + batch_size] for start in range(0, len(canvas_ids), batch_size)]
+
+def reindex(manifest, canvas_ids):
+    """Ask the host to reindex canvases whose OCR has been loaded.
+
+    For each batch, `canvases_loaded` is sent and the `INGEST_REINDEX_HANDLER`, if any, is called.
+    A failed batch is logged so the rest are still reindexed and the ingest is not retried.
+
+    :param manifest: Manifest the canvases belong to
+    :type manifest: Manifest
+    :param canvas_ids: Primary keys of the canvases
+    :type canvas_ids: list
+    :return: Number of batches
+    :rtype: int
+    """
+    handler = get_handler()
+    canvas_batches = batches(list(canvas_ids))
+    for batch in canvas_batches:
+        try:
+            canvases_loaded.send(sender=type(manifest), manifest=manifest, canvas_ids=batch)
+            if handler is not None:
+                handler(manifest, batch)
+        except Exception: # pylint: disable = broad-except
+            LOGGER.exception(f'INGEST: Reindexing {len(batch)} canvases of {manifest.pid} failed')
+    LOGGER.info(f'INGEST: Reindexed {len(canvas_ids)} canvases of {manifest.pid} in {len(canvas_batches)} batches')
+    return len(canvas_batches)
+
+def save_canvases(manifest, canvas_ids):
+    """Handler for hosts that only reindex from save signals. Each canvas is saved, so the
+    index still gets one update per canvas, but only once the whole volume is loaded.
+
+    :param manifest: Manifest the canvases belong to
+    :type manifest: Manifest
+    :param canvas_ids: Primary keys of the canvases
+    :type canvas_ids: list
+    """
+    Canvas = get_iiif_models()['Canvas'] # pylint: disable = invalid-name
+    for canvas in Canvas.objects.filter(pk__in=canvas_ids):
+        canvas.save()
+
+@lru_cache(maxsize=None)
+def get_handler():
+    """Function set by `INGEST_REINDEX_HANDLER`, or None when it is not set.
+
+    :rtype: callable
+    """
+    handler = getattr(settings, 'INGEST_REINDEX_HANDLER', None)
+    return import_string(handler) if handler else None
+
+@receiver(setting_changed)
+def reset_handler(setting, **kwargs): # pylint: disable = unused-argument
+    """Load the handler again when the setting changes, eg. in tests."""
+    if setting == 'INGEST_REINDEX_HANDLER':
+        get_handler.cache_clear()
@@ -0,0 +1,231 @@
+""" Track, reserve and clean up the disk space ingests use for extracted files. """
+import fcntl
+import json
+import logging
+import os
+import socket
+from contextlib import contextmanager
+from time import time
+from uuid import uuid4
+from shutil import disk_usage
+from django.conf import settings
+from .helpers import get_iiif_models
+from .memory import MB
+
+LOGGER = logging.getLogger(__name__)
+
+class InsufficientScratchSpace(Exception):
+    """Raised when there is not enough free disk to extract a bundle."""
+    pass # pylint: disable=unnecessary-pass
+
+def directory_size(path):
+    """Total size in bytes of the files under `path`."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file_name))
+            except FileNotFoundError:
+                pass
+    return total
+
+class ScratchSpace:
+    """Disk space used by ingests in `INGEST_TMP_DIR`, `INGEST_PROCESSING_DIR` and `INGEST_OCR_DIR`.
+
+    Before a bundle is extracted, space for its uncompressed files is reserved. Reservations
+    are kept in a ledger file in `INGEST_TMP_DIR`, so ingests in other worker processes on
+    the same host see them. A reservation is released once the files are on disk, where
+    they count against the free space anyway. The `INGEST_SCRATCH_HEADROOM` setting is the
+    number of megabytes to always leave free.
+
+    Each reservation records the host and process that made it and when. One left by a
+    process that is gone, eg. a worker killed by the OOM killer, or older than
+    `INGEST_SCRATCH_RESERVATION_TTL` seconds (default six hours) is dropped when the ledger
+    is next read.
+    """
+    ledger_name = '.scratch-reservations.json'
+
+    def __init__(self):
+        self.tmp_dir = settings.INGEST_TMP_DIR
+        self.headroom = int(getattr(settings, 'INGEST_SCRATCH_HEADROOM', 0) * MB)
+        self.ttl = getattr(settings, 'INGEST_SCRATCH_RESERVATION_TTL', 6 * 60 * 60)
+
+    @property
+    def ledger_path(self):
+        return os.path.join(self.tmp_dir, self.ledger_name)
+
+    @contextmanager
+    def ledger(self):
+        """Lock the ledger and yield the reservations, saving any changes."""
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        with open(self.ledger_path, 'a+') as ledger_file:
+            fcntl.flock(ledger_file, fcntl.LOCK_EX)
+            try:
+                ledger_file.seek(0)
+                contents = ledger_file.read()
+                reservations = json.loads(contents) if contents else {}
+                for run in [run for run, reservation in reservations.items() if self.is_stale(reservation)]:
+                    LOGGER.warning(f'INGEST: Dropping stale scratch reservation {run}: {reservations.pop(run)}')
+                yield reservations
+                ledger_file.seek(0)
+                ledger_file.truncate()
+                json.dump(reservations, ledger_file)
+            finally:
+                fcntl.flock(ledger_file, fcntl.LOCK_UN)
+
+    def is_stale(self, reservation):
+        """Check if a reservation's owner is gone or it has been held too long.
+
+        :param reservation: Entry in the ledger
+        :type reservation: dict
+        :rtype: bool
+        """
+        if not isinstance(reservation, dict):
+            return True
+        if time() - reservation.get('created', 0) > self.ttl:
+            return True
+        if reservation.get('host') == socket.gethostname():
+            try:
+                os.kill(reservation['pid'], 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+        return False
+
+    @contextmanager
+    def reserve(self, key, size):
+        """Hold disk space for an ingest while it extracts its bundle.
+
+        :param key: Identifies the ingest, eg. the manifest pid. Each run gets its own entry,
+            so overlapping runs for the same pid do not release each other's space.
+        :type key: str
+        :param size: Bytes to reserve
+        :type size: int
+        :raises InsufficientScratchSpace: When the free space, less other reservations and
+            the headroom, is smaller than `size`.
+        """
+        with self.ledger() as reservations:
+            free = disk_usage(self.tmp_dir).free
+            reserved = sum(reservation['size'] for reservation in reservations.values())
+            if size + reserved + self.headroom > free:
+                raise InsufficientScratchSpace(
+                    f'INGEST: {key} needs {size / MB:.1f} MB of scratch space; '
+                    f'{free / MB:.1f} MB is free and {reserved / MB:.1f} MB is reserved by other ingests.'
+                )
+            run = f'{key}:{uuid4().hex}'
+            reservations[run] = {
+                'key': key,
+                'size': size,
+                'host': socket.gethostname(),
+                'pid': os.getpid(),
+                'created': time(),
+            }
+        try:
+            yield
+        finally:
+            with self.ledger() as reservations:
+                reservations.pop(run, None)
+
+    def ingest_usage(self, pid):
+        """Bytes on disk for one manifest's images waiting for conversion and its OCR files.
+
+        :param pid: Manifest pid
+        :type pid: str
+        :rtype: dict
+        """
+        return {
+            'processing': sum(entry.stat().st_size for entry in processing_files(pid)),
+            'ocr': directory_size(os.path.join(settings.INGEST_OCR_DIR, pid)),
+        }
+
+    def usage(self):
+        """Current use of the scratch disk.
+
+        :return: Free and total bytes, bytes under each scratch directory, reservations,
+            and usage for each manifest with OCR files waiting.
+        :rtype: dict
+        """
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        disk = disk_usage(self.tmp_dir)
+        with self.ledger() as reservations:
+            reserved = dict(reservations)
+        pids = os.listdir(settings.INGEST_OCR_DIR) if os.path.isdir(settings.INGEST_OCR_DIR) else []
+        return {
+            'total': disk.total,
+            'free': disk.free,
+            'directories': {
+                'tmp': directory_size(self.tmp_dir),
+                'processing': directory_size(settings.INGEST_PROCESSING_DIR),
+                'ocr': directory_size(settings.INGEST_OCR_DIR),
+            },
+            'reserved': reserved,
+            'ingests': {pid: self.ingest_usage(pid) for pid in sorted(pids)},
+        }
+
+    def remove_ocr_files(self, pid, keep=()):
+        """Remove a manifest's OCR files once they are loaded, except the ones canvases
+        still point to with `ocr_file_path`, which loading the OCR again reads.
+
+        :param pid: Manifest pid
+        :type pid: str
+        :param keep: Paths of OCR files to leave in place, defaults to ()
+        :type keep: iterable, optional
+        :return: Number of files removed
+        :rtype: int
+        """
+        directory = os.path.join(settings.INGEST_OCR_DIR, pid)
+        if not os.path.isdir(directory):
+            return 0
+        keep = {os.path.abspath(path) for path in keep}
+        removed = 0
+        for entry in os.scandir(directory):
+            if entry.is_file() and os.path.abspath(entry.path) not in keep:
+                os.remove(entry.path)
+                removed += 1
+        if not os.listdir(directory):
+            os.rmdir(directory)
+        return removed
+
+    def remove_processing_files(self, pid):
+        """Remove a manifest's images once conversion has finished.
+
+        :param pid: Manifest pid
+        :type pid: str
+        :return: Number of files removed
+        :rtype: int
+        """
+        removed = 0
+        for entry in processing_files(pid):
+            os.remove(entry.path)
+            removed += 1
+        LOGGER.info(f'INGEST: Removed {removed} converted images for {pid}')
+        return removed
+
+def processing_files(pid):
+    """A manifest's images in `INGEST_PROCESSING_DIR`.
+
+    File names cannot tell manifests apart: names that already hold the pid are not
+    prefixed with it, and a pid can start another one, eg. `abc` and `abc_2`. So the
+    images are the ones the manifest's canvases were created from, whose pids are the
+    image names with `.tiff`.
+
+    :param pid: Manifest pid
+    :type pid: str
+    :rtype: list of os.DirEntry
+    """
+    if not os.path.isdir(settings.INGEST_PROCESSING_DIR):
+        return []
+    Canvas = get_iiif_models()['Canvas'] # pylint: disable = invalid-name
+    names = {
+        os.path.splitext(canvas_pid)[0]
+        for canvas_pid in Canvas.objects.filter(manifest__pid=pid).values_list('pid', flat=True)
+    }
+    return [
+        entry for entry in os.scandir(settings.INGEST_PROCESSING_DIR)
+        if entry.is_file() and os.path.splitext(entry.name)[0] in names
+    ]
+
+def cleanup_enabled():
+    """Remove scratch files as soon as they are no longer needed when `INGEST_SCRATCH_CLEANUP` is True."""
+    return getattr(settings, 'INGEST_SCRATCH_CLEANUP', False)
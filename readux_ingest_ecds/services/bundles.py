@@ -0,0 +1,165 @@
+""" Read the files in a volume bundle: a ZIP, a tar (optionally compressed) or a directory. """
+import os
+import tarfile
+from collections import namedtuple
+from zipfile import ZipFile, is_zipfile
+from django.conf import settings
+
+# First bytes of the compressed formats tar files are read from.
+COMPRESSION_MAGIC = {
+    'gz': b'\x1f\x8b',
+    'bz2': b'BZh',
+    'xz': b'\xfd7zXZ\x00',
+}
+
+BundleMember = namedtuple('BundleMember', ('filename', 'file_size', 'crc', 'info'))
+BundleMember.__doc__ = """A file in a bundle.
+
+:param filename: Path of the file in the bundle, with "/" separators
+:param file_size: Uncompressed size in bytes
+:param crc: CRC-32 recorded in a ZIP, None for other bundles
+:param info: What the bundle needs to open the file
+"""
+
+class Bundle:
+    """Files in a bundle, read in one pass in the order they are stored.
+
+    Iterate over the bundle to get its files. A file's content can be read with `open()`
+    until the next file is reached. In a `streamed` bundle, like a tar file, it can only
+    be read once.
+    """
+    streamed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __iter__(self):
+        raise NotImplementedError
+
+    def open(self, member):
+        """Binary file object with the member's content."""
+        raise NotImplementedError
+
+    def sizes(self, wanted):
+        """Number and total bytes of the files for which `wanted(filename)` is True.
+
+        :param wanted: Filter on the file names
+        :type wanted: callable
+        :return: Count, or None when it is only known after reading a stream, and bytes
+        :rtype: tuple
+        """
+        members = [member for member in self if wanted(member.filename)]
+        return len(members), sum(member.file_size for member in members)
+
+    def close(self):
+        pass
+
+class ZipBundle(Bundle):
+    """Bundle in a ZIP file. Sizes come from its central directory without reading any files."""
+    def __init__(self, source):
+        self.zip_ref = ZipFile(source, 'r')
+
+    def __iter__(self):
+        for info in self.zip_ref.infolist():
+            if not info.is_dir():
+                yield BundleMember(info.filename, info.file_size, info.CRC, info)
+
+    def open(self, member):
+        return self.zip_ref.open(member.info)
+
+    def close(self):
+        self.zip_ref.close()
+
+class TarBundle(Bundle):
+    """Bundle in a tar file, plain or compressed with gzip, bzip2 or xz, read as a stream.
+
+    Files are read in the order they were added. The only size known before reading is
+    the archive's. For a compressed archive, what it holds is estimated as its size times
+    `INGEST_TAR_EXPANSION` (default 4); a plain tar holds about its own size.
+    """
+    streamed = True
+
+    def __init__(self, source):
+        self.archive_size = os.path.getsize(source) if isinstance(source, str) else source.size
+        self.compression = compression(source)
+        if isinstance(source, str):
+            self.tar = tarfile.open(name=source, mode='r|*')
+        else:
+            self.tar = tarfile.open(fileobj=source, mode='r|*')
+
+    def __iter__(self):
+        for info in self.tar:
+            if info.isfile():
+                yield BundleMember(info.name, info.size, None, info)
+
+    def open(self, member):
+        return self.tar.extractfile(member.info)
+
+    def sizes(self, wanted):
+        if self.compression is None:
+            return None, self.archive_size
+        return None, int(self.archive_size * getattr(settings, 'INGEST_TAR_EXPANSION', 4))
+
+    def close(self):
+        self.tar.close()
+
+class DirectoryBundle(Bundle):
+    """Bundle that is a directory on the server, read in sorted order without copying it."""
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        for root, directories, files in os.walk(self.path):
+            directories.sort()
+            for file_name in sorted(files):
+                file_path = os.path.join(root, file_name)
+                filename = os.path.relpath(file_path, self.path).replace(os.sep, '/')
+                yield BundleMember(filename, os.path.getsize(file_path), None, file_path)
+
+    def open(self, member):
+        return open(member.info, 'rb')
+
+def compression(source):
+    """Compression of an archive, from its first bytes.
+
+    :param source: Path of the archive, or the archive
+    :type source: str or django.core.files.File
+    :return: 'gz', 'bz2', 'xz' or None when it is not compressed
+    :rtype: str
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as archive:
+            start = archive.read(6)
+    else:
+        source.seek(0)
+        start = source.read(6)
+        source.seek(0)
+    for name, magic in COMPRESSION_MAGIC.items():
+        if start.startswith(magic):
+            return name
+    return None
+
+def open_bundle(source):
+    """Open a bundle of any kind.
+
+    :param source: Path of a directory or archive, or an uploaded archive
+    :type source: str or django.core.files.File
+    :raises ValueError: When the source is not a directory, ZIP or tar file
+    :rtype: Bundle
+    """
+    if isinstance(source, str) and os.path.isdir(source):
+        return DirectoryBundle(source)
+    is_zip = is_zipfile(source)
+    if not isinstance(source, str):
+        source.seek(0)
+    if is_zip:
+        return ZipBundle(source)
+    try:
+        return TarBundle(source)
+    except tarfile.ReadError as error:
+        name = source if isinstance(source, str) else source.name
+        raise ValueError(f'{name} is not a directory, ZIP or tar bundle') from error
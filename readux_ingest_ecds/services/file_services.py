@@ -1,17 +1,12 @@
 """ Module of service methods for ingest files. """
 import os
+from functools import lru_cache
+from hashlib import sha256
 from shutil import move
-from PIL import Image
-from boto3 import resource
 from mimetypes import guess_type
 
 from django.conf import settings
 
-from readux_ingest_ecds.helpers import get_iiif_models
-
-Manifest = get_iiif_models()['Manifest']
-RelatedLink = get_iiif_models()['RelatedLink']
-
 def is_image(file_path):
     """Check if file is expected type for image files
 
@@ -43,6 +38,81 @@ def is_junk(file_path):
     """
     return file_path.startswith('.') or file_path.startswith('~') or file_path.startswith('__') or file_path.endswith('/') or file_path == ''
 
+CHUNK_SIZE = 1024 * 1024
+
+def ingest_file_name(ingest, file_path):
+    """File name an extracted file is saved as: its base name with the Manifest pid added
+    if not already there.
+
+    :param ingest: Ingest object
+    :type ingest: _type_
+    :param file_path: Path of the file in the bundle or tmp directory
+    :type file_path: str
+    :rtype: str
+    """
+    base_name = os.path.basename(file_path)
+    if not named_for(ingest.manifest.pid, base_name):
+        base_name = f'{ingest.manifest.pid}_{base_name}'
+    return base_name
+
+def named_for(pid, file_name):
+    """Check if a file name already holds a Manifest pid, so `ingest_file_name` keeps it as it is.
+
+    A pid can be part of another one, eg. `abc` and `abc_2`, so a match does not prove the
+    file is that manifest's.
+
+    :param pid: Manifest pid
+    :type pid: str
+    :param file_name: Base name of the file
+    :type file_name: str
+    :rtype: bool
+    """
+    return pid in file_name
+
+def is_bundle_file(file_path):
+    """Check if a file in a bundle is an image or OCR file to ingest.
+
+    :param file_path: Path of the file in the bundle
+    :type file_path: str
+    :rtype: bool
+    """
+    return not is_junk(os.path.basename(file_path)) and (is_image(file_path) or is_ocr(file_path))
+
+def extract_member(bundle, member, directory):
+    """Stream a file out of a bundle, hashing it as it is written.
+
+    :param bundle: Open bundle
+    :type bundle: readux_ingest_ecds.services.bundles.Bundle
+    :param member: File in the bundle
+    :type member: readux_ingest_ecds.services.bundles.BundleMember
+    :param directory: Directory to write the file to
+    :type directory: str
+    :return: Absolute path of the extracted file and its SHA-256 hex digest
+    :rtype: tuple
+    """
+    file_path = os.path.join(directory, os.path.basename(member.filename))
+    digest = sha256()
+    with bundle.open(member) as source, open(file_path, 'wb') as target:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            target.write(chunk)
+    return file_path, digest.hexdigest()
+
+def member_checksum(bundle, member):
+    """SHA-256 hex digest of a file in a bundle, without writing it anywhere.
+
+    :param bundle: Open bundle
+    :type bundle: readux_ingest_ecds.services.bundles.Bundle
+    :param member: File in the bundle
+    :type member: readux_ingest_ecds.services.bundles.BundleMember
+    :rtype: str
+    """
+    digest = sha256()
+    with bundle.open(member) as source:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 def move_image_file(ingest, file_path):
     """ Move files to directory where they processed.
     Add the Manifest pid to the file name if not already there.
@@ -54,9 +124,7 @@ def move_image_file(ingest, file_path):
     :return: File name file to be processed
     :rtype: str
     """
-    base_name = os.path.basename(file_path)
-    if ingest.manifest.pid not in base_name:
-        base_name = f'{ingest.manifest.pid}_{base_name}'
+    base_name = ingest_file_name(ingest, file_path)
     move(file_path, os.path.join(settings.INGEST_PROCESSING_DIR, base_name))
     return base_name
 
@@ -67,11 +135,12 @@ def move_ocr_file(ingest, file_path):
     :type ingest: _type_
     :param file_path: Absolute path of tmp file
     :type file_path: str
+    :return: File name of the moved OCR file
+    :rtype: str
     """
-    base_name = os.path.basename(file_path)
-    if ingest.manifest.pid not in base_name:
-        base_name = f'{ingest.manifest.pid}_{base_name}'
+    base_name = ingest_file_name(ingest, file_path)
     move(file_path, os.path.join(ingest.ocr_directory, base_name))
+    return base_name
 
 def upload_trigger_file(trigger_file):
     """
@@ -82,18 +151,104 @@ def upload_trigger_file(trigger_file):
     :param trigger_file: Absolute path to trigger file.
     :type trigger_file: str
     """
-    s3 = resource('s3')
-    s3.Bucket(settings.INGEST_TRIGGER_BUCKET).upload_file(trigger_file, os.path.basename(trigger_file))
+    s3_client().upload_file(trigger_file, settings.INGEST_TRIGGER_BUCKET, os.path.basename(trigger_file))
+
+@lru_cache(maxsize=None)
+def s3_client():
+    """S3 client shared by every ingest in the process. Clients are thread safe and
+    keep their connections open, so bulk ingests do not reconnect for each volume.
 
-def canvas_dimensions(image_name):
+    :return: boto3 S3 client
+    :rtype: botocore.client.S3
+    """
+    from boto3 import client
+
+    return client('s3')
+
+def canvas_dimensions(image_name, image_path=None):
     """Get canvas dimensions
 
     :param image_name: File name without extension of image file.
     :type image_name: str
+    :param image_path: Absolute path of the image, when known, defaults to None
+    :type image_path: str, optional
     :return: 2-tuple containing width and height (in pixels)
     :rtype: tuple
     """
+    from PIL import Image
+
+    if image_path is not None:
+        return Image.open(image_path).size
+
     original_image = [img for img in os.listdir(settings.INGEST_PROCESSING_DIR) if img.startswith(image_name)]
     if len(original_image) > 0:
         return Image.open(os.path.join(settings.INGEST_PROCESSING_DIR, original_image[0])).size
     return (0,0)
+
+def page_names(file_name):
+    """Names a page's files can be matched on: the file name without its extension and,
+    for names like `0001.hocr.txt`, without any extensions.
+
+    :param file_name: Base name of an image or OCR file
+    :type file_name: str
+    :rtype: list
+    """
+    names = [os.path.splitext(file_name)[0]]
+    if file_name.split('.')[0] not in names:
+        names.append(file_name.split('.')[0])
+    return names
+
+class IngestFiles:
+    """Index of the images and OCR files extracted for one manifest, by page name.
+
+    Ingests running at the same time share `INGEST_PROCESSING_DIR`, so looking up a page
+    by listing that directory can match another ingest's files. The index only holds
+    files this manifest's ingest extracted, or found on disk with names `ingest_file_name`
+    could have given them, and is built once instead of listing the directories for every canvas.
+
+    :param pid: Manifest pid
+    :type pid: str
+    """
+    def __init__(self, pid):
+        self.pid = pid
+        self.images = {}
+        self.ocr = {}
+
+    @classmethod
+    def from_disk(cls, pid, ocr_directory):
+        """Index files already moved into place, eg. when an ingest is retried.
+
+        Files of a manifest whose pid holds this one are indexed too, but pages are only
+        looked up by the names `ingest_file_name` gives this ingest's files.
+
+        :param pid: Manifest pid
+        :type pid: str
+        :param ocr_directory: The manifest's OCR directory
+        :type ocr_directory: str
+        :rtype: IngestFiles
+        """
+        files = cls(pid)
+        if os.path.isdir(settings.INGEST_PROCESSING_DIR):
+            for entry in os.scandir(settings.INGEST_PROCESSING_DIR):
+                if entry.is_file() and named_for(pid, entry.name):
+                    files.add_image(entry.path)
+        if os.path.isdir(ocr_directory):
+            for entry in os.scandir(ocr_directory):
+                if entry.is_file():
+                    files.add_ocr(entry.path)
+        return files
+
+    def add_image(self, file_path):
+        self.images[os.path.splitext(os.path.basename(file_path))[0]] = file_path
+
+    def add_ocr(self, file_path):
+        for name in page_names(os.path.basename(file_path)):
+            self.ocr.setdefault(name, os.path.abspath(file_path))
+
+    def image_path(self, image_name):
+        """Absolute path of the page's image, or None."""
+        return self.images.get(image_name)
+
+    def ocr_path(self, image_name):
+        """Absolute path of the page's OCR file, or None."""
+        return self.ocr.get(image_name)
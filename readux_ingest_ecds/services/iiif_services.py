@@ -1,13 +1,15 @@
 """ Module of service methods for IIIF objects. """
+from django.db import transaction
 from readux_ingest_ecds.helpers import get_iiif_models
 
-Manifest = get_iiif_models()['Manifest']
-RelatedLink = get_iiif_models()['RelatedLink']
-OCR = get_iiif_models()['OCR']
-
 def create_manifest(ingest):
     """
     Create or update a Manifest from supplied metadata and images.
+
+    Uses as few statements as it can: a get or create of the manifest, one save and one
+    insert for the collections. These run in a transaction, so the manifest stays locked
+    until they are done. Called in one, eg. from `Local.prep()`, they join it.
+
     :return: New or updated Manifest with supplied `pid`
     :rtype: iiif.manifest.models.Manifest
     """
@@ -21,23 +23,42 @@ def create_manifest(ingest):
         metadata = dict(ingest.metadata)
     except TypeError:
         metadata = None
-    if metadata:
-        if 'pid' in metadata:
-            manifest, created = Manifest.objects.get_or_create(pid=metadata['pid'].replace('_', '-'))
+
+    metadata = dict(metadata or {})
+    pid = metadata.pop('pid', None)
+    fields = {name for field in Manifest._meta.concrete_fields for name in (field.name, field.attname)}
+    # Set the id so the image server is not loaded just to be assigned.
+    values = {'image_server_id': ingest.image_server_id}
+    values.update((key, value) for key, value in metadata.items() if key in fields)
+    extra = {key: value for key, value in metadata.items() if key not in fields}
+
+    # No savepoint: an error here rolls back the caller's transaction too.
+    with transaction.atomic(savepoint=False):
+        if pid:
+            # get_or_create selects the row again when a concurrent ingest of the same new pid
+            # inserts it first, instead of failing with an IntegrityError.
+            manifest, created = Manifest.objects.select_for_update().get_or_create(
+                pid=pid.replace('_', '-'), defaults=values
+            )
+            changes = extra if created else {**values, **extra}
         else:
-            manifest = Manifest.objects.create()
-        for (key, value) in metadata.items():
-            setattr(manifest, key, value)
-    else:
-        manifest = Manifest()
+            manifest, created = Manifest(**values), True
+            changes = extra
 
-    manifest.image_server = ingest.image_server
+        for (key, value) in changes.items():
+            setattr(manifest, key, value)
+        if changes or manifest._state.adding:
+            manifest.save()
+        # A default pid, eg. a UUID, is a string when read back. Convert it here instead of
+        # reloading the manifest.
+        manifest.pid = Manifest._meta.get_field('pid').to_python(manifest.pid)
 
-    # Ensure that manifest has an ID before updating the M2M relationship
-    manifest.save()
-    manifest.refresh_from_db()
-    manifest.collections.set(ingest.collections.all())
-    # Save again once relationship is set
-    manifest.save()
+        # An ingest that has not been saved yet has no collections.
+        collection_ids = list(ingest.collections.values_list('pk', flat=True)) if ingest.pk else []
+        if created:
+            if collection_ids:
+                manifest.collections.add(*collection_ids)
+        else:
+            manifest.collections.set(collection_ids)
 
     return manifest
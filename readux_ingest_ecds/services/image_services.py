@@ -0,0 +1,263 @@
+""" Module of service methods for converting images and making derivatives of them. """
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from time import perf_counter
+from uuid import uuid4
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from readux_ingest_ecds.memory import MB
+
+LOGGER = logging.getLogger(__name__)
+
+CONVERSIONS = ('lambda', 'local')
+
+def local_conversion():
+    """Check if images are converted in the ingest task instead of by the AWS Lambda.
+    Set by `INGEST_IMAGE_CONVERSION`, "lambda" (default) or "local".
+
+    :rtype: bool
+    """
+    conversion = getattr(settings, 'INGEST_IMAGE_CONVERSION', 'lambda')
+    if conversion not in CONVERSIONS:
+        raise ImproperlyConfigured(f'INGEST_IMAGE_CONVERSION must be one of {", ".join(CONVERSIONS)}, not {conversion}')
+    return conversion == 'local'
+
+def conversion_workers():
+    """Number of threads that convert images, `INGEST_CONVERSION_WORKERS` or one per CPU.
+
+    :rtype: int
+    """
+    return getattr(settings, 'INGEST_CONVERSION_WORKERS', None) or os.cpu_count() or 1
+
+def converted_directory():
+    """Directory the image server reads pyramidal TIFFs from, `INGEST_CONVERTED_DIR`.
+
+    :raises ImproperlyConfigured: When the setting is missing or pyvips is not installed.
+    :rtype: str
+    """
+    try:
+        import pyvips # pylint: disable = import-outside-toplevel, unused-import
+    except ImportError as error:
+        raise ImproperlyConfigured(
+            'Converting images locally needs pyvips. Install it with "pip install readux-ingest-ecds[vips]".'
+        ) from error
+    directory = getattr(settings, 'INGEST_CONVERTED_DIR', None)
+    if directory is None:
+        raise ImproperlyConfigured('INGEST_CONVERTED_DIR must be set to convert images locally.')
+    return directory
+
+def tiff_path(image_path, directory):
+    """Path of the pyramidal TIFF for an image, named like the canvas pid.
+
+    :param image_path: Image waiting in `INGEST_PROCESSING_DIR`
+    :type image_path: str
+    :param directory: Directory for converted images
+    :type directory: str
+    :rtype: str
+    """
+    return os.path.join(directory, f'{os.path.splitext(os.path.basename(image_path))[0]}.tiff')
+
+@contextmanager
+def partial_file(target_path):
+    """Path of a new file next to the target, renamed to the target when the block finishes.
+
+    Each call gets its own name, so ingests converting the same content at the same time
+    never write to one partial file. The partial file is removed if the block fails.
+
+    :param target_path: Where the finished file goes
+    :type target_path: str
+    :rtype: str
+    """
+    partial_path = f'{target_path}.{uuid4().hex}.part'
+    try:
+        yield partial_path
+        os.replace(partial_path, target_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+def convert_image(image_path, target_path):
+    """Save an image as a tiled, JPEG compressed pyramidal TIFF. The TIFF is written next
+    to the target and renamed, so the image server never sees a partial file.
+
+    :param image_path: Image to convert
+    :type image_path: str
+    :param target_path: Where to save the TIFF
+    :type target_path: str
+    :return: Size of the source image in bytes
+    :rtype: int
+    """
+    import pyvips # pylint: disable = import-outside-toplevel
+
+    image = pyvips.Image.new_from_file(image_path, access='sequential')
+    with partial_file(target_path) as partial_path:
+        image.tiffsave(
+            partial_path,
+            tile=True,
+            tile_width=256,
+            tile_height=256,
+            pyramid=True,
+            compression='jpeg',
+            Q=90
+        )
+    return os.path.getsize(image_path)
+
+def convert_images(image_paths, workers=None, targets=None):
+    """Convert images to pyramidal TIFFs in a pool of threads.
+
+    libvips releases the GIL while it works, so threads convert side by side. Unlike
+    processes, they can also be started from celery's prefork workers, which are daemonic
+    and may not have child processes.
+
+    :param image_paths: Images to convert
+    :type image_paths: list
+    :param workers: Number of threads, defaults to `conversion_workers()`
+    :type workers: int, optional
+    :param targets: Where to save each TIFF, defaults to None for `tiff_path()` in `INGEST_CONVERTED_DIR`
+    :type targets: list, optional
+    :return: Images and bytes converted, seconds taken and throughput
+    :rtype: dict
+    """
+    directory = converted_directory()
+    os.makedirs(directory, exist_ok=True)
+    workers = min(workers or conversion_workers(), len(image_paths)) or 1
+    if targets is None:
+        targets = [tiff_path(image_path, directory) for image_path in image_paths]
+
+    start = perf_counter()
+    if workers == 1:
+        sizes = list(map(convert_image, image_paths, targets))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            sizes = list(pool.map(convert_image, image_paths, targets))
+    seconds = perf_counter() - start
+
+    stats = {
+        'images': len(sizes),
+        'bytes': sum(sizes),
+        'workers': workers,
+        'seconds': round(seconds, 6),
+        'images_per_second': round(len(sizes) / seconds, 2) if seconds else 0,
+        'mb_per_second': round(sum(sizes) / MB / seconds, 2) if seconds else 0,
+    }
+    LOGGER.info(
+        f'INGEST: Converted {stats["images"]} images with {workers} workers in {stats["seconds"]}s, '
+        f'{stats["images_per_second"]} images/s, {stats["mb_per_second"]} MB/s'
+    )
+    return stats
+
+def derivative_sizes():
+    """Longest side in pixels of each derivative made of every image, by name, from
+    `INGEST_DERIVATIVES`. Empty (default) makes none.
+
+    :rtype: dict
+    """
+    return getattr(settings, 'INGEST_DERIVATIVES', {})
+
+def derivatives_directory():
+    """Where derivatives are saved, `INGEST_DERIVATIVES_DIR` or "derivatives" in `INGEST_PROCESSING_DIR`.
+
+    :rtype: str
+    """
+    return getattr(settings, 'INGEST_DERIVATIVES_DIR', None) or os.path.join(settings.INGEST_PROCESSING_DIR, 'derivatives')
+
+def make_derivatives(image_path, sizes, directory):
+    """Save scaled down JPEGs of an image in a directory for each size, largest first so
+    each one is scaled from the one before.
+
+    :param image_path: Image to scale
+    :type image_path: str
+    :param sizes: Longest side in pixels, by name
+    :type sizes: dict
+    :param directory: Directory with a subdirectory for each name
+    :type directory: str
+    :return: Number of derivatives saved
+    :rtype: int
+    """
+    from PIL import Image # pylint: disable = import-outside-toplevel
+
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    largest = max(sizes.values())
+    with Image.open(image_path) as original:
+        # Lets JPEGs decode at a fraction of their full size.
+        original.draft('RGB', (largest, largest))
+        image = original.convert('RGB')
+    for label, size in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+        image.thumbnail((size, size))
+        target_path = os.path.join(directory, label, f'{name}.jpg')
+        with partial_file(target_path) as partial_path:
+            image.save(partial_path, 'JPEG', quality=85)
+    return len(sizes)
+
+class Derivatives:
+    """Make derivatives of images as they are extracted, in a pool of threads.
+
+    Images are added while the rest of the bundle is still being extracted. Leaving the
+    block waits for the pool. A derivative that fails is logged and counted in `failed`
+    and does not stop the ingest; the image server can still make it on request. When the
+    block raises, images not finished yet are counted as failed and the pool is left to
+    stop on its own, so the error is not held up by images still being scaled.
+
+    Pillow releases the GIL to decode, scale and encode, so threads work side by side,
+    and unlike processes they can be started in celery's daemonic prefork workers.
+
+    :param workers: Number of threads, defaults to `INGEST_DERIVATIVE_WORKERS` or one per CPU
+    :type workers: int, optional
+    """
+    def __init__(self, workers=None):
+        self.sizes = derivative_sizes()
+        self.directory = derivatives_directory()
+        self.workers = workers or getattr(settings, 'INGEST_DERIVATIVE_WORKERS', None) or os.cpu_count() or 1
+        self.pool = None
+        self.futures = {}
+        self.made = 0
+        self.failed = 0
+
+    def __enter__(self):
+        if not self.sizes:
+            return self
+        for label in self.sizes:
+            os.makedirs(os.path.join(self.directory, label), exist_ok=True)
+        if self.workers > 1:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.pool is None:
+            return False
+        if exc_type is not None:
+            for future, image_path in self.futures.items():
+                if future.done() and not future.cancelled():
+                    self._collect(image_path, future.result)
+                else:
+                    future.cancel()
+                    self.failed += 1
+            self.pool.shutdown(wait=False)
+        else:
+            for future, image_path in self.futures.items():
+                self._collect(image_path, future.result)
+            self.pool.shutdown(wait=True)
+        self.pool = None
+        return False
+
+    def add(self, image_path):
+        """Make the derivatives of an image, in the pool when there is one.
+
+        :param image_path: Extracted image
+        :type image_path: str
+        """
+        if not self.sizes:
+            return
+        if self.pool is None:
+            self._collect(image_path, lambda: make_derivatives(image_path, self.sizes, self.directory))
+        else:
+            self.futures[self.pool.submit(make_derivatives, image_path, self.sizes, self.directory)] = image_path
+
+    def _collect(self, image_path, result):
+        try:
+            self.made += result()
+        except Exception as error: # pylint: disable = broad-except
+            self.failed += 1
+            LOGGER.warning(f'INGEST: Could not make derivatives of {image_path}: {error}')
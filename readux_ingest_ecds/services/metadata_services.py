@@ -1,38 +1,150 @@
 """ Module of service methods for ingest files. """
+import os
+import logging
+from functools import lru_cache, partial
+from django.core.exceptions import ValidationError
 from readux_ingest_ecds.helpers import get_iiif_models
 from mimetypes import guess_type
-from tablib.core import Dataset
 
-Manifest = get_iiif_models()['Manifest']
-RelatedLink = get_iiif_models()['RelatedLink']
+LOGGER = logging.getLogger(__name__)
 
 def clean_metadata(metadata):
-    """Remove keys that do not align with Manifest fields.
+    """Remove keys that do not align with Manifest fields and coerce the values for the
+    fields. An empty cell for a field that is not text is None when the field allows null,
+    and is left out otherwise so the field keeps its default.
 
-    :param metadata:
-    :type metadata: tablib.Dataset
+    :param metadata: One row of metadata keyed by column header, eg. from `metadata_from_file()`
+    :type metadata: dict
     :return: Dictionary with keys matching Manifest fields
     :rtype: dict
     """
-    metadata = {key.casefold().replace(' ', '_'): value for key, value in metadata.items()}
-    fields = [f.name for f in get_iiif_models()['Manifest']._meta.get_fields()]
-    invalid_keys = []
-
-    for key in metadata.keys():
-        if key != 'metadata' and isinstance(metadata[key], list):
-            if isinstance(metadata[key][0], dict):
-                for meta_key in metadata[key][0].keys():
-                    if 'value' in meta_key:
-                        metadata[key] = metadata[key][0][meta_key]
-            else:
-                metadata[key] = ', '.join(metadata[key])
-        if key not in fields:
-            invalid_keys.append(key)
+    return get_field_mapper().map(metadata)
 
-    for invalid_key in invalid_keys:
-        metadata.pop(invalid_key)
+@lru_cache(maxsize=1024)
+def normalize_header(header):
+    """Header of a metadata column as a field name, eg. "Published Date" is "published_date"."""
+    return str(header).strip().casefold().replace(' ', '_')
 
-    return metadata
+def flatten_value(value):
+    """Turn a list from a metadata file into a single value.
+
+    A list of dicts, eg. `[{"label": "Author", "value": "Rosalind"}]`, becomes the
+    first dict's value. Any other list is joined with commas.
+    """
+    if not value:
+        return value
+    if isinstance(value[0], dict):
+        for key in value[0].keys():
+            if 'value' in key:
+                value = value[0][key]
+        return value
+    return ', '.join(str(item) for item in value)
+
+SKIP = object()
+
+class ManifestFieldMapper:
+    """Maps rows of metadata to Manifest fields.
+
+    Everything that only depends on the model, which columns are fields and how to coerce
+    their values, is worked out once when the mapper is made. Use `get_field_mapper()`
+    for the mapper of the configured Manifest model.
+
+    :param model: Model the metadata is for
+    :type model: django.db.models.Model
+    """
+    def __init__(self, model):
+        self.model = model
+        self.coercers = {
+            field.name: self.coercer(field)
+            for field in model._meta.get_fields()
+            # Relations can't be set from a spreadsheet cell.
+            if field.concrete and not field.is_relation
+        }
+        self.fields = frozenset(self.coercers)
+        self._plans = {}
+
+    def coercer(self, field):
+        """Function to convert a value from a metadata file for a field."""
+        if field.get_internal_type() == 'JSONField':
+            return None
+        if field.get_internal_type() in ('CharField', 'TextField', 'SlugField', 'URLField', 'EmailField'):
+            return partial(self._coerce_text, field.null)
+        return partial(self._coerce_typed, field)
+
+    @staticmethod
+    def _coerce_text(null, value):
+        if isinstance(value, list):
+            value = flatten_value(value)
+        if value is None:
+            return None if null else ''
+        return value if isinstance(value, str) else str(value)
+
+    @staticmethod
+    def _coerce_typed(field, value):
+        if isinstance(value, list):
+            value = flatten_value(value)
+        if value is None or value == '':
+            # Leave the field's default for an empty cell.
+            return None if field.null else SKIP
+        try:
+            return field.to_python(value)
+        except ValidationError:
+            LOGGER.warning(f'INGEST: Ignoring metadata "{value}" for {field.name}: not a valid {field.get_internal_type()}')
+            return SKIP
+
+    def plan(self, headers):
+        """Which columns to keep and how to coerce them, worked out once for each set of headers.
+
+        :param headers: Column headers of a row
+        :type headers: tuple
+        :return: Tuples of header, field name and coercer
+        :rtype: tuple
+        """
+        plan = self._plans.get(headers)
+        if plan is None:
+            plan = tuple(
+                (header, normalize_header(header), self.coercers[normalize_header(header)])
+                for header in headers
+                if normalize_header(header) in self.fields
+            )
+            self._plans[headers] = plan
+        return plan
+
+    def map(self, row):
+        """Manifest fields and values for one row.
+
+        :param row: Row of metadata keyed by column header
+        :type row: dict
+        :return: Dictionary with keys matching Manifest fields
+        :rtype: dict
+        """
+        metadata = {}
+        for header, field_name, coerce in self.plan(tuple(row)):
+            value = row[header] if coerce is None else coerce(row[header])
+            if value is not SKIP:
+                metadata[field_name] = value
+        return metadata
+
+    def map_rows(self, rows):
+        """Manifest fields and values for each row.
+
+        :param rows: Rows of metadata keyed by column header
+        :type rows: list
+        :return: List of dictionaries with keys matching Manifest fields
+        :rtype: list
+        """
+        return [self.map(row) for row in rows]
+
+@lru_cache(maxsize=None)
+def _field_mapper(model):
+    return ManifestFieldMapper(model)
+
+def get_field_mapper():
+    """Shared mapper for the Manifest model set by `IIIF_MANIFEST_MODEL`.
+
+    :rtype: ManifestFieldMapper
+    """
+    return _field_mapper(get_iiif_models()['Manifest'])
 
 def get_metadata_from(files):
     """
@@ -40,6 +152,8 @@ def get_metadata_from(files):
     :return: If metadata file exists, returns the values. If no file, returns None.
     :rtype: list or None
     """
+    from tablib.core import Dataset
+
     metadata = None
     for file in files:
         if metadata is not None:
@@ -55,23 +169,161 @@ def get_metadata_from(files):
     return metadata
 
 def metadata_from_file(metadata_file):
-    format = metadata_file_format(metadata_file)
-    if format is None:
+    rows = iter_metadata_rows(metadata_file)
+    if rows is None:
         return
 
-    metadata = None
+    # Only the first row is used, so stop reading there.
+    first_row = next(rows, None)
+    if hasattr(rows, 'close'):
+        rows.close()
+    if first_row is None:
+        return
+
+    return clean_metadata(first_row)
+
+def metadata_rows(metadata_file):
+    """Read every row of a metadata spreadsheet.
+
+    :param metadata_file: Path to CSV, TSV, or Excel file
+    :type metadata_file: str
+    :return: List of dicts keyed by the header row or None if the format is not supported.
+    :rtype: list, None
+    """
+    rows = iter_metadata_rows(metadata_file)
+    if rows is None:
+        return None
+
+    return list(rows)
+
+def iter_metadata_rows(metadata_file):
+    """Iterate over the rows of a metadata spreadsheet.
+
+    :param metadata_file: Path to CSV, TSV, or Excel file
+    :type metadata_file: str
+    :return: Iterator of dicts keyed by the header row or None if the format is not supported.
+    :rtype: iterator, None
+    """
+    format = metadata_file_format(metadata_file)
+    if format is None:
+        return None
 
     if format == 'excel':
-        with open(metadata_file, 'rb') as fh:
-            metadata = Dataset().load(fh.read(), format=metadata_file.split('.')[-1])
-    else:
-        with open(metadata_file, 'r', encoding="utf-8-sig") as fh:
-            metadata = Dataset().load(fh.read(), format=format)
+        return iter_excel_rows(metadata_file)
 
-    if metadata is not None:
-        metadata = clean_metadata(metadata.dict[0])
+    from tablib.core import Dataset
 
-    return metadata
+    with open(metadata_file, 'r', encoding="utf-8-sig") as fh:
+        metadata = Dataset().load(fh.read(), format=format)
+
+    return iter(metadata.dict)
+
+def iter_excel_rows(metadata_file):
+    """Stream the rows of the first sheet in an Excel file.
+
+    The workbook is opened read-only, so cells are parsed as the rows are read
+    instead of loading the whole workbook into memory first.
+
+    :param metadata_file: Path to an Excel file
+    :type metadata_file: str
+    :return: Dicts keyed by the header row. Empty rows are skipped.
+    :rtype: iterator
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(metadata_file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = next(rows, None)
+        if headers is None:
+            return
+        for values in rows:
+            if all(value is None for value in values):
+                continue
+            yield {
+                header: values[index] if index < len(values) else None
+                for index, header in enumerate(headers)
+                if header is not None
+            }
+    finally:
+        workbook.close()
+
+# Extensions of bundle files, longest first, left off file names to match them to pids.
+BUNDLE_EXTENSIONS = ('.tar.bz2', '.tar.gz', '.tar.xz', '.tbz2', '.tar', '.tgz', '.txz', '.zip')
+
+class DuplicateMetadata(Exception):
+    """Raised when more than one row of a metadata spreadsheet is for the same volume."""
+    pass # pylint: disable=unnecessary-pass
+
+class MetadataSheet:
+    """Rows of a metadata spreadsheet for a batch of volumes, indexed by "pid" and "filename".
+
+    Different rows with the same pid or file name are logged, and looking the volume up
+    raises `DuplicateMetadata`, so two bundles are never given the same row.
+
+    :param rows: Rows from the spreadsheet
+    :type rows: list
+    """
+    index_columns = ('pid', 'filename')
+
+    def __init__(self, rows):
+        self.index = {}
+        self.duplicates = {}
+        for position, (row, metadata) in enumerate(zip(rows, get_field_mapper().map_rows(rows))):
+            for header, value in row.items():
+                if not value or normalize_header(header) not in self.index_columns:
+                    continue
+                key = self.key(value)
+                first, _ = self.index.setdefault(key, (position, metadata))
+                if first != position:
+                    self.duplicates.setdefault(key, {first}).add(position)
+        for key, positions in self.duplicates.items():
+            LOGGER.warning(f'INGEST: Metadata rows {", ".join(str(row + 1) for row in sorted(positions))} are all for {key}')
+
+    def __len__(self):
+        return len(self.index)
+
+    @staticmethod
+    def key(value):
+        """Normalize a pid or file name, eg. "SQN_75.zip" and "sqn-75" are the same. Only
+        bundle extensions are left off, so "sqn75.v1" and "sqn75.v2" are not."""
+        key = os.path.basename(str(value).strip()).casefold()
+        for extension in BUNDLE_EXTENSIONS:
+            if key.endswith(extension):
+                key = key[:-len(extension)]
+                break
+        return key.replace('_', '-')
+
+    def get(self, value):
+        """Metadata for a volume.
+
+        :param value: pid or file name of the volume's bundle
+        :type value: str
+        :return: Cleaned metadata or an empty dict
+        :rtype: dict
+        :raises DuplicateMetadata: When more than one row is for the volume
+        """
+        key = self.key(value)
+        if key in self.duplicates:
+            rows = ', '.join(str(row + 1) for row in sorted(self.duplicates[key]))
+            raise DuplicateMetadata(f'Metadata rows {rows} are all for {value}')
+        return dict(self.index[key][1]) if key in self.index else {}
+
+def load_metadata_sheet(metadata_file):
+    """Read and index a metadata spreadsheet. Each file is only read once per process,
+    unless it changes.
+
+    :param metadata_file: Path to CSV, TSV, or Excel file
+    :type metadata_file: str
+    :return: Indexed rows
+    :rtype: MetadataSheet
+    """
+    stat = os.stat(metadata_file)
+    return _load_metadata_sheet(os.path.abspath(metadata_file), stat.st_mtime_ns, stat.st_size)
+
+@lru_cache(maxsize=16)
+def _load_metadata_sheet(metadata_file, modified, size): # pylint: disable = unused-argument
+    return MetadataSheet(metadata_rows(metadata_file) or [])
 
 def metadata_file_format(file_path):
     """Get format used to read the metadata file
@@ -86,6 +338,9 @@ def metadata_file_format(file_path):
 
     file_type = guess_type(file_path)[0]
 
+    if file_type is None:
+        return None
+
     if 'csv' in file_type:
         return 'csv'
     elif 'tab-separated' in file_type:
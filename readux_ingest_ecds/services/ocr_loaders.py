@@ -0,0 +1,127 @@
+""" Ways to insert OCR rows into the database. """
+import logging
+from datetime import date, datetime, time
+from django.conf import settings
+from django.db import connections, router
+
+LOGGER = logging.getLogger(__name__)
+
+LOADERS = ('bulk_create', 'copy')
+
+def use_copy(model):
+    """Check if rows for a model should be loaded with COPY.
+
+    True when `INGEST_OCR_LOADER` is "copy" and the model's database is PostgreSQL.
+
+    :param model: Model the rows are for
+    :type model: django.db.models.Model
+    :rtype: bool
+    """
+    if getattr(settings, 'INGEST_OCR_LOADER', 'bulk_create') != 'copy':
+        return False
+    return connections[router.db_for_write(model)].vendor == 'postgresql'
+
+def load_objects(model, objs, batch_size=None):
+    """Insert unsaved objects with COPY when `use_copy()` allows it, otherwise with `bulk_create`.
+
+    Unlike `bulk_create`, COPY does not set the primary keys of the objects.
+
+    :param model: Model of the objects
+    :type model: django.db.models.Model
+    :param objs: Unsaved objects
+    :type objs: list
+    :param batch_size: Objects per query for `bulk_create`, defaults to None for all at once
+    :type batch_size: int, optional
+    """
+    if use_copy(model):
+        copy_objects(model, objs)
+    else:
+        model.objects.bulk_create(objs, batch_size=batch_size)
+
+def copy_objects(model, objs):
+    """Stream objects to PostgreSQL with `COPY ... FROM STDIN`.
+
+    Values are prepared the same way `save()` prepares them, with each field's
+    `pre_save` and `get_db_prep_save`.
+
+    :param model: Model of the objects
+    :type model: django.db.models.Model
+    :param objs: Unsaved objects
+    :type objs: iterable
+    """
+    connection = connections[router.db_for_write(model)]
+    fields = copy_fields(model)
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    sql = f'COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) FROM STDIN'
+
+    with connection.cursor() as cursor:
+        # The Django cursor wraps psycopg2's, which has `copy_expert`.
+        cursor.cursor.copy_expert(sql, RowStream(copy_rows(objs, fields, connection)))
+
+def copy_fields(model):
+    """Concrete fields to copy. An auto-incrementing primary key is left to the database."""
+    return [
+        field for field in model._meta.concrete_fields
+        if not (field.primary_key and field.get_internal_type() in ('AutoField', 'BigAutoField', 'SmallAutoField'))
+    ]
+
+def copy_rows(objs, fields, connection):
+    """Lines of COPY's text format for the objects.
+
+    :return: One line per object
+    :rtype: iterator
+    """
+    for obj in objs:
+        yield '\t'.join(
+            copy_value(field.get_db_prep_save(field.pre_save(obj, True), connection))
+            for field in fields
+        ) + '\n'
+
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+def copy_value(value):
+    """A database value as text for COPY.
+
+    :param value: Value from `get_db_prep_save`
+    :return: Escaped text, `\\N` for NULL
+    :rtype: str
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    if hasattr(value, 'dumps') and hasattr(value, 'adapted'):
+        # psycopg2's Json adapter for JSONField values.
+        value = value.dumps(value.adapted)
+    return str(value).translate(COPY_ESCAPES)
+
+class RowStream:
+    """Read-only file-like object over lines, so rows are written to COPY as they are made
+    instead of building the whole input in memory first.
+
+    :param lines: Lines of text
+    :type lines: iterator
+    """
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.buffer += line
+        if size < 0:
+            chunk, self.buffer = self.buffer, ''
+        else:
+            chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+    def readline(self, size=-1): # pylint: disable = unused-argument
+        if self.buffer:
+            chunk, self.buffer = self.buffer, ''
+            return chunk
+        return next(self.lines, '')
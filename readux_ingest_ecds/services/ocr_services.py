@@ -1,16 +1,14 @@
-import httpretty
 import json
 import csv
 import re
 import tempfile
-from os import environ, path, unlink, remove
+from os import unlink
 from io import BytesIO
 import logging
-from hocr_spec import HocrValidator
-from lxml import etree
-from django.conf import settings
-from django.core.serializers import deserialize
 from readux_ingest_ecds.helpers import get_iiif_models
+from readux_ingest_ecds.metrics import timed
+from .ocr_loaders import load_objects
+from .ocr_sources import ocr_source_for
 from .services import fetch_url
 
 LOGGER = logging.getLogger(__name__)
@@ -27,21 +25,64 @@ class HocrValidationError(Exception):
     """Exception for hOCR validation errors."""
     pass # pylint: disable=unnecessary-pass
 
-def get_ocr(canvas):
+def get_ocr(canvas, metrics=None, source=None):
     """Function to determine method for fetching OCR for a canvas.
 
     :param canvas: Canvas object
     :type canvas: apps.iiif.canvases.models.Canvas
+    :param metrics: Where to record fetch and parse timings, defaults to None
+    :type metrics: readux_ingest_ecds.metrics.IngestMetrics, optional
+    :param source: Where to fetch the OCR from, defaults to None to pick one for the canvas' manifest
+    :type source: readux_ingest_ecds.services.ocr_sources.OcrSource, optional
+    :return: List of dicts of parsed OCR data.
+    :rtype: list
+    """
+    source = source or ocr_source_for(canvas.manifest)
+    with timed(metrics, 'ocr_fetch'):
+        result = source.fetch(canvas)
+
+    return parse_ocr(canvas, result, metrics)
+
+def fetch_ocr(source, canvases, metrics=None):
+    """Fetch OCR for many canvases using the source's concurrency.
+
+    :param source: Where to fetch the OCR from
+    :type source: readux_ingest_ecds.services.ocr_sources.OcrSource
+    :param canvases: Canvases of the source's manifest
+    :type canvases: iterable
+    :param metrics: Where to record the time spent waiting for OCR, defaults to None
+    :type metrics: readux_ingest_ecds.metrics.IngestMetrics, optional
+    :return: Tuples of canvas and raw OCR data
+    :rtype: iterator
+    """
+    results = source.fetch_many(canvases)
+    while True:
+        with timed(metrics, 'ocr_fetch'):
+            fetched = next(results, None)
+        if fetched is None:
+            return
+        yield fetched
+
+def parse_ocr(canvas, result, metrics=None):
+    """Parse OCR fetched for a canvas.
+
+    :param canvas: Canvas object
+    :type canvas: apps.iiif.canvases.models.Canvas
+    :param result: Raw OCR data
+    :param metrics: Where to record parse timings, defaults to None
+    :type metrics: readux_ingest_ecds.metrics.IngestMetrics, optional
     :return: List of dicts of parsed OCR data.
     :rtype: list
     """
     if canvas.default_ocr == "line":
-        result = fetch_tei_ocr(canvas)
-        return parse_tei_ocr(result)
+        with timed(metrics, 'ocr_parse'):
+            return parse_tei_ocr(result)
 
-    result = fetch_positional_ocr(canvas)
+    if metrics is not None and isinstance(result, (str, bytes)):
+        metrics.incr('bytes', len(result))
 
-    return add_positional_ocr(canvas, result)
+    with timed(metrics, 'ocr_parse'):
+        return add_positional_ocr(canvas, result)
 
 def fetch_tei_ocr(canvas):
     """Function to fetch TEI OCR data for a given canvas.
@@ -51,14 +92,7 @@ def fetch_tei_ocr(canvas):
     :return: Positional OCR data
     :rtype: requests.models.Response
     """
-    if 'archivelab' in canvas.manifest.image_server.server_base:
-        return None
-    url = "{p}{c}/datastreams/tei/content".format(
-        p=settings.DATASTREAM_PREFIX,
-        c=canvas.pid.replace('fedora:', '')
-    )
-
-    return fetch_url(url, data_format='text/plain')
+    return ocr_source_for(canvas.manifest).fetch_tei(canvas)
 
 def fetch_positional_ocr(canvas):
     """Function to get OCR for a canvas depending on the image's source.
@@ -68,68 +102,7 @@ def fetch_positional_ocr(canvas):
     :return: Positional OCR data
     :rtype: requests.models.Response
     """
-    if 'archivelab' in canvas.manifest.image_server.server_base:
-        if '$' in canvas.pid:
-            pid = str(int(canvas.pid.split('$')[-1]) - canvas.ocr_offset)
-        else:
-            pid = canvas.pid
-
-        url = f"https://api.archivelab.org/books/{canvas.manifest.pid}/pages/{pid}/ocr?mode=words"
-
-        if environ['DJANGO_ENV'] == 'test':
-            fake_ocr = open(path.join(settings.FIXTURE_DIR, 'ocr_words.json'))
-            words = fake_ocr.read()
-            httpretty.enable()
-            httpretty.register_uri(httpretty.GET, url, body=words)
-
-        return fetch_url(url)
-
-    if 'images.readux.ecds.emory' in canvas.manifest.image_server.server_base:
-        # Fake TSV data for testing.
-        if environ['DJANGO_ENV'] == 'test':
-            fake_tsv = open(path.join(settings.FIXTURE_DIR, 'sample.tsv'))
-            tsv = fake_tsv.read()
-            url = "https://raw.githubusercontent.com/ecds/ocr-bucket/master/{m}/boo.tsv".format(
-                m=canvas.manifest.pid
-            )
-            httpretty.enable()
-            httpretty.register_uri(httpretty.GET, url, body=tsv)
-
-        if canvas.ocr_file_path is None:
-            return fetch_url(
-                "https://raw.githubusercontent.com/ecds/ocr-bucket/master/{m}/{p}.tsv".format(
-                    m=canvas.manifest.pid,
-                    p=canvas.pid.split('_')[-1]
-                    .replace('.jp2', '')
-                    .replace('.jpg', '')
-                    .replace('.tif', '')
-                ),
-                data_format='text'
-            )
-
-    url = "{p}{c}{s}".format(
-        p=settings.DATASTREAM_PREFIX,
-        c=canvas.pid.replace('fedora:', ''),
-        s=settings.DATASTREAM_SUFFIX
-    )
-
-    if (
-        environ['DJANGO_ENV'] == 'test'
-        and 'images.readux.ecds.emory' not in canvas.manifest.image_server.server_base
-        and canvas.ocr_file_path is None
-    ):
-        fake_json = open(path.join(settings.FIXTURE_DIR, 'ocr_words.json'))
-        words = fake_json.read()
-        httpretty.enable(allow_net_connect=True)
-        httpretty.register_uri(httpretty.GET, url, body=words)
-
-    if canvas.ocr_file_path is not None:
-        if canvas.image_server.storage_service == 's3':
-            return canvas.image_server.bucket.Object(canvas.ocr_file_path).get()['Body'].read()
-
-        if canvas.image_server.storage_service == 'local':
-            with open(canvas.ocr_file_path, 'r') as ocr:
-                return ocr.read()
+    return ocr_source_for(canvas.manifest).fetch_positional(canvas)
 
 def parse_alto_ocr(result):
     """Function to parse fetched ALTO OCR data for a given canvas.
@@ -141,6 +114,8 @@ def parse_alto_ocr(result):
     """
     if result is None:
         return None
+    from lxml import etree
+
     ocr = []
     unvalidated_root = etree.fromstring(result)
     if 'ns-v2' in unvalidated_root.tag:
@@ -178,6 +153,9 @@ def parse_hocr_ocr(result):
     :return: Parsed OCR data
     :rtype: list
     """
+    from hocr_spec import HocrValidator
+    from lxml import etree
+
     if isinstance(result, bytes):
         as_string = result.decode('utf-8')
     else:
@@ -267,6 +245,8 @@ def parse_tei_ocr(result):
     """
     if result is None:
         return None
+    from lxml import etree
+
     ocr = []
     parser = etree.XMLParser(schema = etree.XMLSchema(file='xml_schema/tei_all.xsd'))
     # The following will raise etree.XMLSyntaxError if invalid
@@ -361,6 +341,8 @@ def parse_xml_ocr(result):
     :return: Parsed OCR data
     :rtype: list
     """
+    from lxml import etree
+
     root = etree.fromstring(result)
     if (
         re.match(r'{[0-9A-Za-z.:/#-]+}alto|alto', root.tag)
@@ -374,7 +356,16 @@ def parse_xml_ocr(result):
         return parse_hocr_ocr(result)
     return None
 
-def add_ocr_annotations(canvas, ocr):
+def add_ocr_annotations(canvas, ocr, batch_size=None):
+    """Create OCR objects for parsed words.
+
+    :param canvas: Canvas object
+    :type canvas: apps.iiif.canvases.models.Canvas
+    :param ocr: Parsed OCR data
+    :type ocr: list
+    :param batch_size: Number of objects inserted per query, defaults to None for all at once
+    :type batch_size: int, optional
+    """
     word_order = 1
     annotations = []
     for word in ocr:
@@ -405,9 +396,12 @@ def add_ocr_annotations(canvas, ocr):
     # bulk_create does not call the model's save method. Saving the OCR annotation
     # at the same time as creating it is very slow for unknown reasons. Once this
     # method finishes, the next method that called will save all the new OCR annotations.
-    OCR.objects.bulk_create(annotations)
+    # On PostgreSQL, `INGEST_OCR_LOADER = 'copy'` streams the rows with COPY instead.
+    load_objects(OCR, annotations, batch_size=batch_size)
 
 def add_oa_annotations(annotation_list_url):
+    from django.core.serializers import deserialize
+
     data = fetch_url(annotation_list_url)
     for oa_annotation in data['resources']:
         anno = deserialize('annotation', oa_annotation)
@@ -435,18 +429,32 @@ def add_positional_ocr(canvas, result):
                 ocr = parse_fedora_ocr(result)
         elif is_tsv(result):
             ocr = parse_tsv_ocr(result)
-    elif canvas.ocr_file_path.endswith('.json'):
-        ocr = parse_dict_ocr(result)
-    elif canvas.ocr_file_path.endswith('.tsv') or canvas.ocr_file_path.endswith('.tab'):
-        ocr = parse_tsv_ocr(result)
-    elif canvas.ocr_file_path.endswith('.xml'):
-        ocr = parse_xml_ocr(result)
-    elif canvas.ocr_file_path.endswith('.hocr'):
-        ocr = parse_hocr_ocr(result)
+    else:
+        ocr = parse_ocr_file(canvas.ocr_file_path, result)
     if ocr:
         return ocr
     return None
 
+def parse_ocr_file(file_path, result):
+    """Parse the content of an OCR file by the file's extension.
+
+    :param file_path: Name or path of the OCR file
+    :type file_path: str
+    :param result: Content of the file
+    :type result: str or bytes
+    :return: Parsed OCR data, or None for extensions that are not parsed
+    :rtype: list
+    """
+    if file_path.endswith('.json'):
+        return parse_dict_ocr(result)
+    if file_path.endswith('.tsv') or file_path.endswith('.tab'):
+        return parse_tsv_ocr(result)
+    if file_path.endswith('.xml'):
+        return parse_xml_ocr(result)
+    if file_path.endswith('.hocr'):
+        return parse_hocr_ocr(result)
+    return None
+
 def is_json(to_test):
     """Function to test if data is shaped like JSON.
 
@@ -0,0 +1,223 @@
+""" Places to fetch OCR from, chosen once for each manifest. """
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from .file_services import s3_client
+from .services import fetch_url
+
+DEFAULT_OCR_SOURCES = [
+    'readux_ingest_ecds.services.ocr_sources.ArchiveLabSource',
+    'readux_ingest_ecds.services.ocr_sources.EmoryOcrBucketSource',
+    'readux_ingest_ecds.services.ocr_sources.StorageFileSource',
+]
+
+class OcrSource:
+    """Base class for places to fetch OCR from. Also used when no other source handles a
+    manifest: line OCR comes from the Fedora TEI datastream and there is no word OCR.
+
+    Subclasses set their own policies:
+
+    - `concurrency`: number of canvases fetched at the same time.
+    - `batch_size`: number of canvases handed to the fetchers at a time, which bounds how
+      much fetched OCR waits in memory to be parsed and saved.
+    - `cache_timeout`: seconds fetched OCR is kept in Django's default cache, so loading
+      the OCR again, eg. when the task is retried, does not fetch it again. 0 does not cache.
+
+    Anything that only depends on the manifest, eg. a storage bucket, is looked up once
+    when the source is made.
+
+    :param manifest: Manifest to fetch OCR for
+    :type manifest: Manifest
+    """
+    concurrency = 1
+    batch_size = 50
+    cache_timeout = 0
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+
+    @classmethod
+    def handles(cls, manifest): # pylint: disable = unused-argument
+        """Check if this source should be used for a manifest.
+
+        :param manifest: Manifest to fetch OCR for
+        :type manifest: Manifest
+        :rtype: bool
+        """
+        return True
+
+    def fetch(self, canvas):
+        """Fetch the OCR for a canvas.
+
+        :param canvas: Canvas object
+        :type canvas: Canvas
+        :return: Raw OCR data or None
+        """
+        if not self.cache_timeout:
+            return self.fetch_uncached(canvas)
+
+        key = f'readux_ingest_ecds:ocr:{type(self).__name__}:{self.manifest.pid}:{canvas.pid}:{canvas.default_ocr}'
+        ocr = cache.get(key)
+        if ocr is None:
+            ocr = self.fetch_uncached(canvas)
+            # OCR that could not be fetched is tried again next time.
+            if ocr is not None:
+                cache.set(key, ocr, self.cache_timeout)
+        return ocr
+
+    def fetch_uncached(self, canvas):
+        if canvas.default_ocr == 'line':
+            return self.fetch_tei(canvas)
+        return self.fetch_positional(canvas)
+
+    def fetch_many(self, canvases):
+        """Fetch the OCR for each canvas, `concurrency` at a time.
+
+        :param canvases: Canvases to fetch OCR for
+        :type canvases: iterable
+        :return: Tuples of canvas and raw OCR data, in the order of `canvases`
+        :rtype: iterator
+        """
+        if self.concurrency <= 1:
+            for canvas in canvases:
+                yield canvas, self.fetch(canvas)
+            return
+
+        canvases = iter(canvases)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while True:
+                batch = list(islice(canvases, self.batch_size))
+                if not batch:
+                    return
+                yield from zip(batch, pool.map(self.fetch, batch))
+
+    def fetch_tei(self, canvas):
+        url = "{p}{c}/datastreams/tei/content".format(
+            p=settings.DATASTREAM_PREFIX,
+            c=canvas.pid.replace('fedora:', '')
+        )
+        return self.request(url, data_format='text/plain')
+
+    def fetch_positional(self, canvas): # pylint: disable = unused-argument
+        return None
+
+    def request(self, url, data_format='json'):
+        """Get a URL. Test sources override this to serve fixtures."""
+        return fetch_url(url, data_format=data_format)
+
+class ArchiveLabSource(OcrSource):
+    """Word OCR from the Internet Archive's API for volumes served by archivelab."""
+    concurrency = 4
+    cache_timeout = 60 * 60 * 24
+
+    @classmethod
+    def handles(cls, manifest):
+        return manifest.image_server is not None and 'archivelab' in manifest.image_server.server_base
+
+    def fetch_tei(self, canvas):
+        return None
+
+    def fetch_positional(self, canvas):
+        if '$' in canvas.pid:
+            pid = str(int(canvas.pid.split('$')[-1]) - canvas.ocr_offset)
+        else:
+            pid = canvas.pid
+
+        return self.request(f"https://api.archivelab.org/books/{self.manifest.pid}/pages/{pid}/ocr?mode=words")
+
+class StorageFileSource(OcrSource):
+    """OCR files saved by an ingest to the image server's storage, S3 or the local disk.
+
+    S3 objects are fetched four at a time with the process' shared S3 client, which unlike
+    a boto3 resource is safe to use from the fetching threads. Local files are read one
+    after another.
+    """
+    @classmethod
+    def handles(cls, manifest):
+        return manifest.canvas_set.filter(ocr_file_path__isnull=False).exists()
+
+    def __init__(self, manifest):
+        super().__init__(manifest)
+        self.storage_service = manifest.image_server.storage_service if manifest.image_server else None
+        if self.storage_service == 's3':
+            self.concurrency = 4
+            # Only the name is kept; the image server's Bucket resource is not shared with the threads.
+            self.bucket_name = manifest.image_server.bucket.name
+
+    def fetch_positional(self, canvas):
+        if canvas.ocr_file_path is None:
+            return None
+
+        if self.storage_service == 's3':
+            return s3_client().get_object(Bucket=self.bucket_name, Key=canvas.ocr_file_path)['Body'].read()
+
+        if self.storage_service == 'local':
+            with open(canvas.ocr_file_path, 'r') as ocr:
+                return ocr.read()
+
+        return None
+
+class EmoryOcrBucketSource(StorageFileSource):
+    """TSV files in ECDS' ocr-bucket repository for volumes served from images.readux.ecds.emory.edu.
+    Canvases with an OCR file of their own use that instead.
+    """
+    base_url = 'https://raw.githubusercontent.com/ecds/ocr-bucket/master'
+    cache_timeout = 60 * 60 * 24
+
+    @classmethod
+    def handles(cls, manifest):
+        return manifest.image_server is not None and 'images.readux.ecds.emory' in manifest.image_server.server_base
+
+    def __init__(self, manifest):
+        super().__init__(manifest)
+        self.concurrency = 4
+
+    def fetch_positional(self, canvas):
+        if canvas.ocr_file_path is not None:
+            return super().fetch_positional(canvas)
+
+        return self.request(
+            "{b}/{m}/{p}.tsv".format(
+                b=self.base_url,
+                m=self.manifest.pid,
+                p=canvas.pid.split('_')[-1]
+                .replace('.jp2', '')
+                .replace('.jpg', '')
+                .replace('.tif', '')
+            ),
+            data_format='text'
+        )
+
+def ocr_source_for(manifest):
+    """Pick the source of OCR for a manifest from the `INGEST_OCR_SOURCES` setting.
+    The first source that handles the manifest is used.
+
+    :param manifest: Manifest to fetch OCR for
+    :type manifest: Manifest
+    :rtype: OcrSource
+    """
+    for source in get_ocr_sources():
+        if source.handles(manifest):
+            return source(manifest)
+    return OcrSource(manifest)
+
+@lru_cache(maxsize=None)
+def get_ocr_sources():
+    """Classes listed in the `INGEST_OCR_SOURCES` setting, in order.
+
+    :rtype: tuple
+    """
+    return tuple(
+        import_string(source) for source in getattr(settings, 'INGEST_OCR_SOURCES', DEFAULT_OCR_SOURCES)
+    )
+
+@receiver(setting_changed)
+def reset_ocr_sources(setting, **kwargs): # pylint: disable = unused-argument
+    """Reload the sources when the setting changes, eg. in tests."""
+    if setting == 'INGEST_OCR_SOURCES':
+        get_ocr_sources.cache_clear()
@@ -1,16 +1,31 @@
 """ Utility functions for fetching remote data. """
 import json
 import logging
+import threading
 import requests
 
 logger = logging.getLogger(__name__)
 logging.getLogger("urllib3").setLevel(logging.ERROR)
 
+# Reuse connections to the same hosts, eg. when fetching OCR for every page of a volume.
+# Each thread gets its own session, as OCR sources fetch from several threads at once and
+# requests does not promise a Session is safe to share between them.
+sessions = threading.local()
+
+def get_session():
+    """The calling thread's `requests.Session`, made on first use.
+
+    :rtype: requests.Session
+    """
+    if not hasattr(sessions, 'session'):
+        sessions.session = requests.Session()
+    return sessions.session
+
 def fetch_url(url, timeout=30, data_format='json', verbosity=1):
     """ Given a url, this function returns the data."""
     data = None
     try:
-        resp = requests.get(url, timeout=timeout, verify=True)
+        resp = get_session().get(url, timeout=timeout, verify=True)
     except requests.exceptions.Timeout as err:
         if verbosity > 2:
             logger.warning('Connection timeoutout for {}'.format(url))
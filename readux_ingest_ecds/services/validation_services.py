@@ -0,0 +1,195 @@
+""" Check a bundle's images and OCR before ingesting it, without touching the database. """
+import os
+import tarfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing import current_process
+from io import BytesIO
+from zipfile import BadZipFile
+from django.conf import settings
+from .bundles import open_bundle
+from .file_services import is_bundle_file, is_image, page_names
+
+# Enough of an image to reach the dimensions, past any EXIF or ICC profile before them.
+IMAGE_HEADER_BYTES = 1024 * 1024
+# Extensions `parse_ocr_file` reads. Other OCR files are ingested but no words are loaded.
+OCR_EXTENSIONS = ('.json', '.tsv', '.tab', '.xml', '.hocr')
+
+class InvalidBundle(Exception):
+    """Raised when a bundle that was checked before ingesting has problems."""
+    pass # pylint: disable=unnecessary-pass
+
+def validation_enabled():
+    """Bundles are checked as the first step of the ingest task when `INGEST_VALIDATE_BUNDLES` is True."""
+    return getattr(settings, 'INGEST_VALIDATE_BUNDLES', False)
+
+class ValidationReport:
+    """What was found in a bundle and what would stop it from ingesting. Warnings are
+    about files that ingest but may not be what was meant; they do not make it invalid.
+
+    :param bundle: Name of the bundle
+    :type bundle: str
+    """
+    def __init__(self, bundle):
+        self.bundle = bundle
+        self.images = 0
+        self.ocr_files = 0
+        self.words = 0
+        self.pages = {'images': set(), 'ocr': {}}
+        self.problems = []
+        self.warnings = []
+
+    @property
+    def valid(self):
+        return not self.problems
+
+    def problem(self, file_name, error):
+        self.problems.append({'file': file_name, 'error': error})
+
+    def warning(self, file_name, message):
+        self.warnings.append({'file': file_name, 'warning': message})
+
+    def add(self, result):
+        """Record the check of one file.
+
+        :param result: Returned by `check_file`
+        :type result: dict
+        """
+        name = os.path.basename(result['file'])
+        if result['kind'] == 'image':
+            self.images += 1
+            self.pages['images'].add(os.path.splitext(name)[0])
+        else:
+            self.ocr_files += 1
+            self.words += result.get('words', 0)
+            self.pages['ocr'][result['file']] = page_names(name)
+        if result.get('error'):
+            self.problem(result['file'], result['error'])
+        if result.get('warning'):
+            self.warning(result['file'], result['warning'])
+
+    def finish(self):
+        """Check the bundle as a whole once every file has been checked."""
+        if not self.images:
+            self.problem(self.bundle, 'No images found')
+        for file_name, names in self.pages['ocr'].items():
+            if not self.pages['images'].intersection(names):
+                self.problem(file_name, 'No image for this OCR file')
+        self.problems.sort(key=lambda problem: problem['file'])
+        self.warnings.sort(key=lambda warning: warning['file'])
+
+    def as_dict(self):
+        return {
+            'bundle': self.bundle,
+            'valid': self.valid,
+            'images': self.images,
+            'ocr_files': self.ocr_files,
+            'words': self.words,
+            'problems': list(self.problems),
+            'warnings': list(self.warnings),
+        }
+
+def check_file(file_name, content):
+    """Probe an image's header or parse an OCR file the way `add_ocr_task` will.
+
+    :param file_name: Path of the file in the bundle
+    :type file_name: str
+    :param content: The image's first `IMAGE_HEADER_BYTES`, or the whole OCR file
+    :type content: bytes
+    :return: Kind of file, and error, warning, dimensions or words found
+    :rtype: dict
+    """
+    if is_image(file_name):
+        from PIL import Image # pylint: disable = import-outside-toplevel
+
+        result = {'file': file_name, 'kind': 'image'}
+        try:
+            with Image.open(BytesIO(content)) as image:
+                result['width'], result['height'] = image.size
+        except Exception as error: # pylint: disable = broad-except
+            result['error'] = f'Not a readable image: {error}'
+            return result
+        if not result['width'] or not result['height']:
+            result['error'] = 'Image has no width or height'
+        return result
+
+    # Imported here so reading the models does not load the host's OCR model early.
+    from .ocr_services import parse_ocr_file # pylint: disable = import-outside-toplevel
+
+    result = {'file': file_name, 'kind': 'ocr'}
+    try:
+        ocr = parse_ocr_file(file_name, content)
+    except Exception as error: # pylint: disable = broad-except
+        result['error'] = f'{error.__class__.__name__}: {error}'
+        return result
+    extension = os.path.splitext(file_name)[1]
+    if extension not in OCR_EXTENSIONS:
+        # The ingest accepts the file, it just loads no words from it.
+        result['warning'] = f'OCR in {extension} files is not loaded'
+    result['words'] = len(ocr or [])
+    return result
+
+def read_member(bundle, member):
+    """The part of a file `check_file` needs."""
+    with bundle.open(member) as source:
+        return source.read(IMAGE_HEADER_BYTES) if is_image(member.filename) else source.read()
+
+def validate_bundle(source, workers=None, fail_fast=False):
+    """Read a bundle once and check every image and OCR file, in a pool of processes.
+
+    Images are only read as far as their headers. Nothing is extracted or saved. In a
+    daemonic process, eg. a celery prefork worker running the ingest task, which may not
+    start processes, the files are checked in a pool of threads instead.
+
+    :param source: Path of a directory or archive, or an uploaded archive
+    :type source: str or django.core.files.File
+    :param workers: Number of processes, defaults to `INGEST_VALIDATION_WORKERS` or one per CPU
+    :type workers: int, optional
+    :param fail_fast: Stop at the first problem, defaults to False
+    :type fail_fast: bool, optional
+    :rtype: ValidationReport
+    """
+    name = source if isinstance(source, str) else os.path.basename(source.name)
+    report = ValidationReport(name)
+    workers = workers or getattr(settings, 'INGEST_VALIDATION_WORKERS', None) or os.cpu_count() or 1
+    pool = None
+    if workers > 1:
+        pool_class = ThreadPoolExecutor if current_process().daemon else ProcessPoolExecutor
+        pool = pool_class(max_workers=workers)
+    pending = set()
+
+    def stop():
+        return fail_fast and not report.valid
+
+    def collect(futures):
+        for future in futures:
+            pending.discard(future)
+            report.add(future.result())
+
+    try:
+        with open_bundle(source) as bundle:
+            for member in bundle:
+                if not is_bundle_file(member.filename):
+                    continue
+                if pool is None:
+                    report.add(check_file(member.filename, read_member(bundle, member)))
+                else:
+                    # Keep a few files per process waiting, so a long tar stream is not held in memory.
+                    if len(pending) >= workers * 4:
+                        collect(wait(pending, return_when=FIRST_COMPLETED).done)
+                    pending.add(pool.submit(check_file, member.filename, read_member(bundle, member)))
+                    collect([future for future in pending if future.done()])
+                if stop():
+                    break
+            if not stop():
+                collect(wait(pending).done)
+    except (ValueError, BadZipFile, tarfile.TarError, OSError) as error:
+        report.problem(name, f'Could not read bundle: {error}')
+    finally:
+        if pool is not None:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+    if not stop():
+        report.finish()
+    return report
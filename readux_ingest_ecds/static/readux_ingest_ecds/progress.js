@@ -0,0 +1,42 @@
+// Poll the progress of an ingest until it finishes or fails.
+// Polling also stops when the progress cannot be read, or has not changed for STALE_AFTER.
+var STALE_AFTER = 30 * 60 * 1000;
+
+document.addEventListener('DOMContentLoaded', function() {
+  document.querySelectorAll('.ingest-progress[data-url]').forEach(function(element) {
+    if (!element.dataset.url) {
+      return;
+    }
+    var lastText = element.textContent;
+    var lastChange = Date.now();
+    var poll = function() {
+      fetch(element.dataset.url, {credentials: 'same-origin'})
+        .then(function(response) {
+          if (!response.ok) {
+            throw new Error(response.status + ' ' + response.statusText);
+          }
+          return response.json();
+        })
+        .then(function(data) {
+          var progress = data.progress || {};
+          element.textContent = data.text;
+          if (data.text !== lastText) {
+            lastText = data.text;
+            lastChange = Date.now();
+          }
+          if (progress.finished || progress.failed) {
+            return;
+          }
+          if (Date.now() - lastChange > STALE_AFTER) {
+            element.textContent = data.text + ' (no change for 30 minutes, reload to check again)';
+            return;
+          }
+          setTimeout(poll, 2000);
+        })
+        .catch(function(error) {
+          element.textContent = lastText + ' (could not check progress: ' + error.message + ')';
+        });
+    };
+    poll();
+  });
+});
@@ -2,25 +2,56 @@
 
 """ Common tasks for ingest. """
 import os
-from celery import Celery
+import logging
+from time import sleep
+from celery import chord
 from django.apps import apps
 from django.conf import settings
+from django.utils import timezone
+from .celery import INGEST_QUEUE, OCR_QUEUE, app, queue_options
 from .helpers import get_iiif_models
-from .services.ocr_services import get_ocr, add_ocr_annotations
+from .memory import MemoryBudgetExceeded
+from .metrics import IngestMetrics
+from .profiling import profile_task, profiling_enabled
+from .progress import Progress, record_delivery, record_failure
+from .reindex import reindex, reindex_deferred
+from .services.ocr_services import add_ocr_annotations, fetch_ocr, parse_ocr
+from .services.metadata_services import DuplicateMetadata
+from .services.ocr_sources import ocr_source_for
+from .services.validation_services import InvalidBundle, validation_enabled
+from .scratch import ScratchSpace, cleanup_enabled
+from .transactions import TransactionBatches
+
+LOGGER = logging.getLogger(__name__)
 
 # Use `apps.get_model` to avoid circular import error. Because the parameters used to
 # create a background task have to be serializable, we can't just pass in the model object.
 Local = apps.get_model('readux_ingest_ecds.local') # pylint: disable = invalid-name
+IngestReport = apps.get_model('readux_ingest_ecds.ingestreport') # pylint: disable = invalid-name
+Bulk = apps.get_model('readux_ingest_ecds.bulk') # pylint: disable = invalid-name
 
 Manifest = get_iiif_models()['Manifest']
 Canvas = get_iiif_models()['Canvas']
 OCR = get_iiif_models()['OCR']
 
-app = Celery('readux_ingest_ecds', result_extended=True)
-app.config_from_object('django.conf:settings')
-app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
+class WorkerLost(Exception):
+    """Exception raised when a task has been delivered again more than
+    `INGEST_MAX_DELIVERIES` times, because its worker was killed each time it ran."""
+    pass # pylint: disable=unnecessary-pass
+
+# Errors that happen again however often an ingest is tried.
+NOT_RETRIED = (MemoryBudgetExceeded, InvalidBundle, DuplicateMetadata, WorkerLost)
 
-@app.task(name='local_ingest_task_ecds', autoretry_for=(Exception,), retry_backoff=True, max_retries=20)
+@app.task(
+    name='local_ingest_task_ecds',
+    autoretry_for=(Exception,),
+    dont_autoretry_for=NOT_RETRIED,
+    retry_backoff=True,
+    max_retries=20,
+    # Ingests can be repeated: prep finds the manifest and canvases are updated in place.
+    # `check_deliveries` stops a volume that kills its worker from being delivered forever.
+    **queue_options(INGEST_QUEUE, redeliver=True)
+)
 def local_ingest_task_ecds(ingest_id):
     """Background task to start ingest process.
 
@@ -29,23 +60,269 @@ def local_ingest_task_ecds(ingest_id):
 
     """
     local_ingest = Local.objects.get(pk=ingest_id)
-    local_ingest.ingest()
+    try:
+        check_deliveries(local_ingest_task_ecds, local_ingest.get_report())
+        if local_ingest.manifest is None:
+            if validation_enabled():
+                # Before the manifest is made, so a broken bundle leaves nothing behind.
+                local_ingest.validate()
+            local_ingest.prep()
+        report = local_ingest.get_report()
+        ocr_kwargs = {'report_id': report.pk}
+
+        if profiling_enabled(local_ingest.profile):
+            ocr_kwargs['profile'] = True
+            with profile_task('local_ingest_task_ecds', report):
+                local_ingest.ingest()
+        else:
+            local_ingest.ingest()
+    except Exception as error:
+        record_failure(local_ingest.report, error, retrying=will_retry(local_ingest_task_ecds, error))
+        raise
+
+    # The ingest's progress is finished by add_ocr_task, once the OCR is loaded.
     if os.environ["DJANGO_ENV"] != 'test': # pragma: no cover
-        add_ocr_task.delay(local_ingest.manifest.pk)
+        add_ocr_task.delay(local_ingest.manifest.pk, **ocr_kwargs)
     else:
-        add_ocr_task(local_ingest.manifest.pk)
+        add_ocr_task(local_ingest.manifest.pk, **ocr_kwargs)
+
+
+@app.task(name='ingest_ocr_to_canvas', autoretry_for=(Manifest.DoesNotExist,), retry_backoff=5, **queue_options(OCR_QUEUE))
+def add_ocr_task(manifest_id, *args, profile=False, report_id=None, **kwargs):
+    """Function for parsing and adding OCR.
+
+    :param manifest_id: Primary key for the Manifest
+    :type manifest_id: str
+    :param profile: Profile this task, defaults to False
+    :type profile: bool, optional
+    :param report_id: Primary key for the .models.IngestReport to save profile and memory use to, defaults to None
+    :type report_id: int, optional
+    """
+    report = IngestReport.objects.filter(pk=report_id).first() if report_id else None
+    try:
+        if profiling_enabled(profile):
+            with profile_task('add_ocr_task', report):
+                load_ocr(manifest_id, report)
+        else:
+            load_ocr(manifest_id, report)
+    except Exception as error:
+        record_failure(report, error, retrying=will_retry(add_ocr_task, error))
+        raise
+
+def check_deliveries(task, report):
+    """Count the deliveries of a task that is delivered again when its worker is killed,
+    and stop it once that has happened more than `INGEST_MAX_DELIVERIES` times (default 3),
+    eg. when the OOM killer stops every worker that loads the same volume.
+
+    :param task: Task that is running
+    :type task: celery.Task
+    :param report: Report to count the deliveries on
+    :type report: readux_ingest_ecds.models.IngestReport
+    :raises WorkerLost: The task has been delivered too many times
+    """
+    request = task.request
+    if request.called_directly or request.id is None:
+        return
+    deliveries = record_delivery(report, f'{request.id}:{request.retries}')
+    limit = getattr(settings, 'INGEST_MAX_DELIVERIES', 3)
+    if deliveries > limit:
+        raise WorkerLost(f'{task.name} was delivered {deliveries} times, its worker was lost each time')
 
+def will_retry(task, error):
+    """Check if celery will run a task again after it raised an error.
 
-@app.task(name='ingest_ocr_to_canvas', autoretry_for=(Manifest.DoesNotExist,), retry_backoff=5)
-def add_ocr_task(manifest_id, *args, **kwargs):
-    """Function for parsing and adding OCR."""
+    :param task: Task that raised the error
+    :type task: celery.Task
+    :param error: Exception raised
+    :type error: Exception
+    :rtype: bool
+    """
+    request = task.request
+    if request.called_directly or isinstance(error, getattr(task, 'dont_autoretry_for', ())):
+        return False
+    if not isinstance(error, getattr(task, 'autoretry_for', ())):
+        return False
+    return task.max_retries is None or request.retries < task.max_retries
+
+def load_ocr(manifest_id, report=None):
+    """Fetch, parse and save OCR for every canvas in a manifest.
+
+    When memory use passes the soft limit of `INGEST_MEMORY_BUDGET`, OCR is inserted and
+    saved in batches of `INGEST_OCR_LOW_MEMORY_BATCH_SIZE`. When `INGEST_REINDEX` is
+    'deferred', canvases are not saved as their OCR loads but reindexed together at the end.
+
+    :param manifest_id: Primary key for the Manifest
+    :type manifest_id: str
+    :param report: Where to record memory use, defaults to None
+    :type report: .models.IngestReport, optional
+    """
     manifest = Manifest.objects.get(pk=manifest_id)
-    for canvas in manifest.canvas_set.all():
-        ocr = get_ocr(canvas)
-        if ocr is not None:
-            add_ocr_annotations(canvas, ocr)
-            # The add_ocr_annotations method uses bulk_create() which does not call save() on the model.
-            # Calling save() is really slow and I don't know why. Calling save() after the annotation
-            # has been created, calling save is as fast as expected.
-            [ocr.save() for ocr in OCR.objects.filter(canvas=canvas)]
-            canvas.save()  # trigger reindex
+    metrics = IngestMetrics(task='add_ocr', manifest=manifest.pk)
+    batch_size = None
+    source = ocr_source_for(manifest)
+    canvases = list(manifest.canvas_set.all())
+    progress = Progress(report, 'add_ocr')
+    progress.stage('add_ocr', total=len(canvases))
+    deferred = reindex_deferred()
+    loaded = []
+    with TransactionBatches() as batches:
+        for canvas, result in fetch_ocr(source, canvases, metrics):
+            if batch_size is None and metrics.memory.check('add_ocr'):
+                batch_size = getattr(settings, 'INGEST_OCR_LOW_MEMORY_BATCH_SIZE', 500)
+                LOGGER.warning(f'INGEST: Memory is low, loading OCR for {manifest.pk} in batches of {batch_size}')
+            ocr = parse_ocr(canvas, result, metrics)
+            del result
+            metrics.incr('pages')
+            progress.advance(words=len(ocr) if ocr else 0)
+            if ocr is None:
+                continue
+            # A canvas' OCR is saved in one batch, so it is never left half loaded.
+            with batches.canvas():
+                with metrics.stage('ocr_insert'):
+                    add_ocr_annotations(canvas, ocr, batch_size=batch_size)
+                metrics.incr('words', len(ocr))
+                del ocr
+                # The add_ocr_annotations method uses bulk_create() which does not call save() on the model.
+                # Calling save() is really slow and I don't know why. Calling save() after the annotation
+                # has been created, calling save is as fast as expected.
+                with metrics.stage('ocr_save'):
+                    annotations = OCR.objects.filter(canvas=canvas)
+                    if batch_size is not None:
+                        annotations = annotations.iterator(chunk_size=batch_size)
+                    for annotation in annotations:
+                        annotation.save()
+                    if deferred:
+                        loaded.append(canvas.pk)
+                    else:
+                        canvas.save()  # trigger reindex
+    metrics.incr('commits', batches.commits)
+    if loaded:
+        # After the last batch is committed, so the index never sees a partly loaded volume.
+        with metrics.stage('reindex'):
+            metrics.incr('reindex_batches', reindex(manifest, loaded))
+    progress.finish()
+    if cleanup_enabled():
+        ScratchSpace().remove_ocr_files(
+            manifest.pid, keep=[canvas.ocr_file_path for canvas in canvases if canvas.ocr_file_path]
+        )
+    if report is not None:
+        report.record_memory('add_ocr', metrics.memory)
+    metrics.flush()
+
+
+@app.task(name='bulk_ingest_task_ecds', autoretry_for=(Bulk.DoesNotExist,), retry_backoff=5, **queue_options(INGEST_QUEUE))
+def bulk_ingest_task_ecds(bulk_id):
+    """Ingest every bundle in a bulk ingest, at most `INGEST_BULK_CONCURRENCY` at a time.
+
+    The bundles are split into that many lanes. Each lane is one task that ingests its
+    bundles in turn, so a failed bundle does not stop the rest of its lane.
+
+    :param bulk_id: Primary key for .models.Bulk object
+    :type bulk_id: int
+    """
+    bulk = Bulk.objects.get(pk=bulk_id)
+    bulk.started = timezone.now()
+    bulk.save(update_fields=['started'])
+    bulk.unpack_archives()
+
+    ingest_ids = list(bulk.local_uploads.order_by('pk').values_list('pk', flat=True))
+    collection_ids = list(bulk.collections.values_list('pk', flat=True))
+    if collection_ids:
+        through = Local.collections.through
+        local_field = Local.collections.field.m2m_field_name()
+        collection_field = Local.collections.field.m2m_reverse_field_name()
+        through.objects.bulk_create([
+            through(**{f'{local_field}_id': ingest_id, f'{collection_field}_id': collection_id})
+            for ingest_id in ingest_ids for collection_id in collection_ids
+        # A redelivered task finds the rows it added the first time.
+        ], ignore_conflicts=True)
+
+    lanes = ingest_lanes(ingest_ids, getattr(settings, 'INGEST_BULK_CONCURRENCY', 4))
+
+    if os.environ["DJANGO_ENV"] != 'test': # pragma: no cover
+        chord(bulk_lane_task.s(lane) for lane in lanes)(bulk_ingest_finished_task.s(bulk_id))
+    else:
+        bulk_ingest_finished_task([bulk_lane_task(lane) for lane in lanes], bulk_id)
+
+def ingest_lanes(ingest_ids, concurrency):
+    """Split ingests into lanes that run side by side.
+
+    :param ingest_ids: Primary keys for .models.Local objects
+    :type ingest_ids: list
+    :param concurrency: Most lanes to make
+    :type concurrency: int
+    :return: List of lists of primary keys
+    :rtype: list
+    """
+    lane_count = max(1, min(int(concurrency), len(ingest_ids)))
+    return [ingest_ids[lane::lane_count] for lane in range(lane_count)]
+
+@app.task(name='bulk_lane_task_ecds', **queue_options(INGEST_QUEUE))
+def bulk_lane_task(ingest_ids):
+    """Ingest bundles one after another.
+
+    The ingests run in this task rather than as tasks of their own, so the lane retries
+    each one itself: up to `INGEST_BULK_RETRIES` more times (default 3), waiting
+    `INGEST_BULK_RETRY_DELAY` seconds (default 5) and twice as long after each failure.
+    Running out of memory is not retried.
+
+    :param ingest_ids: Primary keys for .models.Local objects
+    :type ingest_ids: list
+    :return: Which ingests finished and which failed
+    :rtype: dict
+    """
+    results = {'ingested': [], 'failed': []}
+    for ingest_id in ingest_ids:
+        try:
+            ingest_with_retries(ingest_id)
+            results['ingested'].append(ingest_id)
+        except Exception: # pylint: disable = broad-except
+            LOGGER.exception(f'INGEST: Bulk ingest - Local ingest {ingest_id} failed')
+            results['failed'].append(ingest_id)
+    return results
+
+def ingest_with_retries(ingest_id):
+    """Run a local ingest, retrying it after errors that may pass, eg. a dropped S3 or
+    database connection. Errors the ingest task is not retried for are raised at once.
+
+    :param ingest_id: Primary key for .models.Local object
+    :type ingest_id: int
+    """
+    retries = getattr(settings, 'INGEST_BULK_RETRIES', 3)
+    delay = getattr(settings, 'INGEST_BULK_RETRY_DELAY', 5)
+    for attempt in range(retries + 1):
+        try:
+            return local_ingest_task_ecds(ingest_id)
+        except NOT_RETRIED:
+            raise
+        except Exception as error: # pylint: disable = broad-except
+            if attempt == retries:
+                raise
+            LOGGER.warning(f'INGEST: Bulk ingest - Local ingest {ingest_id} failed, retrying in {delay}s: {error}')
+            sleep(delay)
+            delay *= 2
+
+@app.task(name='bulk_ingest_finished_task_ecds', **queue_options(INGEST_QUEUE))
+def bulk_ingest_finished_task(lane_results, bulk_id):
+    """Record throughput for a bulk ingest once all the lanes are done.
+
+    :param lane_results: Return values of :func:`bulk_lane_task`
+    :type lane_results: list
+    :param bulk_id: Primary key for .models.Bulk object
+    :type bulk_id: int
+    """
+    failed = [ingest_id for result in lane_results for ingest_id in result['failed']]
+    return Bulk.objects.get(pk=bulk_id).finish(failed=failed)
+
+@app.task(name='conversion_finished_task_ecds', **queue_options(INGEST_QUEUE))
+def conversion_finished_task_ecds(manifest_pid):
+    """Remove a manifest's images from `INGEST_PROCESSING_DIR` once they have been
+    converted. Queue this when the conversion of the trigger file's images is confirmed.
+
+    :param manifest_pid: Pid of the Manifest
+    :type manifest_pid: str
+    :return: Number of files removed
+    :rtype: int
+    """
+    return ScratchSpace().remove_processing_files(manifest_pid)
+
@@ -0,0 +1,80 @@
+""" Group the writes for many canvases into fewer transactions. """
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import transaction
+
+SCOPES = ('autocommit', 'batch', 'manifest')
+
+class TransactionBatches:
+    """Commit the writes for a manifest's canvases in batches.
+
+    The scope comes from the `INGEST_TRANSACTION_SCOPE` setting:
+
+    - "batch" (default): every `INGEST_TRANSACTION_BATCH_SIZE` canvases are one transaction.
+      A failure rolls back the current batch and leaves the batches before it saved.
+    - "manifest": one transaction for the whole manifest. Each batch is a savepoint in it.
+      Nothing is saved unless every canvas is.
+    - "autocommit": every statement commits on its own.
+
+    When there is already a transaction, eg. in tests, batches are savepoints.
+
+    :param scope: Overrides `INGEST_TRANSACTION_SCOPE`, defaults to None
+    :type scope: str, optional
+    :param batch_size: Overrides `INGEST_TRANSACTION_BATCH_SIZE`, defaults to None
+    :type batch_size: int, optional
+    :param using: Database alias, defaults to None
+    :type using: str, optional
+    """
+    def __init__(self, scope=None, batch_size=None, using=None):
+        self.scope = scope or getattr(settings, 'INGEST_TRANSACTION_SCOPE', 'batch')
+        if self.scope not in SCOPES:
+            raise ValueError(f'INGEST_TRANSACTION_SCOPE must be one of {", ".join(SCOPES)}, not {self.scope}')
+        self.batch_size = batch_size or getattr(settings, 'INGEST_TRANSACTION_BATCH_SIZE', 50)
+        self.using = using
+        self.outer = None
+        self.batch = None
+        self.canvases = 0
+        self.commits = 0
+
+    def __enter__(self):
+        if self.scope == 'manifest':
+            self.outer = transaction.atomic(using=self.using)
+            self.outer.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._end_batch(exc_type, exc_value, traceback)
+        if self.outer is not None:
+            self.outer.__exit__(exc_type, exc_value, traceback)
+            self.outer = None
+            if exc_type is None:
+                self.commits += 1
+        return False
+
+    @contextmanager
+    def canvas(self):
+        """Wrap the writes for one canvas so they are saved in the same batch."""
+        if self.scope == 'autocommit':
+            yield
+            return
+
+        if self.batch is None:
+            self.batch = transaction.atomic(using=self.using)
+            self.batch.__enter__()
+        try:
+            yield
+        except BaseException as error:
+            self._end_batch(type(error), error, error.__traceback__)
+            raise
+
+        self.canvases += 1
+        if self.canvases % self.batch_size == 0:
+            self._end_batch(None, None, None)
+
+    def _end_batch(self, exc_type, exc_value, traceback):
+        if self.batch is None:
+            return
+        batch, self.batch = self.batch, None
+        batch.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and self.outer is None:
+            self.commits += 1
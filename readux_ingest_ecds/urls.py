@@ -0,0 +1,9 @@
+""" URLs for following ingests. Include them in the host app, eg. `path('ingest/', include('readux_ingest_ecds.urls'))`. """
+from django.urls import path
+from . import views
+
+app_name = 'readux_ingest_ecds'
+
+urlpatterns = [
+    path('progress/<int:report_id>/', views.ingest_progress, name='progress'),
+]
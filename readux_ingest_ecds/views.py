@@ -1,3 +1,22 @@
-from django.shortcuts import render
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from .models import IngestReport
+from .progress import describe
 
-# Create your views here.
+@staff_member_required
+def ingest_progress(request, report_id):
+    """Progress of the ingest an ingest report follows, for the admin to poll.
+
+    :param report_id: Primary key for .models.IngestReport
+    :type report_id: int
+    :return: The report's progress, described in words, and the pid of its manifest once there is one
+    :rtype: JsonResponse
+    """
+    report = get_object_or_404(IngestReport, pk=report_id)
+    return JsonResponse({
+        'report': report.pk,
+        'manifest': report.manifest_id,
+        'progress': report.progress,
+        'text': describe(report.progress),
+    })
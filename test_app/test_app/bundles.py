@@ -0,0 +1,149 @@
+""" Generate synthetic ingest bundles for tests and benchmarks. """
+import csv
+import io
+import json
+import random
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+from PIL import Image, ImageDraw
+
+OCR_FORMATS = ('tsv', 'hocr', 'json')
+
+WORDS = (
+    'lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit',
+    'sed', 'do', 'eiusmod', 'tempor', 'incididunt', 'ut', 'labore', 'et', 'dolore',
+)
+
+def page_image(page, width, height):
+    """Create a JPEG for a page. Each page is drawn differently so the files are distinct.
+
+    :param page: Page number
+    :type page: int
+    :param width: Width in pixels
+    :type width: int
+    :param height: Height in pixels
+    :type height: int
+    :return: JPEG data
+    :rtype: bytes
+    """
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    draw.rectangle(
+        (page % width, page % height, min(width, page % width + width // 4), min(height, page % height + height // 8)),
+        fill=(page * 37 % 255, page * 59 % 255, page * 83 % 255)
+    )
+    draw.text((width // 10, height // 10), f'Page {page}', fill=(0, 0, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+def page_words(words, width, height, rand):
+    """Lay out words in rows across a page.
+
+    :return: List of dicts with content, x, y, w, and h
+    :rtype: list
+    """
+    layout = []
+    word_height = max(1, height // 60)
+    x = y = 10
+    for _ in range(words):
+        content = rand.choice(WORDS)
+        word_width = max(1, word_height * len(content) // 2)
+        if x + word_width > width:
+            x = 10
+            y = (y + word_height * 2) % max(1, height - word_height)
+        layout.append({'content': content, 'x': x, 'y': y, 'w': word_width, 'h': word_height})
+        x += word_width + word_height
+    return layout
+
+def page_ocr(layout, ocr_format, width, height):
+    """Serialize a page's words in the requested OCR format.
+
+    :return: OCR file contents
+    :rtype: str
+    """
+    if ocr_format == 'tsv':
+        rows = ['content\tx\ty\tw\th']
+        rows += [f"{w['content']}\t{w['x']}\t{w['y']}\t{w['w']}\t{w['h']}" for w in layout]
+        return '\n'.join(rows)
+
+    if ocr_format == 'json':
+        return json.dumps({
+            'ocr': [[[w['content'], [w['x'], w['y'] + w['h'], w['x'] + w['w'], w['y'], 0]] for w in layout]]
+        })
+
+    if ocr_format == 'hocr':
+        spans = '\n'.join(
+            f"<span class='ocrx_word' id='word_1_{index}' "
+            f"title='bbox {w['x']} {w['y']} {w['x'] + w['w']} {w['y'] + w['h']}; x_wconf 95'>{w['content']}</span>"
+            for index, w in enumerate(layout, start=1)
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"\n'
+            '    "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">\n'
+            '<head><title></title>\n'
+            '<meta http-equiv="Content-Type" content="text/html;charset=utf-8" />\n'
+            "<meta name='ocr-system' content='readux-ingest-ecds benchmark' />\n"
+            "<meta name='ocr-capabilities' content='ocr_page ocr_carea ocr_par ocr_line ocrx_word'/>\n"
+            '</head>\n<body>\n'
+            f"<div class='ocr_page' id='page_1' title='bbox 0 0 {width} {height}'>\n"
+            f"<div class='ocr_carea' id='block_1_1' title='bbox 0 0 {width} {height}'>\n"
+            f"<p class='ocr_par' id='par_1_1' title='bbox 0 0 {width} {height}'>\n"
+            f"<span class='ocr_line' id='line_1_1' title='bbox 0 0 {width} {height}'>\n"
+            f'{spans}\n'
+            '</span></p></div></div>\n</body>\n</html>\n'
+        )
+
+    raise ValueError(f'Unsupported OCR format: {ocr_format}')
+
+def metadata_csv(pid, pages):
+    """Create a one row metadata CSV.
+
+    :return: CSV contents
+    :rtype: str
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['PID', 'Label', 'Summary', 'Author', 'Published city', 'Published date', 'Publisher'])
+    writer.writerow([pid, f'Benchmark volume {pid}', f'{pages} synthetic pages', 'Readux', 'Atlanta', '2024', 'ECDS'])
+    return buffer.getvalue()
+
+def build_bundle(
+    path, pages=10, width=1000, height=1400, ocr_format='tsv',
+    words=250, pid=None, compress=False, seed=0
+):
+    """Write a bundle ZIP with images, matching OCR files and a metadata CSV.
+
+    :param path: Where to write the ZIP
+    :type path: str
+    :param pages: Number of images
+    :type pages: int
+    :param width: Image width in pixels
+    :type width: int
+    :param height: Image height in pixels
+    :type height: int
+    :param ocr_format: One of `OCR_FORMATS` or None to leave out OCR
+    :type ocr_format: str, None
+    :param words: Words per page of OCR
+    :type words: int
+    :param pid: Manifest pid for the metadata file. No metadata file is included when None.
+    :type pid: str, None
+    :param compress: Deflate the members of the ZIP
+    :type compress: bool
+    :param seed: Seed for the word layout
+    :type seed: int
+    :return: Path to the bundle
+    :rtype: str
+    """
+    rand = random.Random(seed)
+    with ZipFile(path, 'w', compression=ZIP_DEFLATED if compress else ZIP_STORED) as bundle:
+        if pid is not None:
+            bundle.writestr('metadata.csv', metadata_csv(pid, pages))
+        for page in range(1, pages + 1):
+            name = f'{page:08d}'
+            bundle.writestr(f'images/{name}.jpg', page_image(page, width, height))
+            if ocr_format is not None:
+                layout = page_words(words, width, height, rand)
+                bundle.writestr(f'ocr/{name}.{ocr_format}', page_ocr(layout, ocr_format, width, height))
+    return path
@@ -0,0 +1,224 @@
+""" Benchmark the full local ingest flow with synthetic bundles. """
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from shutil import rmtree
+from time import perf_counter
+import boto3
+from moto import mock_s3
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings, setup_databases, teardown_databases
+from readux_ingest_ecds.models import Local
+from readux_ingest_ecds.services.ocr_loaders import LOADERS
+from readux_ingest_ecds.tasks import add_ocr_task
+from iiif.models import ImageServer
+from test_app.bundles import OCR_FORMATS, build_bundle
+
+def directory_size(path):
+    """Total size in bytes of the files under `path`."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file_name))
+            except FileNotFoundError:
+                pass
+    return total
+
+def peak_rss():
+    """Peak resident set size of this process in bytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def io_write_bytes():
+    """Bytes this process has caused to be written to storage, when the kernel reports it."""
+    try:
+        with open('/proc/self/io', 'r') as io_stats:
+            for line in io_stats:
+                if line.startswith('write_bytes'):
+                    return int(line.split(':')[1])
+    except OSError:
+        pass
+    return None
+
+class Stage:
+    """Context manager to measure one stage of the ingest."""
+    def __init__(self, name, scratch_dir, results):
+        self.name = name
+        self.scratch_dir = scratch_dir
+        self.results = results
+
+    def __enter__(self):
+        self.queries = CaptureQueriesContext(connection)
+        self.queries.__enter__()
+        self.scratch_before = directory_size(self.scratch_dir)
+        self.io_before = io_write_bytes()
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = perf_counter() - self.start
+        self.queries.__exit__(*exc)
+        io_after = io_write_bytes()
+        self.results.append({
+            'stage': self.name,
+            'seconds': round(elapsed, 4),
+            'queries': len(self.queries),
+            'bytes_written': directory_size(self.scratch_dir) - self.scratch_before,
+            'io_write_bytes': None if io_after is None else io_after - self.io_before,
+            'peak_rss': peak_rss(),
+        })
+
+# Libraries only the ingest and OCR tasks need. Web processes that import the admin
+# should not load any of these.
+HEAVY_MODULES = ('boto3', 'hocr_spec', 'httpretty', 'lxml', 'openpyxl', 'PIL', 'tablib')
+
+IMPORT_SCRIPT = """
+import importlib, json, sys
+from time import perf_counter
+start = perf_counter()
+import django
+django.setup()
+importlib.import_module(sys.argv[1])
+print(json.dumps({
+    'seconds': perf_counter() - start,
+    'loaded': [module for module in sys.argv[2:] if module in sys.modules],
+}))
+"""
+
+def import_benchmark(module):
+    """Time `django.setup()` plus importing a module in a fresh interpreter.
+
+    :param module: Dotted path of the module to import
+    :type module: str
+    :return: Module, seconds, and which of `HEAVY_MODULES` were loaded
+    :rtype: dict
+    """
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'test_app.settings')
+    result = subprocess.run(
+        [sys.executable, '-c', IMPORT_SCRIPT, module, *HEAVY_MODULES],
+        capture_output=True, check=True, text=True, env=env, cwd=settings.BASE_DIR
+    )
+    return {'module': module, **json.loads(result.stdout.strip().splitlines()[-1])}
+
+def run_benchmark(
+    pages=10, width=1000, height=1400, ocr_format='tsv', words=250,
+    compress=False, work_dir=None, run=1, ocr_loader='bulk_create'
+):
+    """Build a bundle and run it through prep, ingest and OCR.
+
+    The ingest stage is the body of `local_ingest_task_ecds` without queuing OCR so
+    the OCR load can be measured on its own by calling `add_ocr_task`.
+
+    :return: List of dicts, one per stage
+    :rtype: list
+    """
+    cleanup = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix='ingest-benchmark-')
+    scratch_dir = os.path.join(work_dir, 'scratch')
+    results = []
+    pid = f'benchmark-{pages}-{ocr_format}-{run}'
+
+    try:
+        with Stage('build_bundle', work_dir, results):
+            bundle_path = build_bundle(
+                os.path.join(work_dir, f'{pid}.zip'),
+                pages=pages, width=width, height=height,
+                ocr_format=ocr_format, words=words, pid=pid, compress=compress
+            )
+
+        scratch_settings = override_settings(
+            INGEST_OCR_LOADER=ocr_loader,
+            INGEST_TMP_DIR=scratch_dir,
+            INGEST_PROCESSING_DIR=os.path.join(scratch_dir, 'processing'),
+            INGEST_OCR_DIR=os.path.join(scratch_dir, 'ocr'),
+        )
+
+        with scratch_settings, mock_s3():
+            boto3.resource('s3', region_name='us-east-1').create_bucket(Bucket=settings.INGEST_TRIGGER_BUCKET)
+            image_server = ImageServer.objects.create(server_base='http://benchmark.readux.io')
+            local = Local(image_server=image_server)
+            with open(bundle_path, 'rb') as bundle:
+                local.bundle = File(bundle, os.path.basename(bundle_path))
+                with Stage('prep', scratch_dir, results):
+                    local.prep()
+
+            with Stage('ingest', scratch_dir, results):
+                local.ingest()
+
+            with Stage('ocr', scratch_dir, results):
+                add_ocr_task(local.manifest.pk)
+    finally:
+        if cleanup:
+            rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+class Command(BaseCommand):
+    help = 'Run synthetic bundles through the local ingest and report per-stage costs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=10)
+        parser.add_argument('--width', type=int, default=1000)
+        parser.add_argument('--height', type=int, default=1400)
+        parser.add_argument('--words', type=int, default=250, help='Words of OCR per page.')
+        parser.add_argument('--ocr', choices=OCR_FORMATS, default='tsv')
+        parser.add_argument('--compress', action='store_true', help='Deflate the bundle.')
+        parser.add_argument('--runs', type=int, default=1)
+        parser.add_argument(
+            '--ocr-loader', choices=LOADERS, nargs='+', default=['bulk_create'],
+            help='How OCR rows are inserted. Pass both to compare them. COPY needs PostgreSQL.'
+        )
+        parser.add_argument('--json', dest='json_file', help='Also write the results to this file.')
+        parser.add_argument(
+            '--imports', action='store_true',
+            help='Only time importing the admin and the tasks in a fresh process.'
+        )
+
+    def handle(self, *args, **options):
+        if options['imports']:
+            for module in ('readux_ingest_ecds.admin', 'readux_ingest_ecds.tasks'):
+                result = import_benchmark(module)
+                self.stdout.write(
+                    f"{result['module']:<28}{result['seconds']:>8.3f}s  loaded: {', '.join(result['loaded']) or '-'}"
+                )
+            return
+
+        old_config = setup_databases(verbosity=0, interactive=False)
+        runs = []
+        try:
+            for ocr_loader in options['ocr_loader']:
+                for run in range(options['runs']):
+                    results = run_benchmark(
+                        pages=options['pages'],
+                        width=options['width'],
+                        height=options['height'],
+                        ocr_format=options['ocr'],
+                        words=options['words'],
+                        compress=options['compress'],
+                        run=f'{ocr_loader}-{run + 1}',
+                        ocr_loader=ocr_loader,
+                    )
+                    runs.append({'ocr_loader': ocr_loader, 'stages': results})
+                    self.report(run + 1, results, ocr_loader)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+        if options['json_file']:
+            with open(options['json_file'], 'w') as json_file:
+                json.dump({'options': options, 'database': connection.vendor, 'runs': runs}, json_file, indent=2, default=str)
+
+    def report(self, run, results, ocr_loader='bulk_create'):
+        self.stdout.write(f'Run {run} ({connection.vendor}, OCR loaded with {ocr_loader})')
+        self.stdout.write(f"{'stage':<14}{'seconds':>10}{'queries':>10}{'bytes written':>16}{'peak rss MB':>14}")
+        for result in results:
+            self.stdout.write(
+                f"{result['stage']:<14}{result['seconds']:>10.3f}{result['queries']:>10}"
+                f"{result['bytes_written']:>16}{result['peak_rss'] / 1024 / 1024:>14.1f}"
+            )
@@ -0,0 +1,28 @@
+""" OCR sources that serve fixtures instead of making requests, for tests. """
+import json
+import os
+from django.conf import settings
+from readux_ingest_ecds.services.ocr_sources import ArchiveLabSource, EmoryOcrBucketSource
+
+class FixtureRequestMixin:
+    """Answer every request with the contents of `fixture`. Nothing is cached, so each
+    test sees the requests it makes."""
+    fixture = None
+    cache_timeout = 0
+
+    def __init__(self, manifest):
+        super().__init__(manifest)
+        self.requested = []
+
+    def request(self, url, data_format='json'):
+        self.requested.append(url)
+        with open(os.path.join(settings.FIXTURE_DIR, self.fixture), 'r') as fixture:
+            if data_format == 'json':
+                return json.load(fixture)
+            return fixture.read()
+
+class FakeArchiveLabSource(FixtureRequestMixin, ArchiveLabSource):
+    fixture = 'ocr_words.json'
+
+class FakeEmoryOcrBucketSource(FixtureRequestMixin, EmoryOcrBucketSource):
+    fixture = 'sample.tsv'
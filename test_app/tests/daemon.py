@@ -0,0 +1,25 @@
+""" Run code the way a celery prefork worker does, in a daemonic process. """
+import multiprocessing
+
+def _call(queue, function, args, kwargs):
+    try:
+        queue.put(('result', function(*args, **kwargs)))
+    except Exception as error: # pylint: disable = broad-except
+        queue.put(('error', f'{error.__class__.__name__}: {error}'))
+
+def run_in_daemon(function, *args, **kwargs):
+    """Call a function in a forked daemonic process, which can not start processes of its own.
+
+    Patches and settings overrides made before the call are forked with the process.
+
+    :return: What the function returned
+    :raises AssertionError: With the error the function raised
+    """
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(target=_call, args=(queue, function, args, kwargs), daemon=True)
+    process.start()
+    kind, value = queue.get(timeout=60)
+    process.join()
+    assert kind == 'result', value
+    return value
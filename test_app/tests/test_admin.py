@@ -1,5 +1,6 @@
 from os.path import join
 from shutil import rmtree
+from unittest.mock import Mock
 import boto3
 from django.conf import settings
 from django.contrib.admin.sites import AdminSite
@@ -12,7 +13,7 @@ from django.test.client import RequestFactory
 from moto import mock_s3
 from iiif.models import Manifest, Canvas, Collection, OCR
 from .factories import ImageServerFactory, UserFactory, LocalFactory, ManifestFactory, CollectionFactory
-from readux_ingest_ecds.models import Local
+from readux_ingest_ecds.models import IngestReport, Local
 from readux_ingest_ecds.admin import LocalAdmin
 
 @mock_s3
@@ -33,6 +34,11 @@ class IngestAdminTest(TestCase):
     def teardown_class():
         rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
 
+    def add(self, local_model_admin, local, req):
+        """Save the ingest the way the admin's add view does."""
+        local_model_admin.save_model(obj=local, request=req, form=None, change=None)
+        local_model_admin.save_related(request=req, form=Mock(instance=local), formsets=[], change=False)
+
     def test_local_admin_save(self):
         """It should add a create a manifest and canvases and delete the Local object"""
         local = LocalFactory.build(image_server=self.image_server)
@@ -52,7 +58,7 @@ class IngestAdminTest(TestCase):
         req.user = self.user
 
         local_model_admin = LocalAdmin(model=Local, admin_site=AdminSite())
-        local_model_admin.save_model(obj=local, request=req, form=None, change=None)
+        self.add(local_model_admin, local, req)
 
         # Saving should kick off the task to create the canvases and then delete
         # the `Local` ingest object when done.
@@ -77,6 +83,27 @@ class IngestAdminTest(TestCase):
         assert isinstance(response, HttpResponseRedirect)
         assert response.url == f'/admin/manifests/manifest/{local.manifest.pk}/change/'
 
+    def test_local_admin_save_returns_before_prep(self):
+        """It should only save the upload and a report, and redirect to the report"""
+        local = LocalFactory.build(image_server=self.image_server)
+        with open(join(self.fixture_path, 'no_meta_file.zip'), 'rb') as f:
+            local.bundle = files.File(files.base.ContentFile(f.read()).file, 'no_meta_file.zip')
+        req = RequestFactory().post('/admin/readux_ingest_ecds/local/add/', data={})
+        req.user = self.user
+        manifest_count = Manifest.objects.count()
+
+        local_model_admin = LocalAdmin(model=Local, admin_site=AdminSite())
+        local_model_admin.save_model(obj=local, request=req, form=None, change=None)
+        response = local_model_admin.response_add(obj=local, request=req)
+
+        assert Manifest.objects.count() == manifest_count
+        assert local.manifest is None
+        assert response.url == f'/admin/readux_ingest_ecds/ingestreport/{local.report.pk}/change/'
+
+        local_model_admin.save_related(request=req, form=Mock(instance=local), formsets=[], change=False)
+
+        assert IngestReport.objects.get(pk=local.report.pk).manifest is not None
+
     def test_local_ingest_with_collections(self):
         """It should add chosen collections to the Local's manifests"""
         local = LocalFactory.build(image_server=self.image_server)
@@ -100,7 +127,7 @@ class IngestAdminTest(TestCase):
         req = request_factory.post('/admin/ingest/local/add/', data={})
         req.user = self.user
         local_model_admin = LocalAdmin(model=Local, admin_site=AdminSite())
-        local_model_admin.save_model(obj=local, request=req, form=None, change=None)
+        self.add(local_model_admin, local, req)
 
         # Get the newly created manifest by comparing current list to the list before
         manifests_after = list(Manifest.objects.all())
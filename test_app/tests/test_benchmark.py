@@ -0,0 +1,46 @@
+""" Tests for the ingest benchmark harness """
+from zipfile import ZipFile
+import pytest
+from django.test import TestCase
+from test_app.bundles import build_bundle
+from test_app.management.commands.ingest_benchmark import import_benchmark, run_benchmark
+from iiif.models import Manifest, OCR
+
+pytestmark = pytest.mark.django_db(transaction=True) # pylint: disable = invalid-name
+
+class IngestBenchmarkTest(TestCase):
+    """ Tests for test_app.management.commands.ingest_benchmark """
+
+    @pytest.fixture(autouse=True)
+    def use_tmp_path(self, tmp_path):
+        # unittest style tests can't take pytest fixtures as arguments.
+        self.tmp_path = tmp_path
+
+    def test_build_bundle(self):
+        """ It should write matching images and OCR files along with a metadata file. """
+        bundle = build_bundle(
+            str(self.tmp_path / 'synthetic.zip'), pages=3, width=40, height=60, ocr_format='hocr', words=5, pid='synth'
+        )
+        with ZipFile(bundle, 'r') as zip_ref:
+            names = zip_ref.namelist()
+
+        assert 'metadata.csv' in names
+        assert 'images/00000003.jpg' in names
+        assert 'ocr/00000003.hocr' in names
+
+    def test_run_benchmark(self):
+        """ It should run each stage and report what it cost. """
+        for ocr_format in ['tsv', 'hocr', 'json']:
+            results = run_benchmark(pages=2, width=40, height=60, ocr_format=ocr_format, words=5)
+
+            assert [result['stage'] for result in results] == ['build_bundle', 'prep', 'ingest', 'ocr']
+            assert all(result['seconds'] >= 0 for result in results)
+            assert results[2]['bytes_written'] > 0
+            manifest = Manifest.objects.get(pid=f'benchmark-2-{ocr_format}-1')
+            assert manifest.canvas_set.count() == 2
+            assert OCR.objects.filter(canvas__manifest=manifest).count() == 10
+
+    def test_import_benchmark(self):
+        """ It should not load the OCR and storage libraries for the admin. """
+        assert import_benchmark('readux_ingest_ecds.admin')['loaded'] == []
+        assert 'lxml' not in import_benchmark('readux_ingest_ecds.tasks')['loaded']
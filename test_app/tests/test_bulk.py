@@ -0,0 +1,209 @@
+""" Tests for bulk ingest """
+import os
+from io import BytesIO
+from shutil import rmtree
+from unittest.mock import Mock, patch
+from zipfile import ZipFile
+import boto3
+import pytest
+from moto import mock_s3
+from django.conf import settings
+from django.contrib.admin.sites import AdminSite
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+from readux_ingest_ecds import tasks
+from readux_ingest_ecds.admin import BulkAdmin
+from readux_ingest_ecds.memory import MemoryBudgetExceeded
+from readux_ingest_ecds.models import Bulk, Local
+from readux_ingest_ecds.services.metadata_services import DuplicateMetadata, MetadataSheet, _load_metadata_sheet
+from readux_ingest_ecds.services.validation_services import InvalidBundle
+from readux_ingest_ecds.tasks import bulk_ingest_task_ecds, bulk_lane_task, ingest_lanes
+from iiif.models import Canvas, Collection, Manifest
+from test_app.bundles import build_bundle
+from .factories import CollectionFactory, ImageServerFactory, UserFactory
+
+pytestmark = pytest.mark.django_db(transaction=True) # pylint: disable = invalid-name
+
+METADATA = 'Filename,PID,Label\nvol-a.zip,bulk-a,Volume A\nvol-b,bulk-b,Volume B\n'
+
+@mock_s3
+class BulkTest(TestCase):
+    """ Tests for ingest.models.Bulk """
+
+    def setUp(self):
+        """ Set instance variables. """
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+        os.makedirs(settings.INGEST_TMP_DIR, exist_ok=True)
+        self.image_server = ImageServerFactory()
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.INGEST_TRIGGER_BUCKET)
+
+    def teardown_class():
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+
+    def bundle(self, name, pages=2):
+        path = build_bundle(os.path.join(settings.INGEST_TMP_DIR, name), pages=pages, width=20, height=30, words=3)
+        with open(path, 'rb') as bundle:
+            content = bundle.read()
+        os.remove(path)
+        return SimpleUploadedFile(name=name, content=content)
+
+    def test_upload_files(self):
+        """ It should make a Local ingest for each bundle with its row of metadata. """
+        bulk = Bulk.objects.create(image_server=self.image_server)
+        files = [
+            self.bundle('vol-a.zip'),
+            SimpleUploadedFile(name='metadata.csv', content=METADATA.encode('utf-8')),
+            self.bundle('vol-b.zip'),
+            self.bundle('vol-c.zip'),
+        ]
+        ingests = bulk.upload_files(files)
+
+        assert len(ingests) == 3
+        assert os.path.isfile(bulk.metadata_file.path)
+        for local in ingests:
+            assert local.bulk == bulk
+            assert local.image_server == self.image_server
+            assert os.path.isfile(local.bundle_file.path)
+            local.open_metadata()
+        assert [local.metadata.get('pid') for local in ingests] == ['bulk-a', 'bulk-b', None]
+
+    def test_upload_archive_of_bundles(self):
+        """ It should make a Local ingest for each bundle in a ZIP of bundles. """
+        archive = BytesIO()
+        with ZipFile(archive, 'w') as zip_ref:
+            zip_ref.writestr('metadata.csv', METADATA)
+            zip_ref.writestr('vol-a.zip', self.bundle('vol-a.zip').read())
+            zip_ref.writestr('vol-b.zip', self.bundle('vol-b.zip').read())
+            zip_ref.writestr('__MACOSX/._vol-b.zip', b'junk')
+        bulk = Bulk.objects.create(image_server=self.image_server)
+        # The request only saves the upload.
+        assert len(bulk.upload_files([SimpleUploadedFile(name='volumes.zip', content=archive.getvalue())])) == 1
+        assert not bulk.metadata_file
+        archive_path = bulk.local_uploads.get().bundle_file.path
+
+        assert bulk.unpack_archives() == 1
+        assert bulk.unpack_archives() == 0
+
+        ingests = bulk.local_uploads.all()
+        assert sorted(bulk.metadata_for(local.bundle_file.name)['pid'] for local in ingests) == ['bulk-a', 'bulk-b']
+        assert not os.path.exists(archive_path)
+
+    def test_metadata_sheet_is_read_once(self):
+        """ It should read the batch's spreadsheet once and look up each volume. """
+        _load_metadata_sheet.cache_clear()
+        bulk = Bulk.objects.create(image_server=self.image_server)
+        bulk.upload_files([
+            self.bundle('vol-a.zip'),
+            self.bundle('vol-b.zip'),
+            SimpleUploadedFile(name='metadata.csv', content=METADATA.encode('utf-8')),
+        ])
+        for local in bulk.local_uploads.all():
+            local.open_metadata()
+
+        assert _load_metadata_sheet.cache_info().misses == 1
+        assert _load_metadata_sheet.cache_info().hits == 1
+
+    def test_metadata_sheet_index(self):
+        """ It should index rows by pid and file name. """
+        sheet = MetadataSheet([
+            {'PID': 'sqn_75', 'Label': 'A'},
+            {'Filename': 'other.zip', 'PID': 'cdc-ledger-1'},
+            {'Label': 'No id'},
+        ])
+
+        assert len(sheet) == 3
+        assert sheet.get('SQN-75.zip')['pid'] == 'sqn_75'
+        assert sheet.get('other')['pid'] == 'cdc-ledger-1'
+        assert sheet.get('cdc-ledger-1')['pid'] == 'cdc-ledger-1'
+        assert sheet.get('missing') == {}
+
+    def test_metadata_sheet_dotted_pids(self):
+        """ It should only leave bundle extensions off and refuse a volume with more than one row. """
+        sheet = MetadataSheet([
+            {'PID': 'sqn75.v1', 'Filename': 'sqn75.v1.tar.gz'},
+            {'PID': 'sqn75.v2'},
+            {'PID': 'dup', 'Label': 'First'},
+            {'Filename': 'dup.zip', 'Label': 'Second'},
+        ])
+
+        assert sheet.get('sqn75.v1.tar.gz')['pid'] == 'sqn75.v1'
+        assert sheet.get('sqn75.v2')['pid'] == 'sqn75.v2'
+        assert sheet.get('sqn75') == {}
+        with pytest.raises(DuplicateMetadata, match='rows 3, 4'):
+            sheet.get('dup.zip')
+
+    def test_bulk_ingest(self):
+        """ It should ingest every volume, add the collections and record throughput. """
+        bulk = Bulk.objects.create(image_server=self.image_server)
+        collection = CollectionFactory()
+        bulk.collections.set([collection])
+        bulk.upload_files([
+            self.bundle('vol-a.zip', pages=3),
+            self.bundle('vol-b.zip', pages=2),
+            SimpleUploadedFile(name='metadata.csv', content=METADATA.encode('utf-8')),
+        ])
+
+        bulk_ingest_task_ecds(bulk.pk)
+        bulk.refresh_from_db()
+
+        assert Local.objects.filter(bulk=bulk).count() == 0
+        assert Canvas.objects.filter(manifest__pid='bulk-a').count() == 3
+        assert Canvas.objects.filter(manifest__pid='bulk-b').count() == 2
+        assert list(Manifest.objects.get(pid='bulk-a').collections.all()) == [collection]
+        assert bulk.stats['volumes'] == 2
+        assert bulk.stats['pages'] == 5
+        assert bulk.stats['failed'] == []
+        assert bulk.stats['pages_per_second'] > 0
+        assert bulk.finished >= bulk.started
+
+    def test_bulk_ingest_redelivered(self):
+        """ It should carry on when a redelivered task finds the collections already added. """
+        bulk = Bulk.objects.create(image_server=self.image_server)
+        collection = CollectionFactory()
+        bulk.collections.set([collection])
+        bulk.upload_files([self.bundle('vol-a.zip', pages=1), SimpleUploadedFile(name='metadata.csv', content=METADATA.encode('utf-8'))])
+        bulk.local_uploads.first().collections.add(collection)
+
+        bulk_ingest_task_ecds(bulk.pk)
+
+        assert list(Manifest.objects.get(pid='bulk-a').collections.all()) == [collection]
+
+    @override_settings(INGEST_BULK_RETRIES=2, INGEST_BULK_RETRY_DELAY=0)
+    def test_lane_retries(self):
+        """ It should retry an ingest that fails, and give up after the last retry. """
+        flaky = Mock(side_effect=[OSError('connection reset'), None, OSError('1'), OSError('2'), OSError('3')])
+        with patch.object(tasks, 'local_ingest_task_ecds', flaky):
+            assert bulk_lane_task([1, 2]) == {'ingested': [1], 'failed': [2]}
+        assert flaky.call_count == 5
+
+        for error in (MemoryBudgetExceeded('too big'), InvalidBundle('broken image')):
+            not_retried = Mock(side_effect=error)
+            with patch.object(tasks, 'local_ingest_task_ecds', not_retried):
+                assert bulk_lane_task([3]) == {'ingested': [], 'failed': [3]}
+            assert not_retried.call_count == 1
+
+    def test_ingest_lanes(self):
+        """ It should never make more lanes than the concurrency allows. """
+        assert ingest_lanes([1, 2, 3, 4, 5], 2) == [[1, 3, 5], [2, 4]]
+        assert ingest_lanes([1, 2], 4) == [[1], [2]]
+        assert ingest_lanes([], 4) == [[]]
+
+    def test_bulk_admin(self):
+        """ It should ingest every uploaded bundle. """
+        request = RequestFactory().post(
+            '/admin/readux_ingest_ecds/bulk/add/',
+            data={'volume_files': [self.bundle('vol-a.zip'), self.bundle('vol-b.zip')]}
+        )
+        request.user = UserFactory.create(is_superuser=True)
+        bulk_model_admin = BulkAdmin(model=Bulk, admin_site=AdminSite())
+        form = bulk_model_admin.get_form(request)(data={'image_server': self.image_server.pk})
+        assert form.is_valid()
+        bulk = bulk_model_admin.save_form(request, form, change=False)
+        bulk_model_admin.save_model(obj=bulk, request=request, form=form, change=False)
+        bulk_model_admin.save_related(request=request, form=form, formsets=[], change=False)
+
+        bulk.refresh_from_db()
+        assert bulk.creator == request.user
+        assert bulk.stats['volumes'] == 2
@@ -0,0 +1,143 @@
+""" Tests for reading bundles """
+import os
+import tarfile
+from shutil import rmtree
+from zipfile import ZipFile
+import boto3
+import pytest
+from moto import mock_s3
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from readux_ingest_ecds.models import Local
+from readux_ingest_ecds.services.bundles import DirectoryBundle, TarBundle, ZipBundle, open_bundle
+from readux_ingest_ecds.services.file_services import is_bundle_file
+from .factories import ImageServerFactory
+
+pytestmark = pytest.mark.django_db(transaction=True) # pylint: disable = invalid-name
+
+BUNDLE_ROOT = os.path.join(settings.INGEST_TMP_DIR, 'bundles')
+
+@mock_s3
+@override_settings(INGEST_BUNDLE_ROOT=BUNDLE_ROOT)
+class BundlesTest(TestCase):
+    """ Tests for readux_ingest_ecds.services.bundles """
+
+    def setUp(self):
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.INGEST_TRIGGER_BUCKET)
+        self.zip_path = os.path.join(settings.FIXTURE_DIR, 'csv_meta.zip')
+        self.directory = os.path.join(BUNDLE_ROOT, 'csv_meta')
+        with ZipFile(self.zip_path, 'r') as zip_ref:
+            zip_ref.extractall(self.directory)
+        self.tar_path = os.path.join(BUNDLE_ROOT, 'csv_meta.tar.gz')
+        with tarfile.open(self.tar_path, 'w:gz') as tar:
+            tar.add(self.directory, arcname='.')
+
+    def teardown_class():
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+
+    def ingest(self, local):
+        local.prep()
+        local.unzip_bundle()
+        local.create_canvases()
+        return local
+
+    def test_open_bundle(self):
+        """ It should read the same files from every kind of bundle. """
+        names = {}
+        for source, bundle_class in ((self.zip_path, ZipBundle), (self.tar_path, TarBundle), (self.directory, DirectoryBundle)):
+            with open_bundle(source) as bundle:
+                assert isinstance(bundle, bundle_class)
+                names[bundle_class] = sorted(
+                    os.path.normpath(member.filename) for member in bundle if is_bundle_file(member.filename)
+                )
+        assert len(names[ZipBundle]) == 20
+        assert names[ZipBundle] == names[TarBundle] == names[DirectoryBundle]
+
+        with pytest.raises(ValueError):
+            open_bundle(os.path.join(self.directory, 'metadata.csv'))
+
+    @override_settings(INGEST_TAR_EXPANSION=5)
+    def test_tar_sizes(self):
+        """ It should estimate a compressed tar holds more than its own size. """
+        plain_path = os.path.join(BUNDLE_ROOT, 'csv_meta.tar')
+        with tarfile.open(plain_path, 'w') as tar:
+            tar.add(self.directory, arcname='.')
+
+        with open_bundle(self.tar_path) as bundle:
+            assert bundle.compression == 'gz'
+            assert bundle.sizes(is_bundle_file) == (None, os.path.getsize(self.tar_path) * 5)
+        with open_bundle(plain_path) as bundle:
+            assert bundle.compression is None
+            assert bundle.sizes(is_bundle_file) == (None, os.path.getsize(plain_path))
+
+    def test_ingest_tar(self):
+        """ It should ingest an uploaded tar.gz in one pass. """
+        local = Local(image_server=ImageServerFactory(), metadata={'pid': 'tar-vol'})
+        local.bundle = SimpleUploadedFile(name='csv_meta.tar.gz', content=open(self.tar_path, 'rb').read())
+        self.ingest(local)
+
+        assert local.manifest.canvas_set.count() == 10
+        assert all(canvas.ocr_file_path for canvas in local.manifest.canvas_set.all())
+        assert local.report.progress['total'] == 10
+
+    def test_reingest_tar(self):
+        """ It should read each image of a tar stream once when reingesting, even one that changed but kept its size. """
+        local = Local(image_server=ImageServerFactory(), metadata={'pid': 'tar-vol'})
+        local.bundle = SimpleUploadedFile(name='csv_meta.tar.gz', content=open(self.tar_path, 'rb').read())
+        self.ingest(local)
+
+        image_path = os.path.join(self.directory, 'images', '00000004.jpg')
+        content = bytearray(open(image_path, 'rb').read())
+        # Past the JPEG's headers, so it is the same size but not the same file.
+        content[-10] ^= 0xFF
+        open(image_path, 'wb').write(bytes(content))
+        with tarfile.open(self.tar_path, 'w:gz') as tar:
+            tar.add(self.directory, arcname='.')
+
+        reingest = Local(image_server=ImageServerFactory(), metadata={'pid': 'tar-vol'}, reingest=True)
+        reingest.bundle = SimpleUploadedFile(name='csv_meta.tar.gz', content=open(self.tar_path, 'rb').read())
+        self.ingest(reingest)
+
+        with open(reingest.trigger_file) as trigger_file:
+            assert trigger_file.read().splitlines() == ['tar-vol_00000004.jpg']
+        assert len(reingest.unchanged_images) == 9
+        assert reingest.manifest.canvas_set.count() == 10
+
+    def test_tar_metadata_first(self):
+        """ It should read the metadata without a hint when it comes first in a tar. """
+        first_path = os.path.join(BUNDLE_ROOT, 'metadata_first.tar.gz')
+        with tarfile.open(first_path, 'w:gz') as tar:
+            for name in ('metadata.csv', 'images', 'ocr'):
+                tar.add(os.path.join(self.directory, name), arcname=name)
+
+        with self.assertLogs('readux_ingest_ecds.models', level='INFO') as logs:
+            Local(bundle_path=self.tar_path).open_metadata()
+            local = Local(bundle_path=first_path)
+            local.open_metadata()
+
+        assert local.metadata['pid'] == 'sqn75'
+        hints = [line for line in logs.output if 'Add it to the archive first' in line]
+        assert len(hints) == 1 and 'csv_meta.tar.gz' in hints[0]
+
+    def test_ingest_directory(self):
+        """ It should ingest a directory on the server and leave it in place. """
+        local = Local(image_server=ImageServerFactory(), bundle_path=self.directory)
+        local.clean()
+        self.ingest(local)
+
+        assert local.manifest.pid == 'sqn75'
+        assert local.manifest.canvas_set.count() == 10
+        assert os.path.exists(os.path.join(self.directory, 'images', '00000001.jpg'))
+
+    def test_bundle_path_must_be_under_root(self):
+        """ It should refuse paths outside INGEST_BUNDLE_ROOT. """
+        with pytest.raises(ValidationError):
+            Local(bundle_path=os.path.join(BUNDLE_ROOT, '..', 'ocr')).clean()
+        with pytest.raises(ValidationError):
+            Local(bundle_path=os.path.join(BUNDLE_ROOT, 'missing')).clean()
+        with override_settings(INGEST_BUNDLE_ROOT=None), pytest.raises(ValidationError):
+            Local(bundle_path=self.directory).clean()
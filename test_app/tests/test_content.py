@@ -0,0 +1,91 @@
+""" Tests for storing files by content """
+import os
+import sys
+from shutil import copyfile, rmtree
+from unittest.mock import MagicMock, patch
+import boto3
+import pytest
+from moto import mock_s3
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from readux_ingest_ecds.content import ContentStore
+from readux_ingest_ecds.models import CanvasContent, ContentObject, Local
+from readux_ingest_ecds.services import image_services
+from .factories import ImageServerFactory
+
+pytestmark = pytest.mark.django_db(transaction=True) # pylint: disable = invalid-name
+
+CONTENT_DIR = os.path.join(settings.INGEST_TMP_DIR, 'content')
+CONVERTED_DIR = os.path.join(settings.INGEST_TMP_DIR, 'converted')
+
+@mock_s3
+@override_settings(INGEST_CONTENT_DIR=CONTENT_DIR)
+class ContentStoreTest(TestCase):
+    """ Tests for readux_ingest_ecds.content """
+
+    def setUp(self):
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.INGEST_TRIGGER_BUCKET)
+        self.converted = []
+
+    def teardown_class():
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+
+    def ingest(self, pid):
+        local = Local(image_server=ImageServerFactory(), metadata={'pid': pid})
+        local.bundle = SimpleUploadedFile(
+            name='csv_meta.zip',
+            content=open(os.path.join(settings.FIXTURE_DIR, 'csv_meta.zip'), 'rb').read()
+        )
+        local.prep()
+        local.unzip_bundle()
+        local.create_canvases()
+        return local
+
+    def copy_image(self, image_path, target_path):
+        self.converted.append(image_path)
+        copyfile(image_path, target_path)
+        return os.path.getsize(image_path)
+
+    def test_add(self):
+        """ It should keep one copy of identical files and link the others to it. """
+        os.makedirs(settings.INGEST_TMP_DIR)
+        first, second = (os.path.join(settings.INGEST_TMP_DIR, name) for name in ('one.tsv', 'two.tsv'))
+        for path in (first, second):
+            with open(path, 'w') as tsv:
+                tsv.write('same')
+        store = ContentStore()
+
+        content_path, duplicate = store.add(first, 'ab' * 32)
+        assert not duplicate
+        assert store.add(second, 'ab' * 32) == (content_path, True)
+        assert content_path == os.path.join(CONTENT_DIR, 'ab', f'{"ab" * 32}.tsv')
+        assert os.stat(second).st_ino == os.stat(first).st_ino == os.stat(content_path).st_ino
+
+    def test_ocr_stored_once(self):
+        """ It should store the OCR files of two ingests of the same pages once. """
+        first = self.ingest('vol-1')
+        second = self.ingest('vol-2')
+
+        # Three of the ten pages have the same OCR file.
+        assert ContentObject.objects.filter(kind=ContentObject.OCR).count() == 8
+        assert CanvasContent.objects.filter(kind=ContentObject.OCR).count() == 20
+        first_ocr = os.path.join(first.ocr_directory, 'vol-1_00000003.tsv')
+        second_ocr = os.path.join(second.ocr_directory, 'vol-2_00000003.tsv')
+        assert os.stat(first_ocr).st_ino == os.stat(second_ocr).st_ino
+
+    @override_settings(INGEST_IMAGE_CONVERSION='local', INGEST_CONVERTED_DIR=CONVERTED_DIR, INGEST_CONVERSION_WORKERS=1)
+    def test_images_converted_once(self):
+        """ It should only convert images whose content has not been converted before. """
+        with patch.dict(sys.modules, {'pyvips': MagicMock()}), patch.object(image_services, 'convert_image', self.copy_image):
+            self.ingest('vol-1')
+            converted_first = len(self.converted)
+            self.ingest('vol-2')
+
+        assert converted_first == len(self.converted)
+        assert converted_first == ContentObject.objects.filter(kind=ContentObject.IMAGE).count()
+        assert CanvasContent.objects.filter(kind=ContentObject.IMAGE).count() == 20
+        assert os.stat(os.path.join(CONVERTED_DIR, 'vol-1_00000001.tiff')).st_ino == \
+            os.stat(os.path.join(CONVERTED_DIR, 'vol-2_00000001.tiff')).st_ino
@@ -0,0 +1,197 @@
+""" Tests for converting images locally """
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from shutil import copyfile, rmtree
+from unittest.mock import MagicMock, patch
+import boto3
+import pytest
+from moto import mock_s3
+from PIL import Image
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from readux_ingest_ecds.models import Local
+from readux_ingest_ecds.progress import describe
+from readux_ingest_ecds.services import image_services
+from iiif.models import Canvas
+from .daemon import run_in_daemon
+from .factories import ImageServerFactory
+
+pytestmark = pytest.mark.django_db(transaction=True) # pylint: disable = invalid-name
+
+CONVERTED_DIR = os.path.join(settings.INGEST_TMP_DIR, 'converted')
+
+def copy_image(image_path, target_path):
+    copyfile(image_path, target_path)
+    return os.path.getsize(image_path)
+
+@mock_s3
+@override_settings(INGEST_IMAGE_CONVERSION='local', INGEST_CONVERTED_DIR=CONVERTED_DIR, INGEST_CONVERSION_WORKERS=1)
+class ImageServicesTest(TestCase):
+    """ Tests for readux_ingest_ecds.services.image_services """
+
+    def setUp(self):
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+        self.s3 = boto3.resource('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket=settings.INGEST_TRIGGER_BUCKET)
+
+    def teardown_class():
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+
+    def local(self):
+        local = Local(image_server=ImageServerFactory())
+        local.bundle = SimpleUploadedFile(
+            name='csv_meta.zip',
+            content=open(os.path.join(settings.FIXTURE_DIR, 'csv_meta.zip'), 'rb').read()
+        )
+        local.prep()
+        return local
+
+    @override_settings(INGEST_SCRATCH_CLEANUP=True)
+    def test_converts_images(self):
+        """ It should convert every image instead of uploading the trigger file. """
+        local = self.local()
+        with patch.dict(sys.modules, {'pyvips': MagicMock()}), patch.object(image_services, 'convert_image', copy_image):
+            local.ingest()
+
+        pids = sorted(Canvas.objects.filter(manifest__pid='sqn75').values_list('pid', flat=True))
+        assert sorted(os.listdir(CONVERTED_DIR)) == pids
+        assert not [image for image in os.listdir(settings.INGEST_PROCESSING_DIR) if image.startswith('sqn75_')]
+        assert not list(self.s3.Bucket(settings.INGEST_TRIGGER_BUCKET).objects.all())
+
+    def test_partial_files(self):
+        """ It should write each conversion to its own partial file and remove it on failure. """
+        target_path = os.path.join(settings.INGEST_TMP_DIR, 'content.tiff')
+        os.makedirs(settings.INGEST_TMP_DIR)
+        partial_paths = []
+
+        def tiffsave(partial_path, fail=False, **kwargs): # pylint: disable = unused-argument
+            partial_paths.append(partial_path)
+            open(partial_path, 'w').write('tiff')
+            if fail:
+                raise OSError('disk full')
+
+        pyvips = MagicMock()
+        image = pyvips.Image.new_from_file.return_value
+        image.tiffsave.side_effect = tiffsave
+        image_path = os.path.join(settings.FIXTURE_DIR, 'csv_meta.zip')
+        with patch.dict(sys.modules, {'pyvips': pyvips}):
+            image_services.convert_image(image_path, target_path)
+            image_services.convert_image(image_path, target_path)
+            image.tiffsave.side_effect = lambda partial_path, **kwargs: tiffsave(partial_path, fail=True)
+            with pytest.raises(OSError):
+                image_services.convert_image(image_path, target_path)
+
+        assert len(set(partial_paths)) == 3
+        assert all(os.path.dirname(path) == settings.INGEST_TMP_DIR for path in partial_paths)
+        assert os.listdir(settings.INGEST_TMP_DIR) == ['content.tiff']
+
+    def test_missing_pyvips(self):
+        """ It should stop before extracting anything when pyvips is not installed. """
+        local = self.local()
+        with patch.dict(sys.modules, {'pyvips': None}):
+            with pytest.raises(ImproperlyConfigured):
+                local.ingest()
+
+        assert not os.listdir(settings.INGEST_PROCESSING_DIR)
+
+    def test_converts_in_worker(self):
+        """ It should convert images side by side in a celery prefork worker's daemonic process. """
+        image = os.path.join(settings.FIXTURE_DIR, 'csv_meta.zip')
+        with patch.dict(sys.modules, {'pyvips': MagicMock()}), patch.object(image_services, 'convert_image', copy_image):
+            stats = run_in_daemon(
+                image_services.convert_images, [image, image], workers=2,
+                targets=[os.path.join(CONVERTED_DIR, name) for name in ('first.tiff', 'second.tiff')]
+            )
+
+        assert (stats['images'], stats['workers']) == (2, 2)
+        assert sorted(os.listdir(CONVERTED_DIR)) == ['first.tiff', 'second.tiff']
+
+    @override_settings(INGEST_IMAGE_CONVERSION='cloud')
+    def test_unknown_conversion(self):
+        """ It should not accept a conversion it does not know. """
+        with pytest.raises(ImproperlyConfigured):
+            image_services.local_conversion()
+
+    def test_stats(self):
+        """ It should report how fast the images were converted. """
+        image = os.path.join(settings.FIXTURE_DIR, 'csv_meta.zip')
+        with patch.dict(sys.modules, {'pyvips': MagicMock()}), patch.object(image_services, 'convert_image', copy_image):
+            stats = image_services.convert_images([image])
+
+        assert stats['images'] == 1
+        assert stats['bytes'] == os.path.getsize(image)
+        assert stats['workers'] == 1
+        assert stats['images_per_second'] > 0
+
+    @override_settings(INGEST_DERIVATIVES={'thumbnail': 20, 'preview': 40}, INGEST_DERIVATIVE_WORKERS=2)
+    def test_derivatives(self):
+        """ It should make every derivative of each image while the bundle is extracted. """
+        local = self.local()
+        local.unzip_bundle()
+
+        directory = os.path.join(settings.INGEST_PROCESSING_DIR, 'derivatives')
+        assert len(os.listdir(os.path.join(directory, 'thumbnail'))) == 10
+        with Image.open(os.path.join(directory, 'thumbnail', 'sqn75_00000010.jpg')) as thumbnail:
+            assert max(thumbnail.size) == 20
+        with Image.open(os.path.join(directory, 'preview', 'sqn75_00000010.jpg')) as preview:
+            assert max(preview.size) == 40
+
+    @override_settings(INGEST_DERIVATIVES={'thumbnail': 20}, INGEST_DERIVATIVE_WORKERS=1)
+    def test_derivative_failure(self):
+        """ It should log an image it cannot scale and carry on. """
+        not_an_image = os.path.join(settings.INGEST_TMP_DIR, 'broken.jpg')
+        os.makedirs(settings.INGEST_TMP_DIR, exist_ok=True)
+        with open(not_an_image, 'w') as broken:
+            broken.write('not a jpeg')
+
+        with image_services.Derivatives() as derivatives:
+            derivatives.add(not_an_image)
+
+        assert derivatives.failed == 1
+        assert derivatives.made == 0
+
+    @override_settings(INGEST_DERIVATIVES={'thumbnail': 20}, INGEST_DERIVATIVE_WORKERS=1)
+    def test_derivative_failures_reported(self):
+        """ It should record derivatives that failed on the ingest's report. """
+        local = self.local()
+        with patch.object(image_services, 'make_derivatives', side_effect=OSError('disk full')):
+            local.unzip_bundle()
+
+        assert local.report.progress['failures'] == {'derivatives': 10}
+        assert describe(local.report.progress).endswith(', 10 derivatives failed')
+
+    @override_settings(INGEST_DERIVATIVES={'thumbnail': 20}, INGEST_DERIVATIVE_WORKERS=2)
+    def test_derivatives_on_error(self):
+        """ It should count unfinished derivatives as failed and not wait for them when the block raises. """
+        image = os.path.join(settings.FIXTURE_DIR, 'csv_meta.zip')
+        shutdown = ThreadPoolExecutor.shutdown
+        with patch.object(ThreadPoolExecutor, 'shutdown', autospec=True, side_effect=shutdown) as pool_shutdown:
+            with pytest.raises(RuntimeError), image_services.Derivatives() as derivatives:
+                derivatives.add(image)
+                raise RuntimeError('extraction failed')
+
+        assert pool_shutdown.call_args.kwargs == {'wait': False}
+        assert derivatives.failed == 1
+        assert derivatives.made == 0
+
+    @override_settings(INGEST_DERIVATIVES={'thumbnail': 20}, INGEST_DERIVATIVE_WORKERS=2)
+    def test_derivatives_in_worker(self):
+        """ It should make derivatives side by side in a celery prefork worker's daemonic process. """
+        os.makedirs(settings.INGEST_TMP_DIR)
+        images = []
+        for name in ('first', 'second'):
+            images.append(os.path.join(settings.INGEST_TMP_DIR, f'{name}.jpg'))
+            Image.new('RGB', (80, 40)).save(images[-1])
+
+        assert run_in_daemon(make_derivatives_of, images) == 2
+        assert sorted(os.listdir(os.path.join(settings.INGEST_PROCESSING_DIR, 'derivatives', 'thumbnail'))) == \
+            ['first.jpg', 'second.jpg']
+
+def make_derivatives_of(images):
+    with image_services.Derivatives() as derivatives:
+        for image in images:
+            derivatives.add(image)
+    return derivatives.made
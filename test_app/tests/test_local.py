@@ -6,13 +6,18 @@ import boto3
 from uuid import UUID
 from zipfile import ZipFile
 from moto import mock_s3
-from django.test import TestCase
+from unittest.mock import patch
+from django.db import transaction
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings
-from .factories import ImageServerFactory
-from readux_ingest_ecds.models import Local
+from .factories import CollectionFactory, ImageServerFactory, ManifestFactory
+from .test_metrics import RecordingSink
+from readux_ingest_ecds.models import CanvasChecksum, Local
+from readux_ingest_ecds.services.file_services import IngestFiles
 from readux_ingest_ecds.services.iiif_services import create_manifest
-from iiif.models import Canvas, OCR
+from iiif.models import Canvas, Manifest, OCR
 
 pytestmark = pytest.mark.django_db(transaction=True) # pylint: disable = invalid-name
 
@@ -220,3 +225,116 @@ class LocalTest(TestCase):
         local.prep()
         assert local.manifest.pid == '808'
         assert local.manifest.title == 'Goodie Mob'
+
+    def test_create_manifest_after_concurrent_insert(self):
+        """ It should use the manifest another ingest created after this one looked for it. """
+        local = self.mock_local('csv_meta.zip', metadata={'pid': 'race-vol', 'label': 'Second'})
+        real_get = QuerySet.get
+        calls = []
+
+        def get_after_insert(queryset, *args, **kwargs):
+            # The first lookup misses, then the other ingest inserts the row.
+            if kwargs.get('pid') == 'race-vol' and not calls:
+                calls.append(True)
+                ManifestFactory(pid='race-vol')
+                raise queryset.model.DoesNotExist
+            return real_get(queryset, *args, **kwargs)
+
+        with transaction.atomic(), patch.object(QuerySet, 'get', get_after_insert):
+            manifest = create_manifest(local)
+
+        assert manifest.pid == 'race-vol'
+        assert Manifest.objects.filter(pid='race-vol').count() == 1
+
+    @override_settings(INGEST_METRICS_SINKS=['tests.test_metrics.RecordingSink'])
+    def test_prep_statements(self):
+        """ It should create the manifest and add every collection in a few statements. """
+        RecordingSink.emitted = []
+        local = self.mock_local('csv_meta.zip')
+        local.collections.set(CollectionFactory.create_batch(5))
+        local.prep()
+
+        assert local.manifest.collections.count() == 5
+        # Begin, manifest lookup and insert in a savepoint, the ingest's collections,
+        # collections insert, report insert, ingest update and commit.
+        assert RecordingSink.emitted[0]['counts']['prep_statements'] <= 10
+        local.refresh_from_db()
+        assert local.report.manifest == local.manifest
+
+    def test_prep_updates_manifest(self):
+        """ It should update a manifest that already exists and replace its collections. """
+        ManifestFactory(pid='sqn75').collections.set(CollectionFactory.create_batch(2))
+        local = self.mock_local('csv_meta.zip')
+        collection = CollectionFactory()
+        local.collections.set([collection])
+        local.prep()
+
+        assert local.manifest.pk == 'sqn75'
+        assert list(local.manifest.collections.all()) == [collection]
+
+    def test_ingests_do_not_share_files(self):
+        """ It should extract each bundle into its own directory and only use its own files. """
+        first = self.mock_local('csv_meta.zip')
+        # Both bundles have images/00000010.jpg.
+        second = self.mock_local('bundle_with_junk.zip', metadata={'pid': 'junk-vol'})
+        first.prep()
+        second.prep()
+        first.unzip_bundle()
+        second.unzip_bundle()
+        first.create_canvases()
+        second.create_canvases()
+
+        for local in (first, second):
+            pid = local.manifest.pid
+            assert local.manifest.canvas_set.count() == len(local.files.images)
+            assert Canvas.objects.get(pid=f'{pid}_00000010.tiff').width == 32
+            assert Canvas.objects.get(pid=f'{pid}_00000003.tiff').ocr_file_path == os.path.abspath(
+                os.path.join(settings.INGEST_OCR_DIR, pid, f'{pid}_00000003.tsv')
+            )
+        assert not [name for name in os.listdir(settings.INGEST_TMP_DIR) if name.startswith('ingest-')]
+
+    def test_ingest_files(self):
+        """ It should match a page's OCR file by name, not by prefix. """
+        files = IngestFiles('vol')
+        files.add_ocr('/ocr/vol/vol_00000010.tsv')
+        files.add_ocr('/ocr/vol/vol_00000001.hocr.txt')
+
+        assert files.ocr_path('vol_00000001') == '/ocr/vol/vol_00000001.hocr.txt'
+        assert files.ocr_path('vol_0000001') is None
+        assert files.image_path('vol_00000001') is None
+
+    def test_reingest_skips_unchanged_images(self):
+        """ It should only extract and convert the images that changed since the last ingest. """
+        local = self.mock_local('csv_meta.zip')
+        local.prep()
+        local.unzip_bundle()
+        local.create_canvases()
+        pid = local.manifest.pid
+        assert CanvasChecksum.objects.filter(canvas__manifest=local.manifest).count() == 10
+        rmtree(settings.INGEST_PROCESSING_DIR)
+        os.makedirs(settings.INGEST_PROCESSING_DIR)
+
+        changed_bundle = os.path.join(settings.INGEST_TMP_DIR, 'changed.zip')
+        with ZipFile(os.path.join(self.fixture_path, 'csv_meta.zip'), 'r') as original, ZipFile(changed_bundle, 'w') as changed:
+            for member in original.infolist():
+                content = original.read(member)
+                if member.filename == 'images/00000004.jpg':
+                    content = original.read('images/00000010.jpg')
+                changed.writestr(member, content)
+
+        reingest = self.mock_local('csv_meta.zip')
+        reingest.bundle = SimpleUploadedFile(name='changed.zip', content=open(changed_bundle, 'rb').read())
+        reingest.reingest = True
+        reingest.prep()
+        reingest.unzip_bundle()
+        reingest.create_canvases()
+
+        with open(reingest.trigger_file) as trigger_file:
+            assert trigger_file.read().splitlines() == [f'{pid}_00000004.jpg']
+        assert os.listdir(settings.INGEST_PROCESSING_DIR) == [f'{pid}_00000004.jpg']
+        assert len(reingest.unchanged_images) == 9
+        assert reingest.manifest.canvas_set.count() == 10
+        assert Canvas.objects.get(pid=f'{pid}_00000004.tiff').width == 32
+        assert Canvas.objects.get(pid=f'{pid}_00000005.tiff').position == 5
+        assert CanvasChecksum.objects.get(canvas__pid=f'{pid}_00000004.tiff').sha256 == \
+            CanvasChecksum.objects.get(canvas__pid=f'{pid}_00000010.tiff').sha256
@@ -0,0 +1,72 @@
+""" Tests for reading metadata and mapping it to Manifest fields """
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from types import GeneratorType
+import pytest
+from openpyxl import Workbook
+from django.test import TestCase
+from readux_ingest_ecds.services.metadata_services import (
+    ManifestFieldMapper, clean_metadata, get_field_mapper, iter_metadata_rows, metadata_from_file, metadata_rows
+)
+from iiif.models import Canvas
+
+pytestmark = pytest.mark.django_db(transaction=True) # pylint: disable = invalid-name
+
+class MetadataMapperTest(TestCase):
+    """ Tests for readux_ingest_ecds.services.metadata_services.ManifestFieldMapper """
+
+    def test_clean_metadata(self):
+        """ It should only keep columns that are Manifest fields. """
+        metadata = clean_metadata({'PID': 'sqn75', ' Label ': 'Sequoyah', 'Image Server': '1', 'Notes': ['a', 'b']})
+
+        assert metadata == {'pid': 'sqn75'}
+
+    def test_mapper_is_shared(self):
+        """ It should build the mapper once per process. """
+        assert get_field_mapper() is get_field_mapper()
+        assert 'collections' not in get_field_mapper().fields
+
+    def test_coerce_values(self):
+        """ It should convert values to the type of each field. """
+        mapper = ManifestFieldMapper(Canvas)
+        rows = mapper.map_rows([
+            {'PID': 123, 'Position': '4', 'Width': '', 'OCR File Path': None, 'Default OCR': ['line', 'word']},
+            {'PID': 'canvas-2', 'Position': 'first', 'Width': 2.0, 'OCR File Path': [{'label': 'path', 'value': '/ocr/2.txt'}]},
+        ])
+
+        assert rows[0] == {'pid': '123', 'position': 4, 'ocr_file_path': None, 'default_ocr': 'line, word'}
+        assert rows[1] == {'pid': 'canvas-2', 'width': 2, 'ocr_file_path': '/ocr/2.txt'}
+        assert len(mapper._plans) == 2
+
+class ExcelMetadataTest(TestCase):
+    """ Tests for reading Excel metadata files """
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        self.xlsx = os.path.join(self.tmp_dir, 'metadata.xlsx')
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(['PID', 'Label', None])
+        sheet.append(['vol-1', 'Volume 1', 'ignored'])
+        sheet.append([None, None, None])
+        sheet.append(['vol-2'])
+        workbook.save(self.xlsx)
+
+    def tearDown(self):
+        rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_iter_excel_rows(self):
+        """ It should stream rows keyed by the header and skip empty rows. """
+        rows = iter_metadata_rows(self.xlsx)
+
+        assert isinstance(rows, GeneratorType)
+        assert list(rows) == [
+            {'PID': 'vol-1', 'Label': 'Volume 1'},
+            {'PID': 'vol-2', 'Label': None},
+        ]
+
+    def test_metadata_from_excel(self):
+        """ It should only clean the first row. """
+        assert metadata_from_file(self.xlsx) == {'pid': 'vol-1'}
+        assert metadata_rows(self.xlsx)[1]['PID'] == 'vol-2'
@@ -0,0 +1,115 @@
+""" Tests for ingest metrics """
+import os
+import socket
+from shutil import rmtree
+import boto3
+import pytest
+from moto import mock_s3
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from readux_ingest_ecds.metrics import IngestMetrics, LogSink, PrometheusFileSink, StatsdSink, get_sinks
+from readux_ingest_ecds.models import Local
+from readux_ingest_ecds.tasks import add_ocr_task
+from .factories import ImageServerFactory
+
+pytestmark = pytest.mark.django_db(transaction=True) # pylint: disable = invalid-name
+
+class RecordingSink:
+    """ Keeps what it is sent so tests can look at it. """
+    emitted = []
+
+    def emit(self, metrics):
+        self.emitted.append(metrics.as_dict())
+
+@mock_s3
+class IngestMetricsTest(TestCase):
+    """ Tests for readux_ingest_ecds.metrics """
+
+    def setUp(self):
+        RecordingSink.emitted = []
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.INGEST_TRIGGER_BUCKET)
+
+    def teardown_class():
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+
+    def test_stage_timings_add_up(self):
+        """ It should add together the time for a stage that runs more than once. """
+        metrics = IngestMetrics(task='test')
+        with metrics.stage('fetch'):
+            pass
+        first = metrics.timings['fetch']
+        with metrics.stage('fetch'):
+            pass
+        metrics.incr('words', 5)
+        metrics.incr('words', 2)
+
+        assert metrics.timings['fetch'] >= first
+        assert metrics.counts['words'] == 7
+
+    @override_settings(INGEST_METRICS_SINKS=['tests.test_metrics.RecordingSink'])
+    def test_flush(self):
+        """ It should send metrics to each sink and then reset. """
+        metrics = IngestMetrics(task='test')
+        metrics.incr('pages')
+        metrics.flush()
+
+        assert RecordingSink.emitted == [{'tags': {'task': 'test'}, 'timings': {}, 'counts': {'pages': 1}}]
+        assert metrics.counts == {}
+
+    def test_default_sink(self):
+        """ It should log metrics when no sinks are configured. """
+        assert [sink.__class__ for sink in get_sinks()] == [LogSink]
+
+    def test_statsd_sink(self):
+        """ It should send timers and counters over UDP. """
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(('127.0.0.1', 0))
+        with override_settings(INGEST_STATSD_HOST='127.0.0.1', INGEST_STATSD_PORT=receiver.getsockname()[1]):
+            metrics = IngestMetrics(task='add_ocr')
+            metrics.timings['ocr_parse'] = 0.5
+            metrics.incr('words', 10)
+            StatsdSink().emit(metrics)
+        packet = receiver.recv(1024).decode('utf-8')
+        receiver.close()
+
+        assert 'readux.ingest.add_ocr.ocr_parse:500.000|ms' in packet
+        assert 'readux.ingest.add_ocr.words:10|c' in packet
+
+    def test_prometheus_file_sink(self):
+        """ It should write the metrics for the textfile collector. """
+        prom_file = os.path.join(settings.INGEST_TMP_DIR, 'metrics', 'ingest.prom')
+        with override_settings(INGEST_PROMETHEUS_FILE=prom_file):
+            metrics = IngestMetrics(task='local_ingest')
+            metrics.timings['unzip_bundle'] = 1.25
+            metrics.incr('pages', 3)
+            PrometheusFileSink().emit(metrics)
+
+        with open(prom_file, 'r') as prom:
+            contents = prom.read()
+
+        assert 'readux_ingest_stage_seconds{task="local_ingest",stage="unzip_bundle"} 1.250000' in contents
+        assert 'readux_ingest_count{task="local_ingest",name="pages"} 3' in contents
+
+    @override_settings(INGEST_METRICS_SINKS=['tests.test_metrics.RecordingSink'])
+    def test_ingest_stages_are_recorded(self):
+        """ It should record each stage of an ingest and OCR load. """
+        local = Local(image_server=ImageServerFactory())
+        local.bundle = SimpleUploadedFile(
+            name='csv_meta.zip',
+            content=open(os.path.join(settings.FIXTURE_DIR, 'csv_meta.zip'), 'rb').read()
+        )
+        local.prep()
+        local.ingest()
+        add_ocr_task(local.manifest.pk)
+
+        prep, ingest, ocr = RecordingSink.emitted
+
+        assert {'prep', 'open_metadata', 'create_manifest'} <= set(prep['timings'])
+        assert {'unzip_bundle', 'create_canvases', 'upload_trigger_file'} <= set(ingest['timings'])
+        assert ingest['counts']['pages'] == 10
+        assert {'ocr_fetch', 'ocr_parse', 'ocr_insert', 'ocr_save'} <= set(ocr['timings'])
+        assert ocr['counts']['pages'] == 10
+        assert ocr['counts']['words'] > 0
+        assert ocr['tags']['manifest'] == 'sqn75'
@@ -0,0 +1,47 @@
+""" Tests for inserting OCR rows """
+import pytest
+from django.db import connection
+from django.test import TestCase, override_settings
+from readux_ingest_ecds.services.ocr_loaders import RowStream, copy_fields, copy_rows, load_objects, use_copy
+from iiif.models import Canvas, OCR
+from .factories import ManifestFactory
+
+pytestmark = pytest.mark.django_db(transaction=True) # pylint: disable = invalid-name
+
+class OcrLoaderTest(TestCase):
+    """ Tests for readux_ingest_ecds.services.ocr_loaders """
+
+    def setUp(self):
+        self.canvas = Canvas.objects.create(pid='loader-1', manifest=ManifestFactory(), position=1)
+
+    def annotations(self):
+        return [
+            OCR(canvas=self.canvas, x=1, y=2, w=3, h=4, order=1, content='tab\there', resource_type=OCR.OCR),
+            OCR(canvas=self.canvas, x=5, y=6, w=7, h=8, order=2, content=None, resource_type=OCR.OCR),
+        ]
+
+    def test_copy_rows(self):
+        """ It should write each object as a line of COPY's text format. """
+        fields = copy_fields(OCR)
+        lines = list(copy_rows(self.annotations(), fields, connection))
+
+        assert 'id' not in [field.name for field in fields]
+        assert lines[0] == 'loader-1\t1\t2\t3\t4\t1\ttab\\there\tcnt:ContentAsText\n'
+        assert lines[1].split('\t')[6] == '\\N'
+
+    def test_row_stream(self):
+        """ It should read the lines in chunks of any size. """
+        stream = RowStream(['one\n', 'two\n', 'three\n'])
+
+        assert stream.read(5) == 'one\nt'
+        assert stream.read(100) == 'wo\nthree\n'
+        assert stream.read(100) == ''
+
+    @override_settings(INGEST_OCR_LOADER='copy')
+    def test_falls_back_to_bulk_create(self):
+        """ It should use bulk_create when the database is not PostgreSQL. """
+        assert not use_copy(OCR)
+
+        load_objects(OCR, self.annotations(), batch_size=1)
+
+        assert OCR.objects.filter(canvas=self.canvas).count() == 2
@@ -0,0 +1,117 @@
+""" Tests for choosing where to fetch OCR from """
+from concurrent.futures import ThreadPoolExecutor
+from shutil import rmtree
+import boto3
+import pytest
+from moto import mock_s3
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase
+from readux_ingest_ecds.services.ocr_services import get_ocr
+from readux_ingest_ecds.services.ocr_sources import OcrSource, StorageFileSource, ocr_source_for
+from readux_ingest_ecds.services.services import get_session
+from readux_ingest_ecds.tasks import load_ocr
+from test_app.ocr_sources import FakeArchiveLabSource, FakeEmoryOcrBucketSource
+from iiif.models import Canvas, OCR
+from .factories import ImageServerFactory, ManifestFactory
+
+pytestmark = pytest.mark.django_db(transaction=True) # pylint: disable = invalid-name
+
+class OcrSourceTest(TestCase):
+    """ Tests for readux_ingest_ecds.services.ocr_sources """
+
+    def teardown_class():
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+
+    def manifest(self, server_base, pages=3, ocr_file_path=None):
+        manifest = ManifestFactory(image_server=ImageServerFactory(server_base=server_base))
+        for position in range(1, pages + 1):
+            Canvas.objects.create(
+                pid=f'{manifest.pid}_{position:04}.jpg',
+                manifest=manifest,
+                position=position,
+                ocr_file_path=ocr_file_path,
+            )
+        return manifest
+
+    def test_source_for_manifest(self):
+        """ It should pick the first source that handles the manifest. """
+        assert isinstance(ocr_source_for(self.manifest('https://iiif.archivelab.org/iiif')), FakeArchiveLabSource)
+        assert isinstance(ocr_source_for(self.manifest('https://images.readux.ecds.emory.edu')), FakeEmoryOcrBucketSource)
+        assert isinstance(ocr_source_for(self.manifest('http://iiif.ecds.emory.edu', ocr_file_path='ocr.tsv')), StorageFileSource)
+        assert type(ocr_source_for(self.manifest('http://iiif.ecds.emory.edu'))) is OcrSource
+
+    def test_fetch_many_keeps_order(self):
+        """ It should fetch canvases concurrently and return them in order. """
+        manifest = self.manifest('https://images.readux.ecds.emory.edu', pages=7)
+        source = ocr_source_for(manifest)
+        source.batch_size = 3
+        canvases = list(manifest.canvas_set.order_by('position'))
+
+        fetched = list(source.fetch_many(canvases))
+
+        assert source.concurrency == 4
+        assert [canvas for canvas, _ in fetched] == canvases
+        assert all(result.startswith('content') for _, result in fetched)
+        assert sorted(source.requested)[0].endswith(f'/{manifest.pid}/0001.tsv')
+
+    def test_cached(self):
+        """ It should keep fetched OCR in the cache for as long as the source's policy says. """
+        cache.clear()
+        manifest = self.manifest('https://iiif.archivelab.org/iiif', pages=2)
+        canvases = list(manifest.canvas_set.order_by('position'))
+        source = ocr_source_for(manifest)
+        source.cache_timeout = 60
+
+        first = [ocr for _, ocr in source.fetch_many(canvases)]
+        second = [ocr for _, ocr in source.fetch_many(canvases)]
+
+        assert first == second
+        assert len(source.requested) == 2
+        uncached = ocr_source_for(manifest)
+        list(uncached.fetch_many(canvases))
+        assert len(uncached.requested) == 2
+        cache.clear()
+
+    def test_session_per_thread(self):
+        """ It should give each fetching thread a session of its own. """
+        session = get_session()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            sessions = list(pool.map(lambda _: get_session(), range(2)))
+        assert get_session() is session
+        assert session not in sessions
+
+    @mock_s3
+    def test_fetch_many_from_s3(self):
+        """ It should fetch OCR files from S3 in threads with the shared client. """
+        s3 = boto3.resource('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='ocr-files')
+        manifest = self.manifest('http://iiif.ecds.emory.edu', pages=6)
+        for canvas in manifest.canvas_set.all():
+            canvas.ocr_file_path = f'ocr/{canvas.pid}.tsv'
+            canvas.save()
+            s3.Object('ocr-files', canvas.ocr_file_path).put(Body=canvas.pid.encode())
+        manifest.image_server.storage_service = 's3'
+        manifest.image_server.bucket = s3.Bucket('ocr-files')
+
+        source = StorageFileSource(manifest)
+        canvases = list(manifest.canvas_set.order_by('position'))
+
+        assert source.concurrency == 4
+        assert [result for _, result in source.fetch_many(canvases)] == [canvas.pid.encode() for canvas in canvases]
+
+    def test_get_ocr(self):
+        """ It should fetch and parse OCR from the manifest's source. """
+        manifest = self.manifest('https://iiif.archivelab.org/iiif', pages=1)
+
+        ocr = get_ocr(manifest.canvas_set.first())
+
+        assert ocr[0]['content'] == 'Dope'
+
+    def test_load_ocr(self):
+        """ It should save the OCR fetched for each canvas. """
+        manifest = self.manifest('https://images.readux.ecds.emory.edu', pages=2)
+
+        load_ocr(manifest.pk)
+
+        assert OCR.objects.filter(canvas__manifest=manifest).count() == 2 * len(get_ocr(manifest.canvas_set.first()))
@@ -0,0 +1,171 @@
+""" Tests for ingest progress """
+import json
+import os
+from shutil import rmtree
+from unittest.mock import patch
+import boto3
+import pytest
+from moto import mock_s3
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from readux_ingest_ecds.models import IngestReport, Local
+from readux_ingest_ecds.progress import Progress, describe
+from readux_ingest_ecds.transactions import TransactionBatches
+from readux_ingest_ecds.services.validation_services import InvalidBundle
+from readux_ingest_ecds.tasks import WorkerLost, check_deliveries, local_ingest_task_ecds, will_retry
+from readux_ingest_ecds.views import ingest_progress
+from .factories import ImageServerFactory, UserFactory
+
+pytestmark = pytest.mark.django_db(transaction=True) # pylint: disable = invalid-name
+
+@mock_s3
+class ProgressTest(TestCase):
+    """ Tests for readux_ingest_ecds.progress and the progress view """
+
+    def setUp(self):
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.INGEST_TRIGGER_BUCKET)
+
+    def teardown_class():
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+
+    @override_settings(INGEST_PROGRESS_INTERVAL=60)
+    def test_throttled(self):
+        """ It should save when a stage starts and finishes, not for every page. """
+        report = IngestReport.objects.create()
+        progress = Progress(report, 'add_ocr')
+
+        with CaptureQueriesContext(connection) as queries:
+            progress.stage('add_ocr', total=100)
+            for _ in range(100):
+                progress.advance(words=10)
+
+        assert len(queries) == 1
+        assert IngestReport.objects.get(pk=report.pk).progress['done'] == 0
+
+        progress.finish()
+        saved = IngestReport.objects.get(pk=report.pk).progress
+        assert saved['done'] == 100
+        assert saved['words'] == 1000
+        assert saved['finished']
+
+    def test_second_connection(self):
+        """ It should save progress outside the task's open batch of canvases, except on SQLite. """
+        report = IngestReport.objects.create()
+        progress = Progress(report, 'add_ocr')
+        assert progress.database() == 'default'
+
+        # As in a worker, where no transaction is open when the task starts.
+        progress.started_in_transaction = False
+        try:
+            with patch.object(type(connections['default']), 'vendor', 'postgresql'):
+                with TransactionBatches(scope='manifest') as batches, batches.canvas():
+                    alias = progress.database()
+            assert alias == 'default_ingest_progress'
+            assert connections.databases[alias]['NAME'] == connections.databases['default']['NAME']
+        finally:
+            # The test case only knows the databases it started with.
+            connections.databases.pop('default_ingest_progress', None)
+
+        with TransactionBatches(scope='manifest') as batches, batches.canvas():
+            assert progress.database() == 'default'
+
+    def test_describe(self):
+        """ It should describe progress in words. """
+        assert describe({}) == 'Waiting to start'
+        assert describe({'stage': 'add_ocr', 'done': 5, 'total': 10, 'words': 50, 'eta': 4.2, 'finished': False}) == \
+            'add_ocr: 5 of 10, 50 words, about 4s left'
+        assert describe({'words': 50, 'finished': True, 'failures': {'derivatives': 2}}) == \
+            'Finished, 50 words loaded, 2 derivatives failed'
+
+    def test_failures_kept(self):
+        """ It should keep failures from earlier tasks of the ingest, but not from an earlier try of the same task. """
+        report = IngestReport.objects.create()
+        Progress(report, 'local_ingest').record_failures('derivatives', 3)
+
+        assert Progress(report, 'add_ocr').state['failures'] == {'derivatives': 3}
+        assert Progress(report, 'local_ingest').state['failures'] == {}
+
+    def test_ingest_progress(self):
+        """ It should follow the ingest through to the last page of OCR and serve it as JSON. """
+        local = Local(image_server=ImageServerFactory())
+        local.bundle = SimpleUploadedFile(
+            name='csv_meta.zip',
+            content=open(os.path.join(settings.FIXTURE_DIR, 'csv_meta.zip'), 'rb').read()
+        )
+        local.prep()
+        report = local.report
+
+        local_ingest_task_ecds(local.pk)
+
+        progress = IngestReport.objects.get(pk=report.pk).progress
+        assert progress['task'] == 'add_ocr'
+        assert progress['done'] == progress['total'] == 10
+        assert progress['words'] > 0
+        assert progress['finished']
+
+        request = RequestFactory().get(f'/ingest/progress/{report.pk}/')
+        request.user = AnonymousUser()
+        assert ingest_progress(request, report.pk).status_code == 302
+        request.user = UserFactory(is_staff=True)
+        response = json.loads(ingest_progress(request, report.pk).content)
+        assert response['manifest'] == 'sqn75'
+        assert response['progress'] == progress
+        assert response['text'].startswith('Finished')
+
+    def test_failed_ingest(self):
+        """ It should save the error to the progress so the page stops polling. """
+        local = Local(image_server=ImageServerFactory())
+        local.bundle = SimpleUploadedFile(
+            name='csv_meta.zip',
+            content=open(os.path.join(settings.FIXTURE_DIR, 'csv_meta.zip'), 'rb').read()
+        )
+        local.prep()
+
+        with patch.object(Local, 'unzip_bundle', side_effect=OSError('disk full')), pytest.raises(OSError):
+            local_ingest_task_ecds(local.pk)
+
+        progress = IngestReport.objects.get(pk=local.report.pk).progress
+        assert progress['failed'] and not progress['retrying']
+        assert describe(progress) == 'Failed at the start: OSError: disk full'
+
+    def test_will_retry(self):
+        """ It should only expect a retry for errors celery retries, until the retries run out. """
+        assert not will_retry(local_ingest_task_ecds, OSError())
+
+        for retries, error, expected in ((0, OSError(), True), (0, InvalidBundle(), False), (20, OSError(), False)):
+            local_ingest_task_ecds.push_request(called_directly=False, retries=retries)
+            try:
+                assert will_retry(local_ingest_task_ecds, error) is expected
+            finally:
+                local_ingest_task_ecds.pop_request()
+        assert describe({'stage': 'add_ocr', 'retrying': True, 'error': 'OSError: disk full'}) == \
+            'Retrying after an error at add_ocr: OSError: disk full'
+
+    @override_settings(INGEST_MAX_DELIVERIES=2)
+    def test_deliveries_capped(self):
+        """ It should stop a task whose worker keeps being lost, counting each retry afresh. """
+        report = IngestReport.objects.create()
+        check_deliveries(local_ingest_task_ecds, report)
+        assert 'delivery' not in IngestReport.objects.get(pk=report.pk).progress
+
+        for retries, deliveries in ((0, 2), (1, 1)):
+            local_ingest_task_ecds.push_request(called_directly=False, id='task-id', retries=retries)
+            try:
+                for _ in range(deliveries):
+                    check_deliveries(local_ingest_task_ecds, report)
+                if retries == 0:
+                    with pytest.raises(WorkerLost):
+                        check_deliveries(local_ingest_task_ecds, report)
+            finally:
+                local_ingest_task_ecds.pop_request()
+
+        progress = IngestReport.objects.get(pk=report.pk).progress
+        assert progress['delivery'] == {'key': 'task-id:1', 'count': 1}
+        assert Progress(report, 'local_ingest').state['delivery'] == progress['delivery']
+        assert not will_retry(local_ingest_task_ecds, WorkerLost())
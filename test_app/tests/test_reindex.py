@@ -0,0 +1,103 @@
+""" Tests for deferred reindexing """
+import os
+from shutil import rmtree
+import boto3
+import pytest
+from moto import mock_s3
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models.signals import post_save
+from django.test import TestCase, override_settings
+from readux_ingest_ecds.models import Local
+from readux_ingest_ecds.reindex import batches, canvases_loaded, reindex_deferred
+from readux_ingest_ecds.tasks import local_ingest_task_ecds
+from iiif.models import Canvas, OCR
+from .factories import ImageServerFactory
+
+pytestmark = pytest.mark.django_db(transaction=True) # pylint: disable = invalid-name
+
+HANDLED = []
+
+def record_batch(manifest, canvas_ids):
+    HANDLED.append((manifest.pid, list(canvas_ids), OCR.objects.filter(canvas__pk__in=canvas_ids).exists()))
+
+@mock_s3
+class ReindexTest(TestCase):
+    """ Tests for readux_ingest_ecds.reindex """
+
+    def setUp(self):
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.INGEST_TRIGGER_BUCKET)
+        HANDLED.clear()
+        self.saved = []
+        self.sent = []
+        post_save.connect(self.canvas_saved, sender=Canvas)
+        canvases_loaded.connect(self.batch_sent)
+
+    def tearDown(self):
+        post_save.disconnect(self.canvas_saved, sender=Canvas)
+        canvases_loaded.disconnect(self.batch_sent)
+
+    def teardown_class():
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+
+    def canvas_saved(self, instance, created, **kwargs):
+        if not created:
+            self.saved.append(instance.pk)
+
+    def batch_sent(self, manifest, canvas_ids, **kwargs):
+        self.sent.append(canvas_ids)
+
+    def ingest(self):
+        local = Local(image_server=ImageServerFactory())
+        local.bundle = SimpleUploadedFile(
+            name='csv_meta.zip',
+            content=open(os.path.join(settings.FIXTURE_DIR, 'csv_meta.zip'), 'rb').read()
+        )
+        local.prep()
+        local_ingest_task_ecds(local.pk)
+        return local
+
+    def test_canvas_mode(self):
+        """ It should save each canvas as its OCR loads by default. """
+        self.ingest()
+
+        # Three of the pages have no words.
+        assert len(self.saved) == 7
+        assert self.sent == []
+
+    @override_settings(INGEST_REINDEX='deferred', INGEST_REINDEX_HANDLER='tests.test_reindex.record_batch', INGEST_REINDEX_BATCH_SIZE=4)
+    def test_deferred(self):
+        """ It should not save canvases while OCR loads and hand them over in batches once it has. """
+        local = self.ingest()
+
+        assert self.saved == []
+        assert [len(batch) for batch in self.sent] == [4, 3]
+        assert [batch for _, batch, _ in HANDLED] == self.sent
+        assert all(pid == local.manifest.pid and has_ocr for pid, _, has_ocr in HANDLED)
+
+    @override_settings(INGEST_REINDEX='deferred')
+    def test_deferred_signal_only(self):
+        """ It should only send the signal, once for the whole manifest, by default. """
+        self.ingest()
+
+        assert len(self.sent) == 1
+        assert len(self.sent[0]) == 7
+        assert self.saved == []
+
+    @override_settings(INGEST_REINDEX='deferred', INGEST_REINDEX_HANDLER='readux_ingest_ecds.reindex.save_canvases')
+    def test_save_canvases_handler(self):
+        """ It should save every canvas once, after all the OCR is loaded. """
+        self.ingest()
+
+        assert len(self.sent) == 1
+        assert sorted(self.saved) == sorted(self.sent[0])
+
+    def test_settings(self):
+        """ It should check the mode and make one batch when no size is set. """
+        assert batches(list(range(10))) == [list(range(10))]
+        assert batches([]) == []
+        with override_settings(INGEST_REINDEX='later'), pytest.raises(ImproperlyConfigured):
+            reindex_deferred()
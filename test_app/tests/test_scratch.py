@@ -0,0 +1,149 @@
+""" Tests for scratch space """
+import os
+import socket
+from shutil import rmtree
+from time import time
+import boto3
+import pytest
+from moto import mock_s3
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from readux_ingest_ecds.models import Local
+from readux_ingest_ecds.scratch import InsufficientScratchSpace, ScratchSpace
+from readux_ingest_ecds.tasks import add_ocr_task, conversion_finished_task_ecds, local_ingest_task_ecds
+from iiif.models import OCR, Canvas
+from .factories import ImageServerFactory, ManifestFactory
+
+pytestmark = pytest.mark.django_db(transaction=True) # pylint: disable = invalid-name
+
+@mock_s3
+class ScratchSpaceTest(TestCase):
+    """ Tests for readux_ingest_ecds.scratch """
+
+    def setUp(self):
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.INGEST_TRIGGER_BUCKET)
+
+    def teardown_class():
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+
+    def test_reserve(self):
+        """ It should hold space while the block runs and release it after. """
+        scratch = ScratchSpace()
+        with scratch.reserve('vol-1', 1024):
+            with scratch.reserve('vol-1', 2048):
+                reserved = scratch.usage()['reserved']
+                assert sorted(reservation['size'] for reservation in reserved.values()) == [1024, 2048]
+                assert all(reservation['key'] == 'vol-1' for reservation in reserved.values())
+            # The second run only released its own space.
+            assert [reservation['size'] for reservation in scratch.usage()['reserved'].values()] == [1024]
+            with pytest.raises(InsufficientScratchSpace):
+                with scratch.reserve('vol-2', scratch.usage()['free']):
+                    pass
+
+        assert scratch.usage()['reserved'] == {}
+
+    def test_stale_reservations(self):
+        """ It should drop reservations whose process is gone or that are too old. """
+        scratch = ScratchSpace()
+        with scratch.ledger() as reservations:
+            reservations['dead:1'] = {'key': 'dead', 'size': 1, 'host': socket.gethostname(), 'pid': 2 ** 22 + 1, 'created': time()}
+            reservations['old:1'] = {'key': 'old', 'size': 1, 'host': 'elsewhere', 'pid': 1, 'created': time() - scratch.ttl - 1}
+            reservations['live:1'] = {'key': 'live', 'size': 1, 'host': 'elsewhere', 'pid': 1, 'created': time()}
+            reservations['legacy'] = 1024
+
+        assert list(scratch.usage()['reserved']) == ['live:1']
+
+    @override_settings(INGEST_SCRATCH_HEADROOM=1024 ** 4)
+    def test_not_enough_space(self):
+        """ It should not extract a bundle when the scratch disk is too full. """
+        local = Local(image_server=ImageServerFactory())
+        local.bundle = SimpleUploadedFile(
+            name='csv_meta.zip',
+            content=open(os.path.join(settings.FIXTURE_DIR, 'csv_meta.zip'), 'rb').read()
+        )
+        local.prep()
+
+        with pytest.raises(InsufficientScratchSpace):
+            local.unzip_bundle()
+
+        assert not os.listdir(settings.INGEST_PROCESSING_DIR)
+
+    @override_settings(INGEST_SCRATCH_CLEANUP=True)
+    def test_cleanup(self):
+        """ It should remove each file once nothing needs it. """
+        local = Local(image_server=ImageServerFactory())
+        local.bundle = SimpleUploadedFile(
+            name='csv_meta.zip',
+            content=open(os.path.join(settings.FIXTURE_DIR, 'csv_meta.zip'), 'rb').read()
+        )
+        local.prep()
+        bundle_path = local.bundle.path
+        trigger_file = local.trigger_file
+
+        local_ingest_task_ecds(local.pk)
+
+        assert OCR.objects.filter(canvas__manifest__pid='sqn75').exists()
+        assert not os.path.exists(bundle_path)
+        assert not os.path.exists(trigger_file)
+        assert not os.path.exists(os.path.join(settings.INGEST_TMP_DIR, 'images'))
+        # The canvases still read their OCR files from here.
+        assert len(os.listdir(os.path.join(settings.INGEST_OCR_DIR, 'sqn75'))) == 10
+        assert ScratchSpace().ingest_usage('sqn75')['processing'] > 0
+
+        assert conversion_finished_task_ecds('sqn75') == 10
+        assert ScratchSpace().ingest_usage('sqn75')['processing'] == 0
+
+    @override_settings(INGEST_SCRATCH_CLEANUP=True)
+    def test_load_ocr_twice(self):
+        """ It should keep the OCR files canvases point to, so the OCR can be loaded again. """
+        local = Local(image_server=ImageServerFactory())
+        local.bundle = SimpleUploadedFile(
+            name='csv_meta.zip',
+            content=open(os.path.join(settings.FIXTURE_DIR, 'csv_meta.zip'), 'rb').read()
+        )
+        local.prep()
+        local_ingest_task_ecds(local.pk)
+        words = OCR.objects.filter(canvas__manifest__pid='sqn75').count()
+        stray_file = os.path.join(settings.INGEST_OCR_DIR, 'sqn75', 'stray.tsv')
+        open(stray_file, 'w').close()
+
+        add_ocr_task(local.manifest.pk)
+
+        assert OCR.objects.filter(canvas__manifest__pid='sqn75').count() == words * 2
+        assert not os.path.exists(stray_file)
+
+    def test_no_cleanup_by_default(self):
+        """ It should leave the bundle and OCR files in place unless cleanup is turned on. """
+        local = Local(image_server=ImageServerFactory())
+        local.bundle = SimpleUploadedFile(
+            name='csv_meta.zip',
+            content=open(os.path.join(settings.FIXTURE_DIR, 'csv_meta.zip'), 'rb').read()
+        )
+        local.prep()
+        bundle_path = local.bundle.path
+
+        local_ingest_task_ecds(local.pk)
+
+        assert os.path.exists(bundle_path)
+        assert len(os.listdir(os.path.join(settings.INGEST_OCR_DIR, 'sqn75'))) == 10
+
+    def test_processing_files_by_canvas(self):
+        """ It should only remove the images of the manifest's canvases, not of a manifest whose pid starts with its pid. """
+        os.makedirs(settings.INGEST_PROCESSING_DIR)
+        for pid, images in (('abc', ('abc_0001', '0002_abc')), ('abc_2', ('abc_2_0001',))):
+            manifest = ManifestFactory(pid=pid)
+            for position, image in enumerate(images):
+                Canvas.objects.create(manifest=manifest, pid=f'{image}.tiff', position=position)
+                open(os.path.join(settings.INGEST_PROCESSING_DIR, f'{image}.jpg'), 'w').write('image')
+
+        assert ScratchSpace().ingest_usage('abc')['processing'] == 10
+        assert ScratchSpace().remove_processing_files('abc') == 2
+        assert os.listdir(settings.INGEST_PROCESSING_DIR) == ['abc_2_0001.jpg']
+
+    def test_command(self):
+        """ It should print the scratch disk's usage. """
+        call_command('ingest_scratch', converted=['sqn75'])
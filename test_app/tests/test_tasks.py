@@ -0,0 +1,137 @@
+""" Tests for ingest tasks """
+import os
+from shutil import rmtree
+from unittest.mock import patch
+import boto3
+import pytest
+from moto import mock_s3
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from readux_ingest_ecds.memory import MB, MemoryBudgetExceeded, current_rss
+from readux_ingest_ecds.models import IngestReport, Local
+from readux_ingest_ecds import profiling, tasks
+from readux_ingest_ecds.tasks import add_ocr_task, bulk_lane_task, local_ingest_task_ecds
+from iiif.models import OCR
+from .factories import ImageServerFactory
+
+pytestmark = pytest.mark.django_db(transaction=True) # pylint: disable = invalid-name
+
+@mock_s3
+class IngestTaskTest(TestCase):
+    """ Tests for readux_ingest_ecds.tasks """
+
+    def setUp(self):
+        """ Set instance variables. """
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+        conn = boto3.resource('s3', region_name='us-east-1')
+        conn.create_bucket(Bucket=settings.INGEST_TRIGGER_BUCKET)
+
+    def teardown_class():
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+
+    def mock_local(self, bundle='csv_meta.zip', **kwargs):
+        local = Local(image_server=ImageServerFactory(), **kwargs)
+        local.bundle = SimpleUploadedFile(
+            name=bundle,
+            content=open(os.path.join(settings.FIXTURE_DIR, bundle), 'rb').read()
+        )
+        local.prep()
+        return local
+
+    def test_profile_ingest(self):
+        """ It should save profiles for the ingest and OCR tasks to a report. """
+        local = self.mock_local(profile=True)
+        local_ingest_task_ecds(local.pk)
+
+        report = IngestReport.objects.get(manifest__pid='sqn75')
+
+        assert set(report.profiles.keys()) == {'local_ingest_task_ecds', 'add_ocr_task'}
+        for profile in report.profiles.values():
+            assert os.path.isfile(profile['file'])
+            assert 'cumulative' in profile['summary']
+        assert 'load_ocr' in report.profiles['add_ocr_task']['summary']
+
+    @override_settings(INGEST_PROFILE=True)
+    def test_profile_setting(self):
+        """ It should profile every ingest when the setting is on. """
+        local = self.mock_local()
+        local_ingest_task_ecds(local.pk)
+
+        assert len(IngestReport.objects.get(manifest__pid='sqn75').profiles) == 2
+
+    def test_profile_not_saved(self):
+        """ It should log a profile it cannot save and keep the task's own error. """
+        with patch.object(profiling, 'save_profile', side_effect=OSError('disk full')):
+            with self.assertLogs('readux_ingest_ecds.profiling', level='ERROR'):
+                with profiling.profile_task('add_ocr_task'):
+                    pass
+            with pytest.raises(ValueError), self.assertLogs('readux_ingest_ecds.profiling', level='ERROR'):
+                with profiling.profile_task('add_ocr_task'):
+                    raise ValueError('bad OCR')
+
+    def test_no_profile(self):
+        """ It should not profile by default. """
+        local = self.mock_local()
+        local_ingest_task_ecds(local.pk)
+
+        assert IngestReport.objects.get(manifest__pid='sqn75').profiles == {}
+
+    def test_memory_is_recorded(self):
+        """ It should record memory used by each stage on the report. """
+        local = self.mock_local()
+        local_ingest_task_ecds(local.pk)
+
+        memory = IngestReport.objects.get(manifest__pid='sqn75').memory
+
+        assert set(memory.keys()) == {'prep', 'ingest', 'add_ocr'}
+        assert {'prep', 'open_metadata', 'create_manifest'} <= set(memory['prep'].keys())
+        assert {'unzip_bundle', 'create_canvases'} <= set(memory['ingest'].keys())
+        assert {'ocr_fetch', 'ocr_parse', 'ocr_insert', 'ocr_save'} <= set(memory['add_ocr'].keys())
+        for stage in memory['ingest'].values():
+            assert stage['rss_peak'] >= stage['rss_end'] > 0
+            assert 'tracemalloc_peak' not in stage
+
+    @override_settings(INGEST_TRACEMALLOC=True)
+    def test_tracemalloc(self):
+        """ It should record the peak of Python allocations when asked. """
+        local = self.mock_local()
+        local_ingest_task_ecds(local.pk)
+
+        memory = IngestReport.objects.get(manifest__pid='sqn75').memory
+
+        assert memory['add_ocr']['ocr_parse']['tracemalloc_peak'] > 0
+        assert memory['ingest']['ingest']['tracemalloc_peak'] >= memory['ingest']['unzip_bundle']['tracemalloc_peak']
+
+    def test_memory_budget_exceeded(self):
+        """ It should stop with a clear error instead of running out of memory. """
+        local = self.mock_local()
+        with override_settings(INGEST_MEMORY_BUDGET=1):
+            with pytest.raises(MemoryBudgetExceeded, match='unzip_bundle.*INGEST_MEMORY_BUDGET'):
+                local_ingest_task_ecds(local.pk)
+
+    def test_low_memory_batches(self):
+        """ It should load OCR in small batches when over the soft limit. """
+        local = self.mock_local()
+        budget = current_rss() / MB * 4
+        with override_settings(INGEST_MEMORY_BUDGET=budget, INGEST_MEMORY_SOFT_LIMIT=0.01, INGEST_OCR_LOW_MEMORY_BATCH_SIZE=7), \
+            patch.object(tasks, 'add_ocr_annotations', wraps=tasks.add_ocr_annotations) as add_ocr_annotations, \
+            patch.object(QuerySet, 'iterator', autospec=True, side_effect=QuerySet.iterator) as iterator:
+            local_ingest_task_ecds(local.pk)
+
+        assert OCR.objects.filter(canvas__manifest__pid='sqn75').count() > 7
+        # Every canvas with words is inserted and saved in batches of 7.
+        assert add_ocr_annotations.call_count == 7
+        assert all(call.kwargs['batch_size'] == 7 for call in add_ocr_annotations.call_args_list)
+        chunk_sizes = [call.kwargs.get('chunk_size') for call in iterator.call_args_list if call.args[0].model is OCR]
+        assert chunk_sizes == [7] * 7
+
+    def test_task_queues(self):
+        """ Ingest and OCR tasks should go to their own queues and be acknowledged once done. """
+        assert local_ingest_task_ecds.queue == 'ingest'
+        assert bulk_lane_task.queue == 'ingest'
+        assert add_ocr_task.queue == 'ingest_ocr'
+        assert local_ingest_task_ecds.acks_late and add_ocr_task.acks_late
+        assert local_ingest_task_ecds.reject_on_worker_lost
+        assert not add_ocr_task.reject_on_worker_lost
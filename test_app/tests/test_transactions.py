@@ -0,0 +1,60 @@
+""" Tests for batching ingest writes into transactions """
+import pytest
+from django.test import TestCase
+from readux_ingest_ecds.transactions import TransactionBatches
+from iiif.models import Canvas
+from .factories import ManifestFactory
+
+pytestmark = pytest.mark.django_db(transaction=True) # pylint: disable = invalid-name
+
+class TransactionBatchesTest(TestCase):
+    """ Tests for readux_ingest_ecds.transactions.TransactionBatches """
+
+    def setUp(self):
+        self.manifest = ManifestFactory()
+
+    def add_canvases(self, batches, count, fail_at=None):
+        for position in range(1, count + 1):
+            with batches.canvas():
+                Canvas.objects.create(pid=f'canvas-{position}', manifest=self.manifest, position=position)
+                if position == fail_at:
+                    raise RuntimeError('Bad canvas')
+
+    def test_batches(self):
+        """ It should commit every batch_size canvases and once more for the rest. """
+        with TransactionBatches(scope='batch', batch_size=2) as batches:
+            self.add_canvases(batches, 5)
+
+        assert batches.commits == 3
+        assert Canvas.objects.filter(manifest=self.manifest).count() == 5
+
+    def test_failure_rolls_back_batch(self):
+        """ It should keep the batches saved before a failure and drop the current one. """
+        with pytest.raises(RuntimeError):
+            with TransactionBatches(scope='batch', batch_size=2) as batches:
+                self.add_canvases(batches, 5, fail_at=4)
+
+        assert batches.commits == 1
+        assert sorted(Canvas.objects.filter(manifest=self.manifest).values_list('position', flat=True)) == [1, 2]
+
+    def test_manifest_scope(self):
+        """ It should save nothing when any canvas fails. """
+        with pytest.raises(RuntimeError):
+            with TransactionBatches(scope='manifest', batch_size=2) as batches:
+                self.add_canvases(batches, 5, fail_at=5)
+
+        assert Canvas.objects.filter(manifest=self.manifest).count() == 0
+
+    def test_autocommit(self):
+        """ It should leave every statement to commit on its own. """
+        with pytest.raises(RuntimeError):
+            with TransactionBatches(scope='autocommit') as batches:
+                self.add_canvases(batches, 3, fail_at=3)
+
+        assert batches.commits == 0
+        assert Canvas.objects.filter(manifest=self.manifest).count() == 3
+
+    def test_unknown_scope(self):
+        """ It should not accept a scope it does not know. """
+        with pytest.raises(ValueError):
+            TransactionBatches(scope='canvas')
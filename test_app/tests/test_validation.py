@@ -0,0 +1,136 @@
+""" Tests for checking bundles before ingesting them """
+import json
+import os
+from io import StringIO
+from shutil import rmtree
+from zipfile import ZipFile
+import boto3
+import pytest
+from moto import mock_s3
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from readux_ingest_ecds.models import IngestReport, Local
+from readux_ingest_ecds.services.validation_services import InvalidBundle, validate_bundle
+from readux_ingest_ecds.tasks import local_ingest_task_ecds
+from iiif.models import Canvas, Manifest
+from .daemon import run_in_daemon
+from .factories import ImageServerFactory
+
+pytestmark = pytest.mark.django_db(transaction=True) # pylint: disable = invalid-name
+
+class ValidationTest(TestCase):
+    """ Tests for readux_ingest_ecds.services.validation_services """
+
+    def setUp(self):
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+        os.makedirs(settings.INGEST_TMP_DIR)
+        self.good_bundle = os.path.join(settings.FIXTURE_DIR, 'csv_meta.zip')
+        self.bad_bundle = os.path.join(settings.INGEST_TMP_DIR, 'broken.zip')
+        with ZipFile(self.good_bundle, 'r') as original, ZipFile(self.bad_bundle, 'w') as broken:
+            for member in original.infolist():
+                content = original.read(member)
+                if member.filename == 'images/00000002.jpg':
+                    content = b'not an image'
+                broken.writestr(member, content)
+            broken.write(os.path.join(settings.FIXTURE_DIR, 'bad_hocr.hocr'), 'ocr/00000003.hocr')
+            broken.writestr('ocr/00000011.tsv', open(os.path.join(settings.FIXTURE_DIR, 'sample.tsv'), 'rb').read())
+
+    def teardown_class():
+        rmtree(settings.INGEST_TMP_DIR, ignore_errors=True)
+
+    def test_valid_bundle(self):
+        """ It should find every image and OCR file, the same in the pool or in the process. """
+        report = validate_bundle(self.good_bundle, workers=2)
+
+        assert report.valid
+        assert (report.images, report.ocr_files) == (10, 10)
+        assert report.words > 0
+        assert validate_bundle(self.good_bundle, workers=1).as_dict() == report.as_dict()
+
+    def test_broken_bundle(self):
+        """ It should report every broken file without touching the database. """
+        report = validate_bundle(self.bad_bundle, workers=2)
+
+        assert not report.valid
+        assert [problem['file'] for problem in report.problems] == [
+            'images/00000002.jpg', 'ocr/00000003.hocr', 'ocr/00000011.tsv'
+        ]
+        assert report.problems[0]['error'].startswith('Not a readable image')
+        assert report.problems[1]['error'].startswith('HocrValidationError')
+        assert report.problems[2]['error'] == 'No image for this OCR file'
+        assert not Manifest.objects.exists()
+        assert not Canvas.objects.exists()
+
+    def test_unloaded_ocr(self):
+        """ It should warn about OCR files the ingest accepts but loads no words from, without failing. """
+        bundle = os.path.join(settings.INGEST_TMP_DIR, 'html.zip')
+        with ZipFile(self.good_bundle, 'r') as original, ZipFile(bundle, 'w') as html:
+            for member in original.infolist():
+                html.writestr(member, original.read(member))
+            html.writestr('ocr/00000001.html', '<html><body>Some words</body></html>')
+
+        report = validate_bundle(bundle, workers=1)
+
+        assert report.valid
+        assert report.as_dict()['warnings'] == [
+            {'file': 'ocr/00000001.html', 'warning': 'OCR in .html files is not loaded'}
+        ]
+        out = StringIO()
+        call_command('ingest_validate', bundle, stdout=out)
+        assert 'ocr/00000001.html: warning: OCR in .html files is not loaded' in out.getvalue()
+
+    def test_in_worker(self):
+        """ It should check files side by side in a celery prefork worker's daemonic process. """
+        report = run_in_daemon(validate_bundle, self.bad_bundle, workers=2)
+
+        expected = validate_bundle(self.bad_bundle, workers=1)
+        assert (report.images, report.ocr_files, report.words) == (expected.images, expected.ocr_files, expected.words)
+        assert [problem['file'] for problem in report.problems] == [problem['file'] for problem in expected.problems]
+
+    def test_fail_fast(self):
+        """ It should stop at the first problem. """
+        assert len(validate_bundle(self.bad_bundle, workers=1, fail_fast=True).problems) == 1
+
+    def test_unreadable_bundle(self):
+        """ It should report a file that is not a bundle. """
+        report = validate_bundle(os.path.join(settings.FIXTURE_DIR, 'metadata.csv'))
+
+        assert not report.valid
+        assert report.problems[0]['error'].startswith('Could not read bundle')
+
+    def test_command(self):
+        """ It should print the reports and fail when a bundle has problems. """
+        out = StringIO()
+        call_command('ingest_validate', self.good_bundle, '--json', stdout=out)
+        assert json.loads(out.getvalue())[0]['valid']
+
+        out = StringIO()
+        with pytest.raises(CommandError):
+            call_command('ingest_validate', self.good_bundle, self.bad_bundle, '--workers', '1', stdout=out)
+        assert 'images/00000002.jpg: Not a readable image' in out.getvalue()
+
+    @override_settings(INGEST_VALIDATE_BUNDLES=True)
+    def test_ingest_task(self):
+        """ It should check the bundle first in the ingest task and stop before making a manifest. """
+        broken = Local(image_server=ImageServerFactory(), report=IngestReport.objects.create())
+        broken.bundle = SimpleUploadedFile(name='broken.zip', content=open(self.bad_bundle, 'rb').read())
+        broken.save()
+
+        with pytest.raises(InvalidBundle):
+            local_ingest_task_ecds(broken.pk)
+
+        validation = IngestReport.objects.get(pk=broken.report_id).validation
+        assert not validation['valid']
+        assert len(validation['problems']) == 3
+        assert not Manifest.objects.exists()
+
+        with mock_s3():
+            boto3.resource('s3', region_name='us-east-1').create_bucket(Bucket=settings.INGEST_TRIGGER_BUCKET)
+            local = Local(image_server=ImageServerFactory())
+            local.bundle = SimpleUploadedFile(name='csv_meta.zip', content=open(self.good_bundle, 'rb').read())
+            local.save()
+            local_ingest_task_ecds(local.pk)
+
+        assert IngestReport.objects.get(manifest__pid='sqn75').validation['valid']